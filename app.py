@@ -1,21 +1,137 @@
 import os
 import uuid
 import json
+import gzip
 
-from flask import Flask, render_template, request, redirect, session, jsonify
+from flask import Flask, render_template, request, redirect, session, jsonify, Response
 from aws_s3 import generate_bdd_from_jira, generate_bdd_scenario, generate_test_data, upload_file_to_s3
-from jira import get_issues, get_sprintid, get_boardid, get_issues_bug
-from performancecomapre import compare_json
+from jira import get_issues, get_sprintid, get_boardid, get_issues_bug, invalidate_jira_cache, verify_credentials
+from performancecomapre import (compare_tables, report_comparison, comparison_payload, COMPARE_METRICS,
+                                PERFORMANCE_REPORT_FORMAT, REPORT_CONTENT_TYPES)
 from summarize_new import summarize_and_store_locally
-from embedGenerate import handle_start_embedding_button_click, handle_defect_detection_button_click
+from embedGenerate import (handle_start_embedding_button_click, handle_defect_detection_button_click,
+                           read_vectorstore_version, VECTORSTORE_DIR)
+from jira_export import export_active_sprints
+from jobs import register_task, submit_job, get_job
+from llm_cache import cache_stats
+from table_store import file_type_of
+from dataset_registry import file_digest, register_dataset, get_dataset, latest_dataset, derived_dataset
+import dataset_registry
+import run_history
+import resources
 
 app = Flask(__name__)
+resources.warm()
+dataset_registry.scan_folder()
 app.secret_key = os.urandom(24)
 
 UPLOAD_FOLDER = './static/uploads'
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
 
+def resolve_dataset(dataset_id, kinds):
+    """The named dataset, or the latest one of the given kinds when no id is given."""
+    if dataset_id:
+        return get_dataset(dataset_id)
+    return latest_dataset(kinds)
+
+
+def current_dataset(dataset):
+    """Re-register a dataset whose file changed in place, so its hash matches the contents.
+
+    The new entry keeps the parent of the old one, so a regenerated summary still
+    points at the export it was built from.
+    """
+    content_hash = file_digest(dataset["path"])
+    if content_hash == dataset["content_hash"]:
+        return dataset
+    return get_dataset(register_dataset(dataset["kind"], dataset["path"], parent_id=dataset["parent_id"],
+                                        content_hash=content_hash))
+
+
+def use_cache_requested():
+    """Operators can bypass the LLM response cache by sending no_cache=true."""
+    return request.values.get('no_cache', '').lower() not in ('1', 'true', 'yes', 'on')
+
+
+def bdd_jira_task(jira_url, email, password, board_id, sprint_id, progress=None, use_cache=True):
+    user_story = get_issues(jira_url=jira_url, email=email, password=password,
+                            board_id=board_id, sprint_id=sprint_id)
+    if len(user_story) == 0:
+        raise ValueError("No active user stories found")
+    return generate_bdd_from_jira(user_story, progress=progress, use_cache=use_cache)
+
+
+def summarization_task(dataset_id=None, progress=None, use_cache=True):
+    dataset = resolve_dataset(dataset_id, dataset_registry.RAW_KINDS)
+    if dataset is None:
+        raise ValueError("No files found for summarization")
+    dataset = current_dataset(dataset)
+    # The same input summarized before is not sent to the LLM again
+    summarized = derived_dataset(dataset["content_hash"], dataset_registry.SUMMARIZED) if use_cache else None
+    if summarized is not None:
+        print(f"Dataset {dataset['dataset_id']} already summarized as {summarized['dataset_id']}")
+        return summarized["path"]
+    # Determine the file type based on the file extension
+    file_type = file_type_of(dataset["path"])
+    print((f"Summarization process started for file: {dataset['path']}"))
+    url = summarize_and_store_locally(dataset["path"], file_type, progress=progress, use_cache=use_cache)
+    if url is not None:
+        register_dataset(dataset_registry.SUMMARIZED, url, parent_id=dataset["dataset_id"])
+    print("Summarization Completed")
+    return url
+
+
+def embedding_task(dataset_id=None, progress=None):
+    dataset = resolve_dataset(dataset_id, (dataset_registry.SUMMARIZED,))
+    if dataset is None:
+        raise ValueError("No files found for embedding")
+    dataset = current_dataset(dataset)
+    embedded = latest_dataset((dataset_registry.EMBEDDED,))
+    if embedded is not None and embedded["content_hash"] == dataset["content_hash"] and read_vectorstore_version():
+        print(f"Dataset {dataset['dataset_id']} is already the embedded one")
+        return dataset["path"]
+    print((f"Embedding process started for file: {dataset['path']}"))
+    url = handle_start_embedding_button_click(dataset["path"])
+    if url is not None:
+        register_dataset(dataset_registry.EMBEDDED, VECTORSTORE_DIR, parent_id=dataset["dataset_id"],
+                         content_hash=dataset["content_hash"], rows=dataset["rows"])
+    return url
+
+
+def jira_export_task(jira_url, email, password, progress=None):
+    output_file_path = export_active_sprints(jira_url, email, password, progress=progress)
+    register_dataset(dataset_registry.JIRA_EXPORT, output_file_path)
+    return output_file_path
+
+
+def generate_test_task(lob, state, test_cases, progress=None, use_cache=True):
+    return generate_test_data(lob, state, test_cases, progress=progress, use_cache=use_cache)
+
+
+def defect_task(issues, progress=None, use_cache=True):
+    return handle_defect_detection_button_click(issue=issues, progress=progress, use_cache=use_cache)
+
+
+def performance_report_task(run_id1, run_id2, report_format=PERFORMANCE_REPORT_FORMAT, progress=None):
+    # Both runs are already in the history, so the job only renders and uploads
+    return report_comparison(run_history.compare_runs(run_id1, run_id2), COMPARE_METRICS, report_format)
+
+
+register_task("generate_bdd", generate_bdd_scenario)
+register_task("generate_bdd_jira", bdd_jira_task)
+register_task("generate_test", generate_test_task)
+register_task("summarization", summarization_task)
+register_task("embedding", embedding_task)
+register_task("generate_defect", defect_task)
+register_task("jira_export", jira_export_task)
+register_task("performance_report", performance_report_task)
+
+
+def job_queued(job_id):
+    return render_template('index.html', status=f"Job {job_id} queued", job_id=job_id)
+
+
 @app.route("/")
 def home():
     return render_template('index.html')
@@ -42,10 +158,38 @@ def upload_bdd():
 @app.route("/generate-bdd")
 def generate_bdd():
     username = session['username']
-    url = generate_bdd_scenario(username)
-    if url is None:
-        return render_template('index.html', status="Failed to generate BDD scenario")
-    return render_template('index.html', status="Bdd generated successfully", response=url)
+    job_id = submit_job("generate_bdd", username=username, use_cache=use_cache_requested())
+    return job_queued(job_id)
+
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify(error="Job not found"), 404
+    return jsonify(job)
+
+
+@app.route("/resources")
+def resource_stats():
+    return jsonify(resources.stats())
+
+
+@app.route("/cache_stats")
+def llm_cache_stats():
+    return jsonify(cache_stats())
+
+
+@app.route("/datasets")
+def dataset_list():
+    kinds = request.args.getlist('kind') or None
+    return jsonify(dataset_registry.list_datasets(kinds))
+
+
+@app.route("/datasets/scan", methods=["POST"])
+def dataset_scan():
+    """Register files copied into upload/ by hand."""
+    return jsonify(dataset_ids=dataset_registry.scan_folder())
 
 
 @app.route("/get_bdd_jira_boardid", methods=['POST'])
@@ -100,6 +244,27 @@ def get_bdd_jira_issue_bug():
         return jsonify(error=str(e))
 
 
+@app.route("/jira_cache/invalidate", methods=['POST'])
+def jira_cache_invalidate():
+    """Drop the caller's cached lookups; board_id and sprint_id narrow it down."""
+    jira_url = request.form.get('jira_url')
+    email = request.form.get('email')
+    password = request.form.get('password')
+    # The same credentials the lookup routes send to Jira, checked against it
+    if not verify_credentials(jira_url, email, password):
+        return jsonify(error="Jira rejected the credentials"), 401
+    invalidate_jira_cache(jira_url=jira_url, email=email, password=password,
+                          board_id=request.form.get('board_id') or None, sprint_id=request.form.get('sprint_id') or None)
+    return jsonify(status="invalidated")
+
+
+@app.route("/jira_export", methods=['POST'])
+def jira_export():
+    job_id = submit_job("jira_export", jira_url=request.form.get('jira_url'), email=request.form.get('email'),
+                        password=request.form.get('password'))
+    return job_queued(job_id)
+
+
 @app.route("/generate_bdd_jira", methods=['POST'])
 def generate_bdd_jira():
     try:
@@ -108,14 +273,9 @@ def generate_bdd_jira():
         password = request.form.get('password')
         board_id = request.form.get('board_id')
         sprint_id = request.form.get('sprint_id')
-        user_story = get_issues(jira_url=jira_url, email=email, password=password,
-                                board_id=board_id, sprint_id=sprint_id)
-        if len(user_story) == 0:
-            return render_template('index.html', status="No active user stories found")
-        url = generate_bdd_from_jira(user_story)
-        if url is None:
-            return render_template('index.html', status="Failed to generate BDD scenario")
-        return render_template('index.html', status="Bdd generated successfully", response=url)
+        job_id = submit_job("generate_bdd_jira", jira_url=jira_url, email=email, password=password,
+                            board_id=board_id, sprint_id=sprint_id, use_cache=use_cache_requested())
+        return job_queued(job_id)
     except:
         return render_template('index.html', status="Provide correct details")
     
@@ -142,10 +302,8 @@ def generate_defect_detection():
             print(issues)
         
         # Pass the cleaned issues to the function
-        url = handle_defect_detection_button_click(issue=issues)
-        if url is None:
-            return render_template('index.html', status="Failed to generate test data")
-        return render_template('index.html', status="Test data generated successfully", response=url)
+        job_id = submit_job("generate_defect", issues=issues, use_cache=use_cache_requested())
+        return job_queued(job_id)
 
     except Exception as e:
         print(f"An error occurred: {e}")
@@ -205,34 +363,20 @@ def generate_test():
     lob = request.form.get('lob')
     state = request.form.get('state')
     test_cases = request.form.get('test_cases')
-    url = generate_test_data(lob, state, test_cases)
-    if url is None:
-        return render_template('index.html', status="Failed to generate test data")
-    return render_template('index.html', status="Test data generated successfully", response=url)
+    job_id = submit_job("generate_test", lob=lob, state=state, test_cases=test_cases,
+                        use_cache=use_cache_requested())
+    return job_queued(job_id)
 
 
 # Trigger summarization and store in upload
 @app.route("/trigger_summarization", methods=["POST"])
 def trigger_summarization():
-    upload_folder = "./upload"
     try:
-        # Get all files in the upload directory
-        files = [os.path.join(upload_folder, f) for f in os.listdir(upload_folder)]
-        
-        if len(files) == 0:
-            return render_template('index.html', status="No files found for embedding")
-        
-        # Get the file with the latest creation time
-        latest_file = max(files, key=os.path.getctime)
-        # Determine the file type based on the file extension
-        file_type = os.path.splitext(latest_file)[1].lower().replace('.', '')
-        
-        # Call the embedding function with the latest file
-        print((f"Summarization process started for file: {latest_file}"))
-        url = summarize_and_store_locally(latest_file,file_type)
-        print("Summarization Completed")
-        # Return a success message after completion
-        return render_template('index.html', status="Summarization completed successfully", url=url)
+        dataset_id = request.form.get('dataset_id') or None
+        if resolve_dataset(dataset_id, dataset_registry.RAW_KINDS) is None:
+            return render_template('index.html', status="No files found for summarization")
+        job_id = submit_job("summarization", dataset_id=dataset_id, use_cache=use_cache_requested())
+        return job_queued(job_id)
     except Exception as e:
         print(f"Error: {e}")
         return render_template('index.html', status="Error while processing the file")
@@ -240,40 +384,113 @@ def trigger_summarization():
 
 @app.route("/trigger_embedding", methods=["POST"])
 def triggerEmbedding():
-    upload_folder = "./upload"
     try:
-        # Get all files in the upload directory
-        files = [os.path.join(upload_folder, f) for f in os.listdir(upload_folder)]
-        
-        if len(files) == 0:
+        dataset_id = request.form.get('dataset_id') or None
+        if resolve_dataset(dataset_id, (dataset_registry.SUMMARIZED,)) is None:
             return render_template('index.html', status="No files found for embedding")
-        
-        # Get the file with the latest creation time
-        latest_file = max(files, key=os.path.getctime)
-        
-        # Call the embedding function with the latest file
-        print((f"Embedding process started for file: {latest_file}"))
-        url = handle_start_embedding_button_click(latest_file)
-        
-        return render_template('index.html',status="Embedding completed successfully")
+        job_id = submit_job("embedding", dataset_id=dataset_id)
+        return job_queued(job_id)
     
     except Exception as e:
         print(f"Error: {e}")
         return render_template('index.html', status="Error while processing the file")
 
+def gzip_requested():
+    """Clients opt in to compressed JSON by sending gzip=true."""
+    return request.values.get('gzip', '').lower() in ('1', 'true', 'yes', 'on')
+
+
+def json_response(payload, status=200):
+    """JSON response, gzip-compressed when the client sends gzip=true."""
+    body = json.dumps(payload).encode("utf-8")
+    if not gzip_requested():
+        return Response(body, status=status, mimetype="application/json")
+    response = Response(gzip.compress(body, compresslevel=5), status=status, mimetype="application/json")
+    response.headers["Content-Encoding"] = "gzip"
+    return response
+
+
+def comparison_response(comparison, run_id1, run_id2):
+    """Deltas and verdict of a comparison; report=xlsx|csv|json also queues the rendered report."""
+    payload = comparison_payload(comparison, COMPARE_METRICS, request.values.getlist('verdict') or None)
+    payload.update(run_id1=run_id1, run_id2=run_id2)
+    report_format = request.values.get('report')
+    if report_format:
+        if report_format not in REPORT_CONTENT_TYPES:
+            return json_response({"error": f"Unsupported report format: {report_format}"}, 400)
+        payload["report_job_id"] = submit_job("performance_report", run_id1=run_id1, run_id2=run_id2,
+                                              report_format=report_format)
+    return json_response(payload)
+
+
 @app.route("/compare_performance", methods=['POST'])
 def compare_performance():
     file1 = request.files['json_file1']
     file2 = request.files['json_file2']
-    # Read the files and load them as JSON
-    json1 = json.load(file1)
-    json2 = json.load(file2)
     print(file1,file2)
-    metrics_to_compare = ["minResponseTime", "maxResponseTime", "meanResponseTime",
-                          "percentiles1", "percentiles2", "percentiles3", "percentiles4",
-                          "standardDeviation"]
-    url=compare_json(json1, json2, metrics_to_compare)
-    return render_template('index.html', status="Test data generated successfully",response=url)
+    # Each stats.json or simulation.log is streamed into a flattened table and
+    # recorded in the history, so later trend queries can use both runs
+    run_id1, _ = run_history.ingest_file(file1.stream, file1.filename)
+    run_id2, _ = run_history.ingest_file(file2.stream, file2.filename)
+    job_id = submit_job("performance_report", run_id1=run_id1, run_id2=run_id2)
+    return job_queued(job_id)
+
+
+@app.route("/api/compare_performance", methods=['POST'])
+def api_compare_performance():
+    """Compare two uploaded runs (json_file1, json_file2) and return the deltas as JSON.
+
+    verdict=warn&verdict=fail limits the transactions listed; the report is
+    only rendered and uploaded, in the background, when report is given.
+    """
+    file1 = request.files['json_file1']
+    file2 = request.files['json_file2']
+    run_id1, table1 = run_history.ingest_file(file1.stream, file1.filename)
+    run_id2, table2 = run_history.ingest_file(file2.stream, file2.filename)
+    return comparison_response(compare_tables(table1, table2), run_id1, run_id2)
+
+
+@app.route("/performance/runs", methods=['GET', 'POST'])
+def performance_runs():
+    """List recorded runs, or record an uploaded stats.json or simulation.log (form field stats_file)."""
+    if request.method == 'POST':
+        stats_file = request.files['stats_file']
+        started = request.form.get('started')
+        run_id, table = run_history.ingest_file(stats_file.stream, stats_file.filename,
+                                                label=request.form.get('label'),
+                                                started=float(started) if started else None)
+        return jsonify(run_id=run_id, transactions=len(table))
+    return jsonify(run_history.list_runs(request.args.get('limit', 100, type=int)))
+
+
+@app.route("/performance/compare/<run_id1>/<run_id2>")
+def performance_compare_runs(run_id1, run_id2):
+    try:
+        comparison = run_history.compare_runs(run_id1, run_id2)
+    except ValueError as e:
+        return jsonify(error=str(e)), 404
+    return comparison_response(comparison, run_id1, run_id2)
+
+
+@app.route("/performance/trend")
+def performance_trend():
+    """Per-transaction values of one metric across the recorded runs, oldest first."""
+    metric = request.args.get('metric', 'percentiles3')
+    matrix = run_history.metric_history(metric, request.args.get('side', 'ok'),
+                                        request.args.get('limit', type=int), request.args.getlist('key') or None)
+    matrix = matrix.astype(object).where(matrix.notna(), None)
+    return jsonify(metric=metric, runs=list(matrix.index), transactions=matrix.to_dict(orient="list"))
+
+
+@app.route("/performance/regressions")
+def performance_regressions():
+    """Transactions that regressed against the rolling baseline of the runs before them."""
+    metric = request.args.get('metric', 'percentiles3')
+    result = run_history.regressions(metric, request.args.get('side', 'ok'), request.args.get('limit', type=int))
+    if request.args.get('all', '').lower() not in ('1', 'true', 'yes'):
+        result = result[result["regression"]]
+    result = result.astype(object).where(result.notna(), None)
+    return jsonify(metric=metric, regressions=result.to_dict(orient="records"))
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", debug=True)
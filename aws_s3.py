@@ -1,11 +1,18 @@
-import io
 import os
+import csv
+import json
+import hashlib
+import tempfile
+import itertools
 import boto3
-import pandas as pd
 from openpyxl import load_workbook
 import google.generativeai as genai
 from dotenv import load_dotenv
 import time
+from llm_dispatcher import dispatch, progress_reporter
+from llm_cache import cached_send
+from lob_cache import get_lob_reference
+from output_writer import open_output_writer, checkpoint_id_for, csv_line
 
 load_dotenv()
 
@@ -18,6 +25,10 @@ AWS_SECRET_ACCESS_KEY = os.getenv("aws_secret_access_key")
 # AWS_SESSION_TOKEN = os.getenv("AWS_SESSION_TOKEN")
 AWS_LOB_FILES = os.getenv("aws_lob_files")
 AWS_TEST_OUTPUT_BUCKET = os.getenv("aws_test_output_bucket")
+# Chunk size used when copying S3 bodies, and size above which spooled files go to disk
+S3_STREAM_CHUNK_SIZE = 1024 * 1024
+TEST_DATA_ROWS_PER_ROUND = 10
+TEST_DATA_MAX_CONCURRENCY = int(os.getenv("test_data_max_concurrency", "4"))
 
 genai.configure(api_key=API_KEY)
 generation_config = {
@@ -67,94 +78,203 @@ def upload_file_to_s3(username):
         return False
 
 
-def generate_bdd_from_jira(user_story):
-    responses = []
-    for story in user_story:
-        convo = model.start_chat()
-        convo.send_message("Generate BDD scenario in feature file format for the  user story " + story)
-        response = convo.last.text
-        responses.append([story, response])
-    df1 = pd.DataFrame(responses)
-    with io.StringIO() as csv_buffer:
-        df1.to_csv(csv_buffer, index=False)
-        ts = str(int(round(time.time())))
-        response = s3_client.put_object(
-            Bucket=AWS_BDD_OUTPUT_BUCKET, Key=f"output_{ts}.csv", Body=csv_buffer.getvalue()
-        )
-        status = response.get("ResponseMetadata", {}).get("HTTPStatusCode")
-        url = f"https://{AWS_BDD_OUTPUT_BUCKET}.s3.amazonaws.com/output_{ts}.csv"
-        if status == 200:
-            return url
-        else:
-            return None
-
-
-def generate_bdd_scenario(username):
-    s3_client_data = s3_client.get_object(Bucket=AWS_BDD_INPUT_BUCKET, Key=f'{username}_input.xlsx')
-    contents = s3_client_data['Body'].read()  # your Excel's essence, pretty much a stream
+def spool_s3_body(body):
+    """Copy an S3 streaming body into a temporary file chunk by chunk.
+
+    xlsx files are zip archives and need random access, so they cannot be parsed
+    straight off the socket; spooling keeps memory flat for large workbooks.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=S3_STREAM_CHUNK_SIZE)
+    for chunk in iter(lambda: body.read(S3_STREAM_CHUNK_SIZE), b""):
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+
+def iter_xlsx_stories(spool):
+    """Yield first-column values below the header row of a spooled workbook, using openpyxl read-only mode."""
+    spool.seek(0)
     # Read in data_only mode to parse Excel after all formulae evaluated
-    wb = load_workbook(filename=(io.BytesIO(contents)), data_only=True)
-    sheet = wb.active
-    responses = []
-    for row in range(2, sheet.max_row + 1):
-        # for row in range(1, sheet.max_row+1):
-        prompt = sheet.cell(row, 1).value
-        # Generate response
-        convo = model.start_chat()
-        convo.send_message("Generate BDD scenario in feature file format for the  user story " + prompt)
-        response = convo.last.text
-        # Save response
-        responses.append(response)
-        # print(prompt)
-        # response = prompt
-        # responses.append(response)
-    df1 = pd.DataFrame(responses)
-    with io.StringIO() as csv_buffer:
-        df1.to_csv(csv_buffer, index=False)
-        ts = str(int(round(time.time())))
-        response = s3_client.put_object(
-            Bucket=AWS_BDD_OUTPUT_BUCKET, Key=f"output_{ts}.csv", Body=csv_buffer.getvalue()
-        )
-        status = response.get("ResponseMetadata", {}).get("HTTPStatusCode")
-        s3 = boto3.resource('s3')
-        s3.Object(AWS_ARCHIVE_BUCKET, f'{username}_input_{ts}.xlsx').copy_from(
-            CopySource=f'{AWS_BDD_INPUT_BUCKET}/{username}_input.xlsx')
-        s3.Object(AWS_BDD_INPUT_BUCKET, f'{username}_input.xlsx').delete()
-        url = f"https://{AWS_BDD_OUTPUT_BUCKET}.s3.amazonaws.com/output_{ts}.csv"
-        if status == 200:
-            return url
-        else:
-            return None
-
-
-def generate_test_data(lob, state, no_of_test_cases):
-    s3_client_data = s3_client.get_object(Bucket=AWS_LOB_FILES, Key=f'{lob}.txt')
-    contents = s3_client_data['Body'].read()  # Reading the txt file
-    responses = []
-    round_of_test_data = int(no_of_test_cases) // 10
-    for test_cases_no in range(round_of_test_data + 1):
-        # Generate response
-        prompt = (f"Generate 10 test data for a {lob} policy according to the following criteria:\n"
-                  f"include state {state} and {lob} for the line of business  using the following data\n"
-                  + contents.decode('utf-8') + "\n in a csv format only.")
-        # print(prompt)
-        convo = model.start_chat()
-        convo.send_message(prompt)
-        response = convo.last.text
-        # Save response
-        if test_cases_no == 0:
-            responses.append(response)
-        else:
-            response = "\n".join(response.split("\n")[1:])
-            responses.append(response)
-        # responses_bytes += response.encode('utf-8')
-    responses_bytes = ("\n".join([response for response in responses])).encode('utf-8')
+    wb = load_workbook(filename=spool, read_only=True, data_only=True)
+    try:
+        for (value,) in wb.active.iter_rows(min_row=2, max_col=1, values_only=True):
+            if value is not None and str(value).strip():
+                yield str(value)
+    finally:
+        wb.close()
+
+
+def xlsx_row_count(spool):
+    """Rows below the header according to the sheet's stored dimension, or None if it has none.
+
+    Only the dimension is read, not the rows; blank rows are counted too.
+    """
+    spool.seek(0)
+    wb = load_workbook(filename=spool, read_only=True)
+    try:
+        max_row = wb.active.max_row
+    finally:
+        wb.close()
+    return max(max_row - 1, 0) if max_row else None
+
+
+def bdd_prompt(story):
+    return "Generate BDD scenario in feature file format for the  user story " + story
+
+
+def generate_bdd_from_jira(user_story, progress=None, use_cache=True):
+    ts = str(int(round(time.time())))
+    # Rows go to S3 as they complete; re-running the same stories resumes from the checkpoint
+    writer = open_output_writer(s3_client, AWS_BDD_OUTPUT_BUCKET, f"output_{ts}.csv",
+                                checkpoint_id=checkpoint_id_for("bdd_jira", user_story), header=csv_line([0, 1]))
+    offset = writer.next_row
+    report = progress_reporter(progress, len(user_story), done=offset)
+
+    def on_result(index, response):
+        writer.write(offset + index, csv_line([user_story[offset + index], response]))
+        if report is not None:
+            report(index, response)
+
+    dispatch([bdd_prompt(story) for story in user_story[offset:]],
+             lambda prompt: cached_send(model, prompt, use_cache), on_result=on_result, collect=False)
+    status = writer.close()
+    url = f"https://{AWS_BDD_OUTPUT_BUCKET}.s3.amazonaws.com/{writer.key}"
+    if status == 200:
+        return url
+    else:
+        return None
+
+
+def generate_bdd_scenario(username, progress=None, use_cache=True):
+    input_key = f'{username}_input.xlsx'
+    s3_client_data = s3_client.get_object(Bucket=AWS_BDD_INPUT_BUCKET, Key=input_key)
     ts = str(int(round(time.time())))
-    response = s3_client.put_object(
-        Bucket=AWS_TEST_OUTPUT_BUCKET, Key=f"{lob}_{ts}.csv", Body=responses_bytes
-    )
-    status = response.get("ResponseMetadata", {}).get("HTTPStatusCode")
-    url = f"https://{AWS_TEST_OUTPUT_BUCKET}.s3.amazonaws.com/{lob}_{ts}.csv"
+    writer = open_output_writer(s3_client, AWS_BDD_OUTPUT_BUCKET, f"output_{ts}.csv",
+                                checkpoint_id=checkpoint_id_for("bdd", username, s3_client_data.get('ETag')),
+                                header=csv_line([0]))
+    offset = writer.next_row
+
+    with spool_s3_body(s3_client_data['Body']) as spool:
+        # Progress starts against the sheet's stored size so generation does not wait for
+        # a counting pass; it includes blank rows, so the exact total is reported at the end
+        total = xlsx_row_count(spool)
+        report = progress_reporter(progress, total, done=offset)
+        done = offset
+
+        def on_result(index, response):
+            nonlocal done
+            writer.write(offset + index, csv_line([response]))
+            done += 1
+            if report is not None:
+                report(index, response)
+
+        # Prompts are produced lazily and responses written in the original row order
+        stories = itertools.islice(iter_xlsx_stories(spool), offset, None)
+        dispatch((bdd_prompt(story) for story in stories), lambda prompt: cached_send(model, prompt, use_cache),
+                 on_result=on_result, collect=False)
+    if progress is not None and done != total:
+        progress(done, done)
+    status = writer.close()
+    s3 = boto3.resource('s3')
+    s3.Object(AWS_ARCHIVE_BUCKET, f'{username}_input_{ts}.xlsx').copy_from(
+        CopySource=f'{AWS_BDD_INPUT_BUCKET}/{username}_input.xlsx')
+    s3.Object(AWS_BDD_INPUT_BUCKET, f'{username}_input.xlsx').delete()
+    url = f"https://{AWS_BDD_OUTPUT_BUCKET}.s3.amazonaws.com/{writer.key}"
+    if status == 200:
+        return url
+    else:
+        return None
+
+
+def parse_csv_response(text):
+    """Rows of a CSV answer from the model, ignoring markdown code fences and blank lines."""
+    lines = [line for line in text.strip().splitlines()
+             if line.strip() and not line.strip().startswith("```")]
+    return [[cell.strip() for cell in row] for row in csv.reader(lines)]
+
+
+def row_hash(row):
+    return hashlib.sha256(json.dumps(row).encode("utf-8")).hexdigest()[:16]
+
+
+def generate_test_data(lob, state, no_of_test_cases, progress=None, use_cache=True):
+    # Cached per worker and revalidated by ETag, compacted if it would not fit the prompt
+    reference = get_lob_reference(s3_client, AWS_LOB_FILES, lob)
+    target = int(no_of_test_cases)
+    prompt = (f"Generate {TEST_DATA_ROWS_PER_ROUND} test data for a {lob} policy according to the following criteria:\n"
+              f"include state {state} and {lob} for the line of business  using the following data\n"
+              + reference.prompt_text + "\n in a csv format only.")
+    ts = str(int(round(time.time())))
+    # Row 0 of the output is the header, data rows follow from row 1
+    writer = open_output_writer(s3_client, AWS_TEST_OUTPUT_BUCKET, f"{lob}_{ts}.csv",
+                                checkpoint_id=checkpoint_id_for("test_data", lob, state, no_of_test_cases,
+                                                                reference.etag))
+    next_row = max(writer.next_row, 1)
+    # The header and the last round accepted are checkpointed with the rows, and a hash of
+    # every row written goes to the writer's journal, so a resumed run neither writes a row
+    # twice nor replays cached rounds
+    resume = writer.extra
+    seen = set(writer.journal)
+
+    # Every round sends the same prompt, so the round number keeps cached answers distinct
+    def generate_round(round_no):
+        return cached_send(model, prompt, use_cache, variant=round_no)
+
+    def accept(rows, round_no):
+        nonlocal next_row
+        resume["round"] = max(resume.get("round", 0), round_no)
+        dropped = 0
+        for row in rows:
+            if next_row > target:
+                break
+            if [cell.lower() for cell in row] == normalized_header:
+                continue
+            if len(row) != len(header):
+                dropped += 1
+                continue
+            key = row_hash(row)
+            if key in seen:
+                continue
+            seen.add(key)
+            writer.record(key)
+            writer.write(next_row, csv_line(row))
+            next_row += 1
+        if dropped:
+            print(f"Dropped {dropped} malformed test data rows")
+        if progress is not None:
+            progress(next_row - 1, target)
+
+    if "header" in resume:
+        header = resume["header"]
+        normalized_header = [column.lower() for column in header]
+        print(f"Resuming test data from row {next_row} after round {resume.get('round', 0)}")
+    else:
+        # The first round fixes the header every later round is validated against
+        first_round = parse_csv_response(generate_round(0))
+        if not first_round:
+            raise ValueError("The model returned no CSV for the first round of test data")
+        header = resume["header"] = first_round[0]
+        normalized_header = [column.lower() for column in header]
+        writer.write(0, csv_line(header))
+        accept(first_round[1:], 0)
+
+    # Malformed or duplicate rows are made up by extra rounds, up to a bound
+    max_rounds = 3 * (target // TEST_DATA_ROWS_PER_ROUND + 1)
+    first = resume.get("round", 0) + 1
+
+    def remaining_rounds():
+        for round_no in range(first, first + max_rounds - 1):
+            # Stop scheduling as soon as the requested count is reached
+            if next_row > target:
+                return
+            yield round_no
+
+    dispatch(remaining_rounds(), generate_round, max_concurrency=TEST_DATA_MAX_CONCURRENCY,
+             on_result=lambda index, response: accept(parse_csv_response(response), first + index), collect=False)
+    if next_row <= target:
+        print(f"Generated {next_row - 1} of {target} test data rows after {max_rounds} rounds")
+    status = writer.close()
+    url = f"https://{AWS_TEST_OUTPUT_BUCKET}.s3.amazonaws.com/{writer.key}"
     if status == 200:
         return url
     else:
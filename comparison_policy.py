@@ -0,0 +1,134 @@
+import os
+import json
+import threading
+from statistics import NormalDist
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Optional JSON file overriding DEFAULT_POLICY, per metric and per transaction (key or name), e.g.
+# {"default": {...}, "metrics": {"percentiles4": {...}},
+#  "transactions": {"login": {"*": {...}, "percentiles3": {...}}}}
+COMPARISON_POLICY_PATH = os.getenv("comparison_policy_path")
+
+DEFAULT_POLICY = {
+    # Regressions above warn_pct percent warn, above fail_pct fail
+    "warn_pct": 5.0,
+    "fail_pct": 20.0,
+    # Absolute changes below this many milliseconds are noise; this also decides zero baselines
+    "min_delta": 5.0,
+    # Confidence level of the test on mean response times
+    "confidence": 0.95,
+}
+VERDICT_ORDER = ["pass", "warn", "fail"]
+# Nodes only in the first run lost a transaction; nodes only in the second are new
+STATUS_VERDICTS = {"both": "pass", "missing": "warn", "new": "pass"}
+
+_policy = None
+_policy_lock = threading.Lock()
+
+
+def load_policy(path=None):
+    """The comparison policy, read once from comparison_policy_path when it is set."""
+    global _policy
+    path = path or COMPARISON_POLICY_PATH
+    with _policy_lock:
+        if _policy is None or path != _policy.get("path"):
+            policy = {}
+            if path:
+                with open(path) as f:
+                    policy = json.load(f)
+            _policy = {
+                "path": path,
+                "default": dict(DEFAULT_POLICY, **policy.get("default", {})),
+                "metrics": policy.get("metrics", {}),
+                "transactions": policy.get("transactions", {}),
+            }
+        return _policy
+
+
+def thresholds(policy, comparison, metric):
+    """Per-row warn_pct, fail_pct and min_delta for metric, with transaction overrides applied."""
+    base = dict(policy["default"], **policy["metrics"].get(metric, {}))
+    columns = {name: np.full(len(comparison), float(base[name])) for name in ("warn_pct", "fail_pct", "min_delta")}
+    for transaction, overrides in policy["transactions"].items():
+        settings = dict(overrides.get("*", {}), **overrides.get(metric, {}))
+        if not settings:
+            continue
+        rows = (comparison.index == transaction) | (comparison["name"] == transaction).to_numpy()
+        for name, value in settings.items():
+            if name in columns:
+                columns[name][rows] = float(value)
+    return columns
+
+
+def mean_difference_significant(comparison, confidence):
+    """Welch test of the mean response time change from standardDeviation and request counts.
+
+    Rows without the numbers to test count as significant, leaving the decision to the tolerance bands.
+    """
+    delta = comparison["meanResponseTime_ok_delta"]
+    variance = (comparison["standardDeviation_ok_1"] ** 2 / comparison["numberOfRequests_ok_1"]
+                + comparison["standardDeviation_ok_2"] ** 2 / comparison["numberOfRequests_ok_2"])
+    margin = NormalDist().inv_cdf((1 + confidence) / 2) * np.sqrt(variance)
+    return (delta.abs() > margin) | margin.isna()
+
+
+def apply_policy(comparison, metrics, policy=None):
+    """Add direction and pass/warn/fail verdict columns to a compare_stats table.
+
+    For every metric, {metric}_direction is "faster", "slower" or "same" (the
+    change is within the tolerance band or not significant) and
+    {metric}_verdict grades regressions; "verdict" is the worst verdict of the
+    row and "weight" its request count in the second run.
+    """
+    policy = policy or load_policy()
+    comparison = comparison.copy()
+    both = (comparison["status"] == "both").to_numpy()
+    row_verdicts = comparison["status"].map(STATUS_VERDICTS).fillna("pass").map(VERDICT_ORDER.index).to_numpy()
+    testable = all(f"{metric}_ok_{run}" in comparison.columns
+                   for metric in ("standardDeviation", "numberOfRequests") for run in (1, 2))
+    for metric in metrics:
+        limits = thresholds(policy, comparison, metric)
+        delta = comparison[f"{metric}_ok_delta"]
+        # At a zero baseline the percent change is undefined; any change beyond min_delta is out of band
+        pct = comparison[f"{metric}_ok_pct"].where(comparison[f"{metric}_ok_1"] != 0, np.sign(delta) * np.inf)
+        moved = (delta.abs() >= limits["min_delta"]) & (pct.abs() > limits["warn_pct"])
+        if metric == "meanResponseTime" and testable:
+            moved &= mean_difference_significant(comparison, policy["default"]["confidence"])
+        moved = moved.to_numpy() & both
+        direction = np.where(moved, np.where(delta > 0, "slower", "faster"), "same")
+        verdict = np.where(direction == "slower", np.where(pct > limits["fail_pct"], "fail", "warn"), "pass")
+        comparison[f"{metric}_direction"] = direction
+        comparison[f"{metric}_verdict"] = verdict
+        row_verdicts = np.maximum(row_verdicts, pd.Series(verdict).map(VERDICT_ORDER.index).to_numpy())
+    comparison["verdict"] = np.array(VERDICT_ORDER)[row_verdicts]
+    if "numberOfRequests_ok_2" in comparison.columns:
+        comparison["weight"] = comparison["numberOfRequests_ok_2"].fillna(comparison["numberOfRequests_ok_1"])
+    return comparison
+
+
+def weighted_change(comparison, metric):
+    """Request-weighted mean percent change of metric over the requests present in both runs.
+
+    Groups and the global row aggregate their requests, so only request rows
+    are weighted when the table has any.
+    """
+    rows = comparison[comparison["status"] == "both"]
+    if (rows["type"] == "REQUEST").any():
+        rows = rows[rows["type"] == "REQUEST"]
+    pct = rows[f"{metric}_ok_pct"]
+    weight = rows["weight"] if "weight" in rows.columns else pd.Series(1.0, index=rows.index)
+    usable = pct.notna() & weight.notna() & (weight > 0)
+    if not usable.any():
+        return None
+    return round(float(np.average(pct[usable], weights=weight[usable])), 2)
+
+
+def overall_verdict(comparison):
+    """Worst verdict of any row, the pass/warn/fail gate for a whole comparison."""
+    if "verdict" not in comparison.columns or comparison.empty:
+        return "pass"
+    return VERDICT_ORDER[int(comparison["verdict"].map(VERDICT_ORDER.index).max())]
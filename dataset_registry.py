@@ -0,0 +1,139 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from contextlib import closing
+from dotenv import load_dotenv
+from table_store import table_rows
+
+load_dotenv()
+
+DATASET_DB_PATH = os.getenv("dataset_db_path", "./datasets.db")
+
+# Kinds of artifact recorded in the catalog
+UPLOADED = "uploaded"
+JIRA_EXPORT = "jira_export"
+SUMMARIZED = "summarized"
+EMBEDDED = "embedded"
+# Kinds the summarization stage accepts as input
+RAW_KINDS = (UPLOADED, JIRA_EXPORT)
+
+_init_lock = threading.Lock()
+_initialized = set()
+
+
+def connect(db_path=None):
+    db_path = db_path or DATASET_DB_PATH
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.row_factory = sqlite3.Row
+    with _init_lock:
+        if db_path not in _initialized:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS datasets (
+                    dataset_id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    rows INTEGER,
+                    parent_id TEXT,
+                    created REAL NOT NULL
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS datasets_kind ON datasets (kind, created)")
+            conn.execute("CREATE INDEX IF NOT EXISTS datasets_parent ON datasets (parent_id, kind)")
+            conn.execute("CREATE INDEX IF NOT EXISTS datasets_path ON datasets (path)")
+            _initialized.add(db_path)
+    return conn
+
+
+def file_digest(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def register_dataset(kind, path, parent_id=None, content_hash=None, rows=None):
+    """Record an artifact and return its dataset id.
+
+    The id is derived from kind, content and parent, so registering the same
+    artifact twice returns the existing entry and marks it as the latest.
+    """
+    content_hash = content_hash or file_digest(path)
+    if rows is None and os.path.isfile(path):
+        try:
+            rows = table_rows(path)
+        except Exception as e:
+            print(f"Could not count rows of {path}: {e}")
+    dataset_id = hashlib.sha256(f"{kind}\0{content_hash}\0{parent_id or ''}".encode("utf-8")).hexdigest()[:16]
+    with closing(connect()) as conn:
+        conn.execute(
+            "INSERT INTO datasets (dataset_id, kind, path, content_hash, rows, parent_id, created) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(dataset_id) DO UPDATE SET path = excluded.path, created = excluded.created",
+            (dataset_id, kind, path, content_hash, rows, parent_id, time.time()),
+        )
+    return dataset_id
+
+
+def get_dataset(dataset_id):
+    with closing(connect()) as conn:
+        row = conn.execute("SELECT * FROM datasets WHERE dataset_id = ?", (dataset_id,)).fetchone()
+    return dict(row) if row else None
+
+
+def list_datasets(kinds=None, limit=100):
+    query = "SELECT * FROM datasets"
+    params = ()
+    if kinds:
+        query += f" WHERE kind IN ({', '.join('?' for _ in kinds)})"
+        params = tuple(kinds)
+    with closing(connect()) as conn:
+        rows = conn.execute(f"{query} ORDER BY created DESC LIMIT ?", (*params, limit)).fetchall()
+    return [dict(row) for row in rows]
+
+
+def latest_dataset(kinds):
+    """Most recently registered dataset of the given kinds whose file still exists."""
+    for dataset in list_datasets(kinds):
+        if os.path.exists(dataset["path"]):
+            return dataset
+    return None
+
+
+def derived_dataset(content_hash, kind):
+    """A dataset of kind already built from an input with content_hash, if its file still exists."""
+    with closing(connect()) as conn:
+        rows = conn.execute(
+            "SELECT child.* FROM datasets AS child JOIN datasets AS parent ON child.parent_id = parent.dataset_id "
+            "WHERE parent.content_hash = ? AND child.kind = ? ORDER BY child.created DESC",
+            (content_hash, kind),
+        ).fetchall()
+    for row in rows:
+        if os.path.exists(row["path"]):
+            return dict(row)
+    return None
+
+
+def scan_folder(folder="./upload"):
+    """Register files in folder the catalog does not know yet; returns the new dataset ids."""
+    if not os.path.isdir(folder):
+        return []
+    with closing(connect()) as conn:
+        known = {os.path.abspath(row["path"]) for row in conn.execute("SELECT path FROM datasets")}
+    new_ids = []
+    for name in sorted(os.listdir(folder)):
+        path = os.path.join(folder, name)
+        if not os.path.isfile(path) or os.path.abspath(path) in known:
+            continue
+        if name.startswith("summarized_"):
+            kind = SUMMARIZED
+        elif name.startswith("jira_export_"):
+            kind = JIRA_EXPORT
+        else:
+            kind = UPLOADED
+        new_ids.append(register_dataset(kind, path))
+    return new_ids
@@ -0,0 +1,133 @@
+import io
+import os
+import re
+import csv
+import heapq
+import hashlib
+import threading
+from collections import defaultdict
+import pandas as pd
+from dotenv import load_dotenv
+from table_store import read_table
+
+load_dotenv()
+
+PREFILTER_ENABLED = os.getenv("prefilter_enabled", "true").lower() in ("1", "true", "yes")
+# Trigram Jaccard similarity at or above which an issue is treated as a clear match
+PREFILTER_THRESHOLD = float(os.getenv("prefilter_threshold", "0.9"))
+# Candidate rows per answer; the retrieval chain answers from as many reranked documents
+PREFILTER_CANDIDATES = 3
+
+MATCH_COLUMNS = ["Summary", "abstract"]
+OUTPUT_COLUMNS = ["Issue key", "Summary", "Project name", "Assignee", "Components"]
+# Header row of the CSV the LLM is asked to produce
+ANSWER_HEADER = ["Input", "Issue Key", "Summary", "Project name", "Assignee", "Components"]
+
+
+def normalize(text):
+    """Lowercase, drop punctuation and markdown, and collapse whitespace."""
+    text = re.sub(r"[^0-9a-z]+", " ", str(text).lower())
+    return " ".join(text.split())
+
+
+def text_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class DefectIndex:
+    """Exact-hash and trigram index over the Summary/abstract columns of a summarized export."""
+
+    def __init__(self, df):
+        self.rows = df.reset_index(drop=True)
+        self.exact = {}
+        self.grams = []
+        self.postings = defaultdict(list)
+        for row_id, row in self.rows.iterrows():
+            grams = set()
+            for column in MATCH_COLUMNS:
+                if column not in self.rows.columns or pd.isnull(row[column]):
+                    continue
+                normalized = normalize(row[column])
+                if not normalized:
+                    continue
+                self.exact.setdefault(text_hash(normalized), row_id)
+                if column == "Summary":
+                    grams = trigrams(normalized)
+            self.grams.append(grams)
+            for gram in grams:
+                self.postings[gram].append(row_id)
+
+    @classmethod
+    def from_file(cls, file_path):
+        return cls(read_table(file_path, columns=MATCH_COLUMNS + OUTPUT_COLUMNS))
+
+    def matches(self, issue, limit=PREFILTER_CANDIDATES):
+        """Return up to limit (row_id, score) pairs, closest first; an exact match scores 1.0."""
+        normalized = normalize(issue)
+        if not normalized:
+            return []
+        query = trigrams(normalized)
+        shared = defaultdict(int)
+        for gram in query:
+            for candidate in self.postings.get(gram, ()):
+                shared[candidate] += 1
+        scores = {candidate: overlap / (len(query) + len(self.grams[candidate]) - overlap)
+                  for candidate, overlap in shared.items()}
+        exact = self.exact.get(text_hash(normalized))
+        if exact is not None:
+            scores[exact] = 1.0
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+
+    def answer(self, issue, row_ids):
+        """CSV answer (header and one line per row) in the same layout the LLM is asked to produce."""
+        with io.StringIO() as buffer:
+            writer = csv.writer(buffer, lineterminator="\n")
+            writer.writerow(ANSWER_HEADER)
+            for row_id in row_ids:
+                row = self.rows.iloc[row_id]
+                writer.writerow([issue] + ["" if pd.isnull(row.get(column)) else row.get(column)
+                                           for column in OUTPUT_COLUMNS])
+            return buffer.getvalue().rstrip("\n")
+
+
+_index = None
+_index_key = None
+_index_lock = threading.Lock()
+
+
+def get_index(file_path, version=None):
+    """Per-process index for file_path, rebuilt when the file or version changes."""
+    global _index, _index_key
+    key = (file_path, version)
+    with _index_lock:
+        if _index is None or _index_key != key:
+            _index = DefectIndex.from_file(file_path)
+            _index_key = key
+        return _index
+
+
+def prefilter(issues, file_path, version=None, threshold=None, candidates=PREFILTER_CANDIDATES):
+    """Answer clear duplicates locally.
+
+    Returns a list aligned with issues holding a CSV answer for clear matches
+    and None for issues that still need the retrieval chain. Once the closest
+    row scores at least threshold, the answer lists up to `candidates` of the
+    closest rows, as the chain's answer does.
+    """
+    if not PREFILTER_ENABLED or not file_path or not os.path.exists(file_path):
+        return [None] * len(issues)
+    threshold = PREFILTER_THRESHOLD if threshold is None else threshold
+    index = get_index(file_path, version)
+    answers = []
+    for issue in issues:
+        matches = index.matches(issue, candidates)
+        if matches and matches[0][1] >= threshold:
+            answers.append(index.answer(issue, [row_id for row_id, _ in matches]))
+        else:
+            answers.append(None)
+    return answers
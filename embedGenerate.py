@@ -1,18 +1,25 @@
 import os
+import hashlib
+import threading
 from dotenv import load_dotenv
 from langchain_openai import OpenAIEmbeddings
 from langchain_community.vectorstores import Chroma
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders.csv_loader import CSVLoader
 import time
 import boto3
+import numpy as np
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain.chains import create_retrieval_chain
 import asyncio
-from langchain.retrievers import ContextualCompressionRetriever
 from langchain.retrievers.document_compressors import FlashrankRerank
+from llm_cache import acached_call
+from langchain_core.documents import Document
+import resources
+from defect_prefilter import prefilter
+from output_writer import open_output_writer, checkpoint_id_for
+from embedding_cache import CachedEmbeddings
+from table_store import DEFECT_COLUMNS, read_table, row_texts
 
 # Load environment variables
 load_dotenv()
@@ -28,124 +35,259 @@ s3_client = boto3.client(
     aws_secret_access_key=AWS_SECRET_ACCESS_KEY
     # aws_session_token=AWS_SESSION_TOKEN,
 )
+# On-disk Chroma collection shared by every worker process
+VECTORSTORE_DIR = os.getenv("vectorstore_dir", "./vectorstore")
+VECTORSTORE_COLLECTION = os.getenv("vectorstore_collection", "defects")
+VECTORSTORE_ADD_BATCH = 1000
 
-# Global variables to hold embeddings and vector store
+# Per-process handles to the embeddings client and the persistent vector store.
+# They are opened lazily and reopened when another worker re-ingests the index.
 embeddings = None
 vectorstore = None
+vectorstore_version = None
+vectorstore_lock = threading.Lock()
 
-def vector_embedding(file_path):
-    global embeddings, vectorstore
 
+def chunk_id(document):
+    """Content hash used as the Chroma id, so unchanged chunks are never re-embedded."""
+    return hashlib.sha256(document.page_content.encode("utf-8")).hexdigest()
+
+
+def read_vectorstore_version():
+    try:
+        with open(os.path.join(VECTORSTORE_DIR, "VERSION")) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def read_vectorstore_source():
+    """Path of the file the collection was last ingested from."""
+    try:
+        with open(os.path.join(VECTORSTORE_DIR, "SOURCE")) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def write_vectorstore_marker(name, value):
+    marker_path = os.path.join(VECTORSTORE_DIR, name)
+    tmp_path = f"{marker_path}.{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        f.write(value)
+    os.replace(tmp_path, marker_path)
+
+
+def write_vectorstore_version(file_path):
+    write_vectorstore_marker("SOURCE", os.path.abspath(file_path))
+    write_vectorstore_marker("VERSION", str(time.time_ns()))
+
+
+def get_vectorstore():
+    """Open the persistent vector store, reloading it if another worker changed it."""
+    global embeddings, vectorstore, vectorstore_version
+    with vectorstore_lock:
+        version = read_vectorstore_version()
+        if vectorstore is None or version != vectorstore_version:
+            if vectorstore is not None:
+                # Chroma keeps one in-memory system per path; drop it to see the new index
+                vectorstore._client.clear_system_cache()
+            if embeddings is None:
+                embeddings = CachedEmbeddings(OpenAIEmbeddings())
+            vectorstore = Chroma(collection_name=VECTORSTORE_COLLECTION, embedding_function=embeddings,
+                                 persist_directory=VECTORSTORE_DIR)
+            vectorstore_version = version
+        return vectorstore
+
+
+def vector_embedding(file_path):
     try:
-        embeddings = OpenAIEmbeddings()
-        loader = CSVLoader(file_path=file_path, encoding='utf-8')
-        docs = loader.load()
+        # One document per row, as CSVLoader would build them, read from Parquet, CSV or Excel
+        df = read_table(file_path, columns=DEFECT_COLUMNS)
+        docs = [Document(page_content=text, metadata={"source": file_path, "row": row})
+                for row, text in enumerate(row_texts(df))]
         text_splitter = RecursiveCharacterTextSplitter(chunk_size=1200, chunk_overlap=100)
         final_documents = text_splitter.split_documents(docs)
-        for id, final_document in enumerate(final_documents):
-            final_document.metadata["id"] = id
-        vectorstore = Chroma.from_documents(final_documents, embeddings)
-        if vectorstore:
-            print("Embedding completed, and vector database is ready.")
+        chunks = {}
+        for final_document in final_documents:
+            doc_id = chunk_id(final_document)
+            final_document.metadata["id"] = doc_id
+            chunks.setdefault(doc_id, final_document)
+
+        # The collection mirrors the latest ingested file: embed only new chunks, drop removed ones
+        store = get_vectorstore()
+        existing = set(store.get(include=[])["ids"])
+        stale = [doc_id for doc_id in existing if doc_id not in chunks]
+        fresh = [doc_id for doc_id in chunks if doc_id not in existing]
+        if stale:
+            store.delete(ids=stale)
+        for start in range(0, len(fresh), VECTORSTORE_ADD_BATCH):
+            batch = fresh[start:start + VECTORSTORE_ADD_BATCH]
+            store.add_documents([chunks[doc_id] for doc_id in batch], ids=batch)
+        write_vectorstore_version(file_path)
+        print(f"Embedding completed: {len(fresh)} new, {len(stale)} removed, "
+              f"{len(existing) - len(stale)} unchanged chunks. Vector database is ready.")
+        return file_path
     except Exception as e:
         print(f"An error occurred during embedding: {e}")
 
 
+DEFECT_PROMPT = ChatPromptTemplate.from_template(
+    """
+    Answer the questions based on the provided context only.
+    Please provide the most accurate response based on the question
+    <context>
+    {context}
+    <context>
+    Question: Given the following context, find all issues that have the same meaning as this {input}.
+    For each issue, check if the relevance score is greater than 0.6.
+    Return the Issue Key, Summary, Project name, Assignee, Components and input. 
+    Output the results in CSV format with the following columns: Input, Issue Key, Summary,Project name, Assignee and Components.
+    If no similar defects are found, return the Input along with "Not Found" in all other fields.
+    """
+)
+DEFECT_RETRIEVAL_K = int(os.getenv("defect_retrieval_k", "4"))
+DEFECT_MAX_CONCURRENCY = int(os.getenv("defect_max_concurrency", "8"))
+# Reranked documents per issue handed to the chain, and rows per pre-filtered answer
+DEFECT_RERANK_TOP_N = int(os.getenv("defect_rerank_top_n", "3"))
+# (issue, candidate) pairs scored by the reranker in one forward pass
+DEFECT_RERANK_BATCH = int(os.getenv("defect_rerank_batch", "256"))
 
-# async def generating_defect(issue):
-#     global vectorstore
-#     if vectorstore is None:
-#         raise ValueError("Vectorstore not initialized. Please run embeddings first.")
-#     llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash",google_api_key=GOOGLE_API_KEY,temperature=0)
-#     compressor = FlashrankRerank()
-#     compression_retriever = ContextualCompressionRetriever(base_compressor=compressor, base_retriever=vectorstore.as_retriever())
-#     compressed_docs = compression_retriever.invoke(issue)
-#     print("Start\n")
-#     print(compressed_docs)
-#     print("\nEnd")
-#     prompt=ChatPromptTemplate.from_template(
-#     """
-#         Answer the questions based on the provided context only.
-#         Please provide the most accurate response based on the question
-#         <context>
-#         {context}
-#         <context>
-#         Question: Given the following context, find all issues that have the same meaning as this {input}.
-#         For each issue, check if the relevance score is greater than 0.9.
-#         Return the Issue Key, Summary and input.
-#         Ensure that you return at least two such issues if they exist. 
-#         Output the results in CSV format with the following columns: Issue Key, Summary, and Input.
-#         If the answer not be found in context, just politely say that you do not know, do not try to make up an answer.
-#     """
-#     )
-#     document_chain = create_stuff_documents_chain(llm, prompt)
-#     retrieval_chain = create_retrieval_chain(compression_retriever, document_chain)
-
-#     responses = retrieval_chain.invoke({'input': issue})
-#     print(responses['answer'])
-
-#     # responses_bytes = ("\n".join([response for response in responses['answer']])).encode('utf-8')
-#     response = s3_client.put_object(
-#         Bucket=AWS_TEST_OUTPUT_BUCKET, Key=f"TestDefect1.csv", Body=responses['answer']
-#     )
-#     status = response.get("ResponseMetadata", {}).get("HTTPStatusCode")
-#     url = f"https://{AWS_TEST_OUTPUT_BUCKET}.s3.amazonaws.com/TestDefect1.csv"
-#     print(url)
-#     if status == 200:
-#         return url
-#     else:
-#         return None
-    
-async def generating_defect(issues):
-    global vectorstore
-    if vectorstore is None:
+# Loaded once per worker and shared across requests and threads
+resources.register("reranker", lambda: FlashrankRerank(top_n=DEFECT_RERANK_TOP_N))
+resources.register("defect_llm", lambda: ChatGoogleGenerativeAI(model="gemini-1.5-flash",
+                                                                google_api_key=GOOGLE_API_KEY, temperature=0))
+resources.register("defect_prompt", lambda: DEFECT_PROMPT)
+resources.register("defect_chain", lambda: create_stuff_documents_chain(resources.get("defect_llm"),
+                                                                        resources.get("defect_prompt")))
+
+
+def batch_similarity_search(vectorstore, issues, k=DEFECT_RETRIEVAL_K):
+    """Embed all issues in one request and query the collection for all of them at once.
+
+    Returns the documents similarity_search would return for each issue.
+    """
+    if not issues:
+        return []
+    query_embeddings = vectorstore.embeddings.embed_documents(issues)
+    # LangChain's Chroma wrapper only searches one query at a time; the collection takes many
+    results = vectorstore._collection.query(query_embeddings=query_embeddings, n_results=k,
+                                            include=["documents", "metadatas"])
+    return [
+        [Document(page_content=text, metadata=metadata or {}) for text, metadata in zip(texts, metadatas)]
+        for texts, metadatas in zip(results["documents"], results["metadatas"])
+    ]
+
+
+def pair_scores(ranker, pairs):
+    """Cross-encoder relevance of [query, passage] pairs, computed as flashrank's Ranker.rerank does."""
+    scores = []
+    for start in range(0, len(pairs), DEFECT_RERANK_BATCH):
+        encoded = ranker.tokenizer.encode_batch(pairs[start:start + DEFECT_RERANK_BATCH])
+        input_ids = np.array([e.ids for e in encoded])
+        token_type_ids = np.array([e.type_ids for e in encoded])
+        attention_mask = np.array([e.attention_mask for e in encoded])
+        onnx_input = {"input_ids": input_ids.astype(np.int64), "attention_mask": attention_mask.astype(np.int64)}
+        if not np.all(token_type_ids == 0):
+            onnx_input["token_type_ids"] = token_type_ids.astype(np.int64)
+        logits = ranker.session.run(None, onnx_input)[0]
+        if logits.shape[1] == 1:
+            scores.append(1 / (1 + np.exp(-logits.flatten())))
+        else:
+            exp_logits = np.exp(logits)
+            scores.append(exp_logits[:, 1] / np.sum(exp_logits, axis=1))
+    return np.concatenate(scores) if scores else np.array([])
+
+
+def rerank_batch(compressor, issues, candidates):
+    """Rerank the candidates of every issue in batched cross-encoder passes instead of one pass per issue.
+
+    Returns the same top_n documents FlashrankRerank.compress_documents would.
+    pair_scores relies on flashrank internals, so listwise LLM rankers and rankers
+    without an ONNX session and tokenizer are called once per issue instead.
+    """
+    ranker = compressor.client
+    pairwise = hasattr(ranker, "session") and hasattr(ranker, "tokenizer")
+    if getattr(ranker, "llm_model", None) is not None or not pairwise:
+        return [compressor.compress_documents(docs, issue) for issue, docs in zip(issues, candidates)]
+    scores = pair_scores(ranker, [[issue, doc.page_content] for issue, docs in zip(issues, candidates) for doc in docs])
+    reranked = []
+    position = 0
+    for docs in candidates:
+        doc_scores = scores[position:position + len(docs)]
+        position += len(docs)
+        # Stable sort, so ties keep their retrieval order as in Ranker.rerank
+        order = sorted(range(len(docs)), key=lambda i: doc_scores[i], reverse=True)[:compressor.top_n]
+        reranked.append([Document(page_content=docs[i].page_content,
+                                  metadata={**docs[i].metadata, "relevance_score": doc_scores[i]})
+                         for i in order])
+    return reranked
+
+
+async def generating_defect(issues, progress=None, use_cache=True):
+    vectorstore = get_vectorstore()
+    if not vectorstore.get(limit=1, include=[])["ids"]:
         raise ValueError("Vectorstore not initialized. Please run embeddings first.")
 
-    llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash", google_api_key=GOOGLE_API_KEY, temperature=0)
-    compressor = FlashrankRerank()
-    compression_retriever = ContextualCompressionRetriever(base_compressor=compressor, base_retriever=vectorstore.as_retriever())
-
-    # Consolidated responses
-    consolidated_responses = []
-
-    for issue in issues:  # Iterate through the array of issues
-        compressed_docs = compression_retriever.invoke(issue)
-        print("Start\n")
-        print(compressed_docs)
-        print("\nEnd")
-
-        prompt = ChatPromptTemplate.from_template(
-            """
-            Answer the questions based on the provided context only.
-            Please provide the most accurate response based on the question
-            <context>
-            {context}
-            <context>
-            Question: Given the following context, find all issues that have the same meaning as this {input}.
-            For each issue, check if the relevance score is greater than 0.6.
-            Return the Issue Key, Summary, Project name, Assignee, Components and input. 
-            Output the results in CSV format with the following columns: Input, Issue Key, Summary,Project name, Assignee and Components.
-            If no similar defects are found, return the Input along with "Not Found" in all other fields.
-            """
-        )
-        
-        # in which issue contains id which is a number and actual issue seperated by colon. You have to conside the actual issue only.
-        document_chain = create_stuff_documents_chain(llm, prompt)
-        retrieval_chain = create_retrieval_chain(compression_retriever, document_chain)
-
-        responses = retrieval_chain.invoke({'input': issue})
-        consolidated_responses.append(responses['answer'])  # Collect responses for all issues
-
-    # Consolidate the responses into one CSV output
-    consolidated_csv = "\n".join(consolidated_responses)
-
-    # Save the consolidated CSV to S3
-    response = s3_client.put_object(
-        Bucket=AWS_TEST_OUTPUT_BUCKET, Key=f"TestDefect1.csv", Body=consolidated_csv
-    )
-
-    status = response.get("ResponseMetadata", {}).get("HTTPStatusCode")
-    url = f"https://{AWS_TEST_OUTPUT_BUCKET}.s3.amazonaws.com/TestDefect1.csv"
+    llm = resources.get("defect_llm")
+    compressor = resources.get("reranker")
+    # in which issue contains id which is a number and actual issue seperated by colon. You have to conside the actual issue only.
+    document_chain = resources.get("defect_chain")
+
+    # Answers are streamed to S3 in input order; re-running the same issues resumes the checkpoint
+    # The writer's S3 calls and file syncs run in worker threads so they do not block the event loop
+    version = read_vectorstore_version()
+    writer = await asyncio.to_thread(open_output_writer, s3_client, AWS_TEST_OUTPUT_BUCKET, "TestDefect1.csv",
+                                     checkpoint_id=checkpoint_id_for("defect", issues, version))
+    offset = writer.next_row
+
+    def write_answer(index, answer):
+        writer.write(index, answer if index == 0 else "\n" + answer)
+
+    # Clear duplicates of already ingested defects are answered locally without an LLM call
+    answers = [None] * offset + prefilter(issues[offset:], read_vectorstore_source(), version,
+                                          candidates=DEFECT_RERANK_TOP_N)
+    pending = [index for index in range(offset, len(issues)) if answers[index] is None]
+
+    def write_prefiltered():
+        for index in range(offset, len(issues)):
+            if answers[index] is not None:
+                write_answer(index, answers[index])
+
+    await asyncio.to_thread(write_prefiltered)
+    completed = len(issues) - len(pending)
+    if completed:
+        print(f"Pre-filter and checkpoint covered {completed} of {len(issues)} issues")
+        if progress is not None:
+            progress(completed, len(issues))
+
+    pending_issues = [issues[index] for index in pending]
+    candidates = await asyncio.to_thread(batch_similarity_search, vectorstore, pending_issues)
+    # Reranking is CPU bound, keep it off the event loop
+    reranked = await asyncio.to_thread(rerank_batch, compressor, pending_issues, candidates)
+    semaphore = asyncio.Semaphore(DEFECT_MAX_CONCURRENCY)
+
+    async def answer_issue(index, issue, compressed_docs):
+        nonlocal completed
+        async with semaphore:
+            # The rendered prompt (issue plus reranked context) is the cache key,
+            # so a changed index misses the cache
+            rendered_prompt = resources.get("defect_prompt").format(
+                input=issue, context="\n\n".join(doc.page_content for doc in compressed_docs))
+            answer = await acached_call(llm.model, {"temperature": llm.temperature}, rendered_prompt,
+                                        lambda: document_chain.ainvoke({'input': issue, 'context': compressed_docs}),
+                                        use_cache=use_cache)
+        await asyncio.to_thread(write_answer, index, answer)
+        completed += 1
+        if progress is not None:
+            progress(completed, len(issues), answer)
+
+    await asyncio.gather(
+        *[answer_issue(index, issue, docs) for index, issue, docs in zip(pending, pending_issues, reranked)])
+
+    # The writer joins the answers into one CSV output in input order
+    status = await asyncio.to_thread(writer.close)
+    url = f"https://{AWS_TEST_OUTPUT_BUCKET}.s3.amazonaws.com/{writer.key}"
     print(url)
 
     if status == 200:
@@ -157,8 +299,8 @@ async def generating_defect(issues):
 
 def handle_start_embedding_button_click(filepath):
     print("Start Embedding button clicked...")
-    vector_embedding(filepath)
+    return vector_embedding(filepath)
 
-def handle_defect_detection_button_click(issue):
+def handle_defect_detection_button_click(issue, progress=None, use_cache=True):
     print("Start Generating defect...")
-    return asyncio.run(generating_defect(issue))
+    return asyncio.run(generating_defect(issue, progress=progress, use_cache=use_cache))
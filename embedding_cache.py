@@ -0,0 +1,172 @@
+import os
+import re
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+from llm_dispatcher import dispatch
+
+load_dotenv()
+
+EMBEDDING_CACHE_DIR = os.getenv("embedding_cache_dir", "./embedding_cache")
+EMBEDDING_BATCH_SIZE = int(os.getenv("embedding_batch_size", "256"))
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("embedding_max_concurrency", "4"))
+EMBEDDING_REQUESTS_PER_MINUTE = float(os.getenv("embedding_requests_per_minute", "500"))
+
+
+class VectorCache:
+    """Text-hash -> vector cache on disk.
+
+    Vectors live in a single append-only float32 file that is read through a
+    memory map; a SQLite sidecar maps each hash to its row and doubles as the
+    cross-process write lock. The cache holds vectors of one dimension;
+    writing vectors of another dimension empties it first.
+    """
+
+    def __init__(self, cache_dir=EMBEDDING_CACHE_DIR):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.vectors_path = os.path.join(cache_dir, "vectors.f32")
+        self.index_path = os.path.join(cache_dir, "index.sqlite")
+        self.lock = threading.Lock()
+        self.matrix = None
+        with self.connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS vectors (hash TEXT PRIMARY KEY, row INTEGER NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        open(self.vectors_path, "ab").close()
+
+    def connect(self):
+        conn = sqlite3.connect(self.index_path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def dimension(self, conn):
+        row = conn.execute("SELECT value FROM meta WHERE name = 'dim'").fetchone()
+        return row[0] if row else None
+
+    def rows_view(self, dim, needed_rows):
+        """Memory-mapped (rows, dim) view of the vector file, remapped when it has grown."""
+        with self.lock:
+            if self.matrix is None or self.matrix.shape[0] < needed_rows or self.matrix.shape[1] != dim:
+                rows = os.path.getsize(self.vectors_path) // (dim * 4)
+                self.matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, dim))
+            return self.matrix
+
+    def get_many(self, hashes):
+        """Return {hash: vector} for every hash already cached."""
+        if not hashes:
+            return {}
+        conn = self.connect()
+        try:
+            dim = self.dimension(conn)
+            if dim is None:
+                return {}
+            rows = {}
+            unique = list(set(hashes))
+            for start in range(0, len(unique), 500):
+                chunk = unique[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows.update(conn.execute(
+                    f"SELECT hash, row FROM vectors WHERE hash IN ({placeholders})", chunk
+                ).fetchall())
+        finally:
+            conn.close()
+        if not rows:
+            return {}
+        matrix = self.rows_view(dim, max(rows.values()) + 1)
+        return {key: matrix[row].tolist() for key, row in rows.items()}
+
+    def put_many(self, items):
+        """Append {hash: vector} entries that are not cached yet."""
+        if not items:
+            return
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            dim = len(next(iter(items.values())))
+            cached_dim = self.dimension(conn)
+            if cached_dim != dim:
+                if cached_dim is not None:
+                    print(f"Embedding dimension changed from {cached_dim} to {dim}; clearing {self.vectors_path}")
+                    conn.execute("DELETE FROM vectors")
+                    # The file is overwritten from row 0 rather than truncated under other processes' maps
+                    with self.lock:
+                        self.matrix = None
+                conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('dim', ?)", (dim,))
+            next_row = conn.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM vectors").fetchone()[0]
+            new_rows = []
+            vectors = []
+            for key, vector in items.items():
+                if conn.execute("SELECT 1 FROM vectors WHERE hash = ?", (key,)).fetchone():
+                    continue
+                new_rows.append((key, next_row + len(new_rows)))
+                vectors.append(vector)
+            if new_rows:
+                block = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), dim)
+                with open(self.vectors_path, "r+b") as f:
+                    f.seek(next_row * dim * 4)
+                    f.write(block.tobytes())
+                conn.executemany("INSERT INTO vectors (hash, row) VALUES (?, ?)", new_rows)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+
+def cache_dir_for(embeddings, root=EMBEDDING_CACHE_DIR):
+    """Per-model cache directory, so switching embedding models never mixes their vectors."""
+    name = str(getattr(embeddings, "model", type(embeddings).__name__))
+    dimensions = getattr(embeddings, "dimensions", None)
+    if dimensions:
+        name = f"{name}-{dimensions}"
+    return os.path.join(root, re.sub(r"[^A-Za-z0-9_.-]+", "_", name))
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper adding batching, parallel rate-limited requests and a disk cache.
+
+    Only texts whose hash is not in the cache are sent to the wrapped model.
+    """
+
+    def __init__(self, embeddings, cache=None, batch_size=EMBEDDING_BATCH_SIZE,
+                 max_concurrency=EMBEDDING_MAX_CONCURRENCY, requests_per_minute=EMBEDDING_REQUESTS_PER_MINUTE):
+        self.embeddings = embeddings
+        self.cache = cache or VectorCache(cache_dir_for(embeddings))
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.model_name = getattr(embeddings, "model", type(embeddings).__name__)
+        self.network_calls = 0
+
+    def text_hash(self, text):
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def embed_documents(self, texts):
+        hashes = [self.text_hash(text) for text in texts]
+        found = self.cache.get_many(hashes)
+        missing = {}
+        for key, text in zip(hashes, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        if missing:
+            keys = list(missing)
+            batches = [keys[start:start + self.batch_size] for start in range(0, len(keys), self.batch_size)]
+
+            def embed_batch(batch):
+                return self.embeddings.embed_documents([missing[key] for key in batch])
+
+            results = dispatch(batches, embed_batch, max_concurrency=self.max_concurrency,
+                               requests_per_minute=self.requests_per_minute)
+            self.network_calls += len(batches)
+            computed = {}
+            for batch, vectors in zip(batches, results):
+                computed.update(zip(batch, vectors))
+            self.cache.put_many(computed)
+            found.update(computed)
+        return [list(found[key]) for key in hashes]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
@@ -0,0 +1,189 @@
+import io
+import math
+from collections import Counter
+import ijson
+from performancecomapre import FLATTEN_METRICS, stats_table
+
+# Gatling's default percentile settings, in the order of percentiles1..4
+PERCENTILES = {"percentiles1": 50, "percentiles2": 75, "percentiles3": 95, "percentiles4": 99}
+ROOT_NAME = "All Requests"
+
+
+def text_lines(fileobj):
+    """Iterate the lines of a text or binary file object without reading it whole."""
+    if isinstance(fileobj, io.TextIOBase):
+        return fileobj
+    return io.TextIOWrapper(fileobj, encoding="utf-8", errors="replace")
+
+
+def stream_stats_table(fileobj, metrics=FLATTEN_METRICS):
+    """Flatten a Gatling stats.json file while parsing it, without building the JSON tree.
+
+    Produces the same table as flatten_stats(json.load(fileobj)).
+    """
+    positions = {metric: index for index, metric in enumerate(metrics)}
+    keys, names, types, depths, values = [], [], [], [], []
+    # Current key at every open container, and (path length, row) of the enclosing nodes
+    path = []
+    nodes = []
+    for _, event, value in ijson.parse(fileobj, use_float=True):
+        if event == "map_key":
+            path[-1] = value
+        elif event in ("start_map", "start_array"):
+            if event == "start_map" and ((not path and not nodes) or (
+                    nodes and len(path) == nodes[-1][0] + 2 and path[-2] == "contents")):
+                parent_key = keys[nodes[-1][1]] if nodes else ""
+                keys.append(f"{parent_key}/{path[-1]}" if parent_key else (path[-1] if nodes else ""))
+                names.append(None)
+                types.append(None)
+                depths.append(len(nodes))
+                values.append([None] * (2 * len(metrics)))
+                nodes.append((len(path), len(keys) - 1))
+            path.append(None)
+        elif event in ("end_map", "end_array"):
+            path.pop()
+            if event == "end_map" and nodes and nodes[-1][0] == len(path):
+                nodes.pop()
+        elif nodes:
+            start, row = nodes[-1]
+            field = path[start:]
+            if field == ["type"]:
+                types[row] = value
+            elif field == ["stats", "name"] or (field == ["name"] and names[row] is None):
+                names[row] = value
+            elif len(field) == 3 and field[0] == "stats" and field[1] in positions and field[2] in ("ok", "ko"):
+                values[row][2 * positions[field[1]] + (field[2] == "ko")] = value
+    return stats_table(keys, names, types, depths, values, metrics)
+
+
+class ResponseTimeStats:
+    """Single-pass response time statistics.
+
+    Mean and standard deviation are updated incrementally; percentiles are
+    exact, from a histogram of millisecond values whose size is bounded by the
+    number of distinct response times rather than the number of requests.
+    """
+
+    __slots__ = ("count", "mean", "m2", "min", "max", "histogram")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.histogram = Counter()
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = value if self.min is None or value < self.min else self.min
+        self.max = value if self.max is None or value > self.max else self.max
+        self.histogram[value] += 1
+
+    def percentiles(self, ranks):
+        """Nearest-rank percentiles for every rank in ranks, from one walk over the histogram."""
+        if not self.count:
+            return [None] * len(ranks)
+        targets = sorted((max(1, math.ceil(rank / 100 * self.count)), index) for index, rank in enumerate(ranks))
+        results = [None] * len(ranks)
+        seen = 0
+        pending = iter(targets)
+        target, index = next(pending)
+        for value in sorted(self.histogram):
+            seen += self.histogram[value]
+            while target is not None and seen >= target:
+                results[index] = value
+                target, index = next(pending, (None, None))
+        return results
+
+    def metric_values(self):
+        if not self.count:
+            return {"numberOfRequests": 0}
+        result = {
+            "numberOfRequests": self.count,
+            "minResponseTime": self.min,
+            "maxResponseTime": self.max,
+            "meanResponseTime": round(self.mean),
+            "standardDeviation": round(math.sqrt(self.m2 / self.count)),
+        }
+        result.update(zip(PERCENTILES, self.percentiles(list(PERCENTILES.values()))))
+        return result
+
+
+class SimulationLogReader:
+    """Aggregates a Gatling simulation.log line by line into per-request and per-group statistics.
+
+    Nodes are keyed by their group path and request name ("group/request"),
+    so two simulation.log files compare with each other; the keys do not
+    match those of a stats.json file.
+    """
+
+    def __init__(self):
+        self.nodes = {}
+        self.node("", ROOT_NAME, "GROUP", 0)
+
+    def node(self, key, name, node_type, depth):
+        node = self.nodes.get(key)
+        if node is None:
+            node = self.nodes[key] = {"name": name, "type": node_type, "depth": depth,
+                                      "ok": ResponseTimeStats(), "ko": ResponseTimeStats()}
+        return node
+
+    def group_nodes(self, groups):
+        """The group nodes along a comma-separated group hierarchy, created in order of appearance."""
+        nodes = []
+        key = ""
+        for depth, group in enumerate(filter(None, groups.split(",")), start=1):
+            key = f"{key}/{group}" if key else group
+            nodes.append((key, self.node(key, group, "GROUP", depth)))
+        return nodes
+
+    def add_line(self, line):
+        fields = line.rstrip("\r\n").split("\t")
+        if fields[0] == "REQUEST" and len(fields) >= 7:
+            # Older Gatling versions put a user id after the record type; count from the end
+            groups, name, start, end, status = fields[-6], fields[-5], fields[-4], fields[-3], fields[-2]
+            parents = self.group_nodes(groups)
+            parent_key = parents[-1][0] if parents else ""
+            key = f"{parent_key}/{name}" if parent_key else name
+            node = self.node(key, name, "REQUEST", len(parents) + 1)
+            side = "ok" if status == "OK" else "ko"
+            response_time = int(end) - int(start)
+            node[side].add(response_time)
+            self.nodes[""][side].add(response_time)
+        elif fields[0] == "GROUP" and len(fields) >= 6:
+            # Group statistics use the cumulated response time of the group's requests;
+            # indexed from the end like REQUEST records, since older layouts add a leading column
+            groups, cumulated, status = fields[-5], fields[-2], fields[-1]
+            parents = self.group_nodes(groups)
+            if parents:
+                parents[-1][1]["ok" if status == "OK" else "ko"].add(int(cumulated))
+
+    def table(self, metrics=FLATTEN_METRICS):
+        keys, names, types, depths, values = [], [], [], [], []
+        for key, node in self.nodes.items():
+            keys.append(key)
+            names.append(node["name"])
+            types.append(node["type"])
+            depths.append(node["depth"])
+            ok, ko = node["ok"].metric_values(), node["ko"].metric_values()
+            values.append([value for metric in metrics for value in (ok.get(metric), ko.get(metric))])
+        return stats_table(keys, names, types, depths, values, metrics)
+
+
+def read_simulation_log(fileobj, metrics=FLATTEN_METRICS):
+    """Flattened statistics table of a simulation.log, read in a single pass."""
+    reader = SimulationLogReader()
+    for line in text_lines(fileobj):
+        reader.add_line(line)
+    return reader.table(metrics)
+
+
+def read_results_table(fileobj, filename):
+    """Flattened table of an uploaded stats.json or simulation.log, chosen by file name."""
+    if filename.endswith(".log"):
+        return read_simulation_log(fileobj)
+    return stream_stats_table(fileobj)
@@ -1,5 +1,12 @@
 # api call
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
 import os
 
@@ -9,14 +16,248 @@ load_dotenv()
 # password = os.getenv("password")
 # url = "https://kishankumarvm.atlassian.net/rest/agile/1.0/board/4/sprint/2/issue"
 
+JIRA_TIMEOUT = float(os.getenv("jira_timeout", "30"))
+JIRA_PAGE_SIZE = int(os.getenv("jira_page_size", "50"))
+JIRA_MAX_WORKERS = int(os.getenv("jira_max_workers", "4"))
+JIRA_MAX_RETRIES = int(os.getenv("jira_max_retries", "3"))
+# Only the fields the BDD and defect flows read
+ISSUE_FIELDS = "summary,description,issuetype,sprint"
+# Seconds board, sprint and issue lookups are reused across the board -> sprint -> issue -> generate flow
+JIRA_CACHE_TTL = float(os.getenv("jira_cache_ttl", "120"))
+# Pooled clients kept per worker: the least recently used go first, idle ones after JIRA_CLIENT_TTL seconds
+JIRA_MAX_CLIENTS = int(os.getenv("jira_max_clients", "32"))
+JIRA_CLIENT_TTL = float(os.getenv("jira_client_ttl", "900"))
+
+
+def plan_pages(key, params=None):
+    """Page plan for a startAt/maxResults collection, shared by the sync and async clients.
+
+    A generator that yields lists of request params and is sent back the
+    pages fetched for them, in order; it returns every value of the
+    collection. When the first page reports a total all remaining pages are
+    requested in one batch, to be fetched concurrently; otherwise pages are
+    followed one at a time until isLast.
+    """
+    params = dict(params or {}, startAt=0, maxResults=JIRA_PAGE_SIZE)
+    (first,) = yield [params]
+    values = list(first.get(key, []))
+    # The server may cap maxResults below what was asked for
+    page_size = first.get("maxResults") or len(values) or JIRA_PAGE_SIZE
+    total = first.get("total")
+    if total is not None:
+        starts = range(len(values), total, page_size)
+        if starts:
+            for page in (yield [dict(params, startAt=start) for start in starts]):
+                values.extend(page.get(key, []))
+        return values
+    page = first
+    while not page.get("isLast", True) and page.get(key):
+        (page,) = yield [dict(params, startAt=len(values))]
+        values.extend(page.get(key, []))
+    return values
+
+
+class JiraClient:
+    """Jira Agile REST client with a pooled session, paging, retries and conditional GETs."""
+
+    def __init__(self, jira_url, email, password):
+        self.base_url = jira_url.rstrip("/")
+        self.session = requests.Session()
+        self.session.auth = (email, password)
+        retry = Retry(total=JIRA_MAX_RETRIES, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=("GET",), respect_retry_after_header=True)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=JIRA_MAX_WORKERS, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # (url, params) -> (etag, payload) for servers that send ETags
+        self.etags = {}
+        self.etags_lock = threading.Lock()
+
+    def get_json(self, path, params=None):
+        url = f"{self.base_url}{path}"
+        cache_key = (url, tuple(sorted((params or {}).items())))
+        with self.etags_lock:
+            cached = self.etags.get(cache_key)
+        headers = {"If-None-Match": cached[0]} if cached else {}
+        response = self.session.get(url, params=params, headers=headers, timeout=JIRA_TIMEOUT)
+        if response.status_code == 304 and cached:
+            return cached[1]
+        response.raise_for_status()
+        payload = response.json()
+        etag = response.headers.get("ETag")
+        if etag:
+            with self.etags_lock:
+                self.etags[cache_key] = (etag, payload)
+        return payload
+
+    def paged(self, path, key, params=None):
+        """Fetch every page of a startAt/maxResults collection, following plan_pages."""
+        plan = plan_pages(key, params)
+        try:
+            batch = next(plan)
+            while True:
+                if len(batch) == 1:
+                    pages = [self.get_json(path, batch[0])]
+                else:
+                    with ThreadPoolExecutor(max_workers=JIRA_MAX_WORKERS) as executor:
+                        pages = list(executor.map(lambda page_params: self.get_json(path, page_params), batch))
+                batch = plan.send(pages)
+        except StopIteration as done:
+            return done.value
+
+    def myself(self):
+        """The authenticated user; raises for bad credentials."""
+        return self.get_json("/rest/api/2/myself")
+
+    def boards(self):
+        return self.paged("/rest/agile/1.0/board", "values")
+
+    def sprints(self, board_id, state=None):
+        params = {"state": state} if state else None
+        return self.paged(f"/rest/agile/1.0/board/{board_id}/sprint", "values", params)
+
+    def sprint_issues(self, board_id, sprint_id, fields=ISSUE_FIELDS):
+        return self.paged(f"/rest/agile/1.0/board/{board_id}/sprint/{sprint_id}/issue", "issues",
+                          {"fields": fields})
+
+
+# credential key -> (last used, client), least recently used first
+_clients = OrderedDict()
+_clients_lock = threading.Lock()
+
+
+def credential_key(jira_url, email, password):
+    """(url, email hash, credential hash); a missing email or password hashes as empty."""
+    email = email or ""
+    email_digest = hashlib.sha256(email.encode("utf-8")).hexdigest()
+    digest = hashlib.sha256(f"{email}\0{password or ''}".encode("utf-8")).hexdigest()
+    return jira_url.rstrip("/"), email_digest, digest
+
+
+def get_client(jira_url, email, password):
+    """One pooled client per Jira URL and credential, shared across requests.
+
+    At most JIRA_MAX_CLIENTS clients are kept; evicted and idle ones are closed.
+    """
+    key = credential_key(jira_url, email, password)
+    now = time.monotonic()
+    closed = []
+    with _clients_lock:
+        entry = _clients.pop(key, None)
+        while _clients and next(iter(_clients.values()))[0] <= now - JIRA_CLIENT_TTL:
+            closed.append(_clients.popitem(last=False)[1][1])
+        client = entry[1] if entry is not None else JiraClient(jira_url, email, password)
+        _clients[key] = (now, client)
+        while len(_clients) > JIRA_MAX_CLIENTS:
+            closed.append(_clients.popitem(last=False)[1][1])
+    for stale in closed:
+        stale.session.close()
+    return client
+
+
+def drop_client(jira_url, email, password):
+    """Forget and close the client for these credentials, e.g. after Jira rejected them."""
+    with _clients_lock:
+        entry = _clients.pop(credential_key(jira_url, email, password), None)
+    if entry is not None:
+        entry[1].session.close()
+
+
+def with_client(jira_url, email, password, call):
+    """Return call(client); the client is dropped when Jira answers 401 for its credentials."""
+    try:
+        return call(get_client(jira_url, email, password))
+    except requests.HTTPError as e:
+        if e.response is not None and e.response.status_code == 401:
+            drop_client(jira_url, email, password)
+        raise
+
+
+_lookups = {}
+_lookups_lock = threading.Lock()
+
+
+def cached_lookup(kind, jira_url, email, password, fetch, board_id=None, sprint_id=None):
+    """Return fetch() through a short-TTL cache keyed by Jira URL, credential hash, board and sprint."""
+    key = (kind, *credential_key(jira_url, email, password),
+           None if board_id is None else str(board_id), None if sprint_id is None else str(sprint_id))
+    now = time.monotonic()
+    with _lookups_lock:
+        entry = _lookups.get(key)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+    value = fetch()
+    with _lookups_lock:
+        _lookups[key] = (now + JIRA_CACHE_TTL, value)
+        # Drop expired entries so the cache does not grow with every credential seen
+        for stale in [k for k, (expires, _) in _lookups.items() if expires <= now]:
+            del _lookups[stale]
+    return value
+
+
+def invalidate_jira_cache(jira_url=None, email=None, password=None, board_id=None, sprint_id=None):
+    """Drop cached lookups; any argument left as None matches every value.
+
+    With an email but no password every lookup made with that email matches.
+    """
+    url, email_digest, digest = credential_key(jira_url or "", email, password)
+    wanted = (url or None, email_digest if email else None, digest if email and password else None,
+              None if board_id is None else str(board_id), None if sprint_id is None else str(sprint_id))
+    with _lookups_lock:
+        for key in list(_lookups):
+            if all(value is None or value == part for value, part in zip(wanted, key[1:])):
+                del _lookups[key]
+
+
+def verify_credentials(jira_url, email, password):
+    """True when Jira accepts the credentials."""
+    if not (jira_url and email and password):
+        return False
+    try:
+        get_client(jira_url, email, password).myself()
+        return True
+    except Exception as e:
+        print(f"Error: {e}")
+        # Failed checks must not leave a client (and its password) behind
+        drop_client(jira_url, email, password)
+        return False
+
+
+def sprint_issues(jira_url, email, password, board_id, sprint_id):
+    """Sprint issues shared by the issue dropdown and the generation step."""
+    return cached_lookup("sprint_issues", jira_url, email, password,
+                         lambda: with_client(jira_url, email, password,
+                                             lambda client: client.sprint_issues(board_id, sprint_id)),
+                         board_id=board_id, sprint_id=sprint_id)
+
+
+def story_descriptions(issues):
+    user_story = []
+    for issue in issues:
+        description = issue['fields'].get('description', '')
+        # print(f"Full Description: {description}")  # Inspect the description field
+        sprint = issue['fields'].get('sprint') or {}
+        if sprint.get('state') == 'active' and description:
+            user_story.append(description)
+    return user_story
+
+
+def bug_summaries(issues):
+    user_story = []
+    for issue in issues:
+        summary = issue['fields'].get('summary', '')
+        if issue['fields']['issuetype']['name'] == 'Bug' and summary:
+            # user_story.append(summary)
+            user_story.append(issue['id'] + ": " + summary)
+    return user_story
+
 
 def get_boardid(jira_url, email, password):
     board_id = []
-    url = f"{jira_url}/rest/agile/1.0/board/"
-    # print(url)
     try:
-        response = requests.get(url, auth=(email, password))
-        for value in response.json()['values']:
+        boards = cached_lookup("boards", jira_url, email, password,
+                               lambda: with_client(jira_url, email, password, lambda client: client.boards()))
+        for value in boards:
             board_id.append([value['id'], value['name']])
         return board_id
     except Exception as e:
@@ -26,11 +267,12 @@ def get_boardid(jira_url, email, password):
 
 def get_sprintid(jira_url, email, password, board_id):
     sprint_id = []
-    url = f"{jira_url}/rest/agile/1.0/board/{board_id}/sprint/"
-    # print(url)
     try:
-        response = requests.get(url, auth=(email, password))
-        for value in response.json()['values']:
+        sprints = cached_lookup("sprints", jira_url, email, password,
+                                lambda: with_client(jira_url, email, password,
+                                                    lambda client: client.sprints(board_id, state='active')),
+                                board_id=board_id)
+        for value in sprints:
             if value['state'] == 'active':
                 sprint_id.append([value['id'], value['name']])
         return sprint_id
@@ -40,41 +282,16 @@ def get_sprintid(jira_url, email, password, board_id):
 
 
 def get_issues(jira_url, email, password, board_id, sprint_id):
-    user_story = []
-    url = f"{jira_url}/rest/agile/1.0/board/{board_id}/sprint/{sprint_id}/issue"
-    # print(url)
     try:
-        response = requests.get(url, auth=(email, password))
-        # print(response.json())
-        # for issue in response.json()['issues']:
-        #     if issue['fields']['sprint']['state'] == 'active':
-        #         user_story.append(issue['fields']['description'])
-        # return user_story
-        for issue in response.json().get('issues', []):
-            description = issue['fields'].get('description', '')
-            # print(f"Full Description: {description}")  # Inspect the description field
-            
-            if issue['fields']['sprint']['state'] == 'active' and description:
-                user_story.append(description)
-        return user_story
+        return story_descriptions(sprint_issues(jira_url, email, password, board_id, sprint_id))
     except Exception as e:
         print(f"Error: {e}")
-        return user_story
+        return []
+
 
 def get_issues_bug(jira_url, email, password, board_id, sprint_id):
-    user_story = []
-    url = f"{jira_url}/rest/agile/1.0/board/{board_id}/sprint/{sprint_id}/issue"
-    print(url)
     try:
-        response = requests.get(url, auth=(email, password))
-        for issue in response.json().get('issues', []):
-            summary = issue['fields'].get('summary', '')
-            
-            if issue['fields']['issuetype']['name'] == 'Bug' and summary:
-                # user_story.append(summary)
-                user_story.append(issue['id']+": "+ summary)
-
-        return user_story
+        return bug_summaries(sprint_issues(jira_url, email, password, board_id, sprint_id))
     except Exception as e:
         print(f"Error: {e}")
-        return user_story
\ No newline at end of file
+        return []
@@ -0,0 +1,138 @@
+import os
+import time
+import asyncio
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import httpx
+import pandas as pd
+from dotenv import load_dotenv
+from jira import plan_pages
+from table_store import intermediate_path, write_table
+
+load_dotenv()
+
+JIRA_EXPORT_CONCURRENCY = int(os.getenv("jira_export_concurrency", "8"))
+JIRA_EXPORT_TIMEOUT = float(os.getenv("jira_export_timeout", "30"))
+# Fields needed by the summarization and embedding pipelines
+EXPORT_FIELDS = "summary,description,issuetype,sprint,project,assignee,components,status"
+UPLOAD_FOLDER = "upload"
+
+
+class AsyncJiraCrawler:
+    """Lists every board, its active sprints and their issues with bounded concurrency."""
+
+    def __init__(self, client, max_concurrency=JIRA_EXPORT_CONCURRENCY):
+        self.client = client
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def get_json(self, path, params):
+        async with self.semaphore:
+            for attempt in range(4):
+                response = await self.client.get(path, params=params)
+                if response.status_code in (429, 500, 502, 503, 504) and attempt < 3:
+                    await asyncio.sleep(retry_delay(response, attempt))
+                    continue
+                response.raise_for_status()
+                return response.json()
+
+    async def paged(self, path, key, params=None):
+        """Fetch every page of a startAt/maxResults collection, following jira.plan_pages."""
+        plan = plan_pages(key, params)
+        try:
+            batch = next(plan)
+            while True:
+                batch = plan.send(await asyncio.gather(*[self.get_json(path, page_params) for page_params in batch]))
+        except StopIteration as done:
+            return done.value
+
+    async def board_sprints(self, board):
+        try:
+            sprints = await self.paged(f"/rest/agile/1.0/board/{board['id']}/sprint", "values", {"state": "active"})
+        except httpx.HTTPStatusError as e:
+            # Kanban boards have no sprints and answer 400
+            print(f"Skipping board {board['id']}: {e.response.status_code}")
+            return []
+        return [(board, sprint) for sprint in sprints]
+
+    async def sprint_rows(self, board, sprint):
+        issues = await self.paged(f"/rest/agile/1.0/board/{board['id']}/sprint/{sprint['id']}/issue", "issues",
+                                  {"fields": EXPORT_FIELDS})
+        return [issue_row(board, sprint, issue) for issue in issues]
+
+    async def crawl(self, progress=None):
+        boards = await self.paged("/rest/agile/1.0/board", "values")
+        pairs = [pair for pairs in await asyncio.gather(*[self.board_sprints(board) for board in boards])
+                 for pair in pairs]
+        # The same sprint can appear on several boards; fetch its issues once
+        unique = {}
+        for board, sprint in pairs:
+            unique.setdefault(sprint["id"], (board, sprint))
+        done = 0
+
+        async def fetch(board, sprint):
+            nonlocal done
+            rows = await self.sprint_rows(board, sprint)
+            done += 1
+            if progress is not None:
+                progress(done, len(unique))
+            return rows
+
+        results = await asyncio.gather(*[fetch(board, sprint) for board, sprint in unique.values()])
+        return [row for rows in results for row in rows]
+
+
+def retry_delay(response, attempt):
+    """Seconds to wait before a retry: Retry-After in seconds or as an HTTP-date, else exponential backoff."""
+    retry_after = response.headers.get("Retry-After")
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass
+        try:
+            when = parsedate_to_datetime(retry_after)
+        except (TypeError, ValueError):
+            when = None
+        if when is not None:
+            if when.tzinfo is None:
+                when = when.replace(tzinfo=timezone.utc)
+            return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+    return 2 ** attempt
+
+
+def issue_row(board, sprint, issue):
+    """Flatten an issue into the column layout summarize_and_store_locally expects."""
+    fields = issue.get("fields", {})
+    return {
+        "Summary": fields.get("summary"),
+        "Issue key": issue.get("key"),
+        "Issue id": issue.get("id"),
+        "Project name": (fields.get("project") or {}).get("name"),
+        "Assignee": (fields.get("assignee") or {}).get("displayName"),
+        "Components": ", ".join(component.get("name", "") for component in fields.get("components") or []),
+        "Issue type": (fields.get("issuetype") or {}).get("name"),
+        "Status": (fields.get("status") or {}).get("name"),
+        "Description": fields.get("description"),
+        "Board id": board.get("id"),
+        "Board name": board.get("name"),
+        "Sprint id": sprint.get("id"),
+        "Sprint name": sprint.get("name"),
+    }
+
+
+async def crawl_active_sprints(jira_url, email, password, progress=None):
+    async with httpx.AsyncClient(base_url=jira_url.rstrip("/"), auth=(email, password),
+                                 timeout=JIRA_EXPORT_TIMEOUT) as client:
+        return await AsyncJiraCrawler(client).crawl(progress=progress)
+
+
+def export_active_sprints(jira_url, email, password, progress=None):
+    """Snapshot every issue of every active sprint on every board into upload/."""
+    rows = asyncio.run(crawl_active_sprints(jira_url, email, password, progress=progress))
+    if not rows:
+        raise ValueError("No issues found in active sprints")
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    output_file_path = write_table(pd.DataFrame(rows),
+                                   intermediate_path(UPLOAD_FOLDER, f"jira_export_{int(time.time())}"))
+    print(f"Exported {len(rows)} issues to {output_file_path}")
+    return output_file_path
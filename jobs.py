@@ -0,0 +1,375 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from collections import deque
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# "sqlite" shares job state between gunicorn workers; "thread" is only for a
+# single worker process, since a poll landing on another worker cannot see the job
+JOB_BACKEND = os.getenv("job_backend", "sqlite")
+JOB_WORKERS = int(os.getenv("job_workers", "4"))
+JOB_DB_PATH = os.getenv("job_db_path", "./jobs.db")
+JOB_POLL_INTERVAL = float(os.getenv("job_poll_interval", "1.0"))
+# Finished and failed jobs are forgotten this many seconds after they end
+JOB_TTL = float(os.getenv("job_ttl", "86400"))
+# A running job whose worker has not touched it for this long is treated as crashed
+JOB_STALE_AFTER = float(os.getenv("job_stale_after", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("job_max_attempts", "2"))
+# Only the latest partial results are kept; the full output is at the job's URL
+JOB_PARTIAL_LIMIT = int(os.getenv("job_partial_limit", "20"))
+
+# Task arguments that are never written to the job store. Jobs carrying them
+# only run in the process that accepted them, which holds them in memory.
+SECRET_FIELDS = ("password", "api_token", "token")
+
+# Task name -> callable(progress=..., **kwargs). Tasks are looked up by name so
+# that any process sharing the SQLite queue can run a job submitted elsewhere.
+TASKS = {}
+
+
+def register_task(name, func):
+    TASKS[name] = func
+    return func
+
+
+def new_job(job_id, task, kwargs):
+    now = time.time()
+    return {
+        "job_id": job_id,
+        "task": task,
+        "status": "queued",
+        "done": 0,
+        "total": None,
+        "partial": [],
+        "url": None,
+        "error": None,
+        "created": now,
+        "updated": now,
+        "kwargs": kwargs,
+    }
+
+
+def split_secrets(kwargs):
+    """Separate secret task arguments from the ones that may be stored."""
+    public = {key: value for key, value in kwargs.items() if key not in SECRET_FIELDS}
+    secrets = {key: value for key, value in kwargs.items() if key in SECRET_FIELDS}
+    return public, secrets
+
+
+def public_view(job):
+    """Job fields safe to return to API clients (no task arguments)."""
+    if job is None:
+        return None
+    return {key: value for key, value in job.items() if key != "kwargs"}
+
+
+def run_task(backend, job_id, task, kwargs):
+    """Run a registered task, recording progress, result and failure on the backend."""
+    backend.update(job_id, status="running")
+
+    def progress(done, total=None, partial=None):
+        backend.report(job_id, done, total, partial)
+
+    try:
+        func = TASKS[task]
+        url = func(progress=progress, **kwargs)
+        if url is None:
+            backend.update(job_id, status="failed", error="Task returned no result")
+        else:
+            backend.update(job_id, status="finished", url=url, partial=[])
+    except Exception as e:
+        print(f"Job {job_id} failed: {e}")
+        backend.update(job_id, status="failed", error=str(e))
+
+
+class ThreadJobBackend:
+    """In-process job backend: jobs run on a thread pool, state lives in memory.
+
+    Job state is only visible to the worker process that accepted the job, so
+    this backend is only suitable when the app runs as a single process.
+    """
+
+    def __init__(self, max_workers=JOB_WORKERS):
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def submit(self, task, **kwargs):
+        if task not in TASKS:
+            raise ValueError(f"Unknown task: {task}")
+        job_id = str(uuid.uuid4())
+        with self.lock:
+            self.prune()
+            job = new_job(job_id, task, split_secrets(kwargs)[0])
+            job["partial"] = deque(maxlen=JOB_PARTIAL_LIMIT)
+            self.jobs[job_id] = job
+        self.executor.submit(run_task, self, job_id, task, kwargs)
+        return job_id
+
+    def prune(self):
+        """Drop finished and failed jobs older than JOB_TTL; called with the lock held."""
+        expired = time.time() - JOB_TTL
+        for job_id in [job_id for job_id, job in self.jobs.items()
+                       if job["status"] in ("finished", "failed") and job["updated"] < expired]:
+            del self.jobs[job_id]
+
+    def update(self, job_id, **fields):
+        with self.lock:
+            job = self.jobs[job_id]
+            if "partial" in fields:
+                job["partial"].clear()
+                job["partial"].extend(fields.pop("partial"))
+            job.update(fields, updated=time.time())
+
+    def report(self, job_id, done, total=None, partial=None):
+        with self.lock:
+            job = self.jobs[job_id]
+            job["done"] = done
+            if total is not None:
+                job["total"] = total
+            if partial is not None:
+                job["partial"].append(partial)
+            job["updated"] = time.time()
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return public_view(dict(job, partial=list(job["partial"]))) if job else None
+
+
+class SQLiteJobBackend:
+    """Persistent job queue stored in SQLite and shared by every worker process.
+
+    Each process runs its own pool of polling threads that claim queued jobs,
+    so a job submitted to one gunicorn worker may run on another and its
+    status is readable from all of them. Jobs with secret arguments are the
+    exception: the secrets stay in the memory of the accepting process and
+    only that process claims them.
+
+    Running jobs are touched every few seconds by the process running them;
+    one left untouched for JOB_STALE_AFTER seconds is requeued, or failed
+    once it has used up JOB_MAX_ATTEMPTS or its secrets are gone.
+    """
+
+    def __init__(self, db_path=JOB_DB_PATH, max_workers=JOB_WORKERS):
+        self.db_path = db_path
+        # Identifies this process as the owner of jobs whose secrets it holds
+        self.instance = uuid.uuid4().hex
+        self.secrets = {}
+        self.running = set()
+        self.lock = threading.Lock()
+        with closing(self.connect()) as conn, conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    task TEXT NOT NULL,
+                    kwargs TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    done INTEGER NOT NULL DEFAULT 0,
+                    total INTEGER,
+                    partial TEXT NOT NULL DEFAULT '[]',
+                    url TEXT,
+                    error TEXT,
+                    created REAL NOT NULL,
+                    updated REAL NOT NULL,
+                    owner TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0
+                )"""
+            )
+            # Queues created before owner and attempts existed
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "owner" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+            if "attempts" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)")
+        self.recover()
+        self.stopped = threading.Event()
+        self.workers = [threading.Thread(target=self.work, daemon=True) for _ in range(max_workers)]
+        self.workers.append(threading.Thread(target=self.heartbeat, daemon=True))
+        for worker in self.workers:
+            worker.start()
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def submit(self, task, **kwargs):
+        if task not in TASKS:
+            raise ValueError(f"Unknown task: {task}")
+        job_id = str(uuid.uuid4())
+        kwargs, secrets = split_secrets(kwargs)
+        job = new_job(job_id, task, kwargs)
+        if secrets:
+            with self.lock:
+                self.secrets[job_id] = secrets
+        with closing(self.connect()) as conn, conn:
+            conn.execute(
+                "INSERT INTO jobs (job_id, task, kwargs, status, created, updated, owner) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, task, json.dumps(kwargs), job["status"], job["created"], job["updated"],
+                 self.instance if secrets else None),
+            )
+        return job_id
+
+    def claim(self):
+        """Atomically move the oldest queued job this process may run to running and return it."""
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT job_id, task, kwargs FROM jobs WHERE status = 'queued' AND (owner IS NULL OR owner = ?) "
+                "ORDER BY created LIMIT 1", (self.instance,)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, updated = ? WHERE job_id = ?",
+                         (time.time(), row["job_id"]))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        with self.lock:
+            self.running.add(row["job_id"])
+            secrets = self.secrets.pop(row["job_id"], {})
+        return row["job_id"], row["task"], dict(json.loads(row["kwargs"]), **secrets)
+
+    def recover(self):
+        """Requeue or fail running jobs whose worker stopped touching them, and drop expired jobs."""
+        now = time.time()
+        with closing(self.connect()) as conn, conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, updated = ? WHERE status = 'running' AND updated < ? "
+                "AND owner IS NOT NULL",
+                ("Worker stopped; the job's credentials were not kept", now, now - JOB_STALE_AFTER),
+            )
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, updated = ? WHERE status = 'running' AND updated < ? "
+                "AND attempts >= ?",
+                ("Worker stopped while running the job", now, now - JOB_STALE_AFTER, JOB_MAX_ATTEMPTS),
+            )
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', updated = ? WHERE status = 'running' AND updated < ?",
+                (now, now - JOB_STALE_AFTER),
+            )
+            # A process that died also takes its queued secrets with it
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, updated = ? WHERE status = 'queued' AND updated < ? "
+                "AND owner IS NOT NULL AND owner != ?",
+                ("Worker stopped; the job's credentials were not kept", now, now - JOB_STALE_AFTER, self.instance),
+            )
+            conn.execute("DELETE FROM jobs WHERE status IN ('finished', 'failed') AND updated < ?", (now - JOB_TTL,))
+
+    def heartbeat(self):
+        """Keep this process's running and queued secret jobs fresh, and sweep up after crashed ones."""
+        while not self.stopped.wait(max(JOB_STALE_AFTER / 5, JOB_POLL_INTERVAL)):
+            with self.lock:
+                job_ids = list(self.running) + list(self.secrets)
+            try:
+                if job_ids:
+                    placeholders = ", ".join("?" for _ in job_ids)
+                    with closing(self.connect()) as conn, conn:
+                        conn.execute(f"UPDATE jobs SET updated = ? WHERE job_id IN ({placeholders})",
+                                     (time.time(), *job_ids))
+                self.recover()
+            except sqlite3.Error as e:
+                print(f"Job queue error: {e}")
+
+    def work(self):
+        while not self.stopped.is_set():
+            try:
+                claimed = self.claim()
+            except sqlite3.Error as e:
+                print(f"Job queue error: {e}")
+                claimed = None
+            if claimed is None:
+                self.stopped.wait(JOB_POLL_INTERVAL)
+                continue
+            job_id, task, kwargs = claimed
+            try:
+                if task not in TASKS:
+                    self.update(job_id, status="failed", error=f"Unknown task: {task}")
+                    continue
+                run_task(self, job_id, task, kwargs)
+            finally:
+                with self.lock:
+                    self.running.discard(job_id)
+
+    def update(self, job_id, **fields):
+        if "partial" in fields:
+            fields["partial"] = json.dumps(fields["partial"], default=str)
+        fields["updated"] = time.time()
+        columns = ", ".join(f"{column} = ?" for column in fields)
+        with closing(self.connect()) as conn, conn:
+            conn.execute(f"UPDATE jobs SET {columns} WHERE job_id = ?", (*fields.values(), job_id))
+
+    def report(self, job_id, done, total=None, partial=None):
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            if partial is None:
+                conn.execute(
+                    "UPDATE jobs SET done = ?, total = COALESCE(?, total), updated = ? WHERE job_id = ?",
+                    (done, total, time.time(), job_id),
+                )
+            else:
+                row = conn.execute("SELECT partial FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+                partials = (json.loads(row["partial"]) + [partial])[-JOB_PARTIAL_LIMIT:] if JOB_PARTIAL_LIMIT else []
+                conn.execute(
+                    "UPDATE jobs SET done = ?, total = COALESCE(?, total), partial = ?, updated = ? WHERE job_id = ?",
+                    (done, total, json.dumps(partials, default=str), time.time(), job_id),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def get(self, job_id):
+        with closing(self.connect()) as conn, conn:
+            row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["partial"] = json.loads(job["partial"])
+        for column in ("owner", "attempts"):
+            job.pop(column, None)
+        return public_view(job)
+
+
+BACKENDS = {
+    "thread": ThreadJobBackend,
+    "sqlite": SQLiteJobBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_job_backend():
+    """Return the process-wide job backend selected by the job_backend env var."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = BACKENDS[JOB_BACKEND]()
+        return _backend
+
+
+def submit_job(task, **kwargs):
+    return get_job_backend().submit(task, **kwargs)
+
+
+def get_job(job_id):
+    return get_job_backend().get(job_id)
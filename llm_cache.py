@@ -0,0 +1,247 @@
+import os
+import json
+import asyncio
+import time
+import sqlite3
+import hashlib
+import threading
+from dotenv import load_dotenv
+from llm_dispatcher import send_prompt
+
+load_dotenv()
+
+LLM_CACHE_ENABLED = os.getenv("llm_cache_enabled", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_PATH = os.getenv("llm_cache_path", "./llm_cache.db")
+LLM_CACHE_TTL = float(os.getenv("llm_cache_ttl", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_BYTES = int(os.getenv("llm_cache_max_bytes", str(256 * 1024 * 1024)))
+# Hits only read the cache file; their counters and access times are buffered
+# in memory and written in one transaction at most this often (in seconds)
+LLM_CACHE_FLUSH_INTERVAL = float(os.getenv("llm_cache_flush_interval", "5"))
+
+_init_lock = threading.Lock()
+_initialized = set()
+
+_pending_lock = threading.Lock()
+_pending_accessed = {}
+_pending_stats = {}
+_last_flush = time.monotonic()
+
+
+def connect(db_path=None):
+    db_path = db_path or LLM_CACHE_PATH
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    with _init_lock:
+        if db_path not in _initialized:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    accessed REAL NOT NULL
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+            conn.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            _initialized.add(db_path)
+    return conn
+
+
+def cache_key(model_name, config, prompt, variant=None):
+    """Content address of a prompt: hash of model name, generation config and prompt text.
+
+    variant distinguishes deliberately repeated prompts that must not share a response.
+    """
+    payload = json.dumps([model_name, config or {}, prompt, variant], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def bump(conn, name, count=1):
+    conn.execute(
+        "INSERT INTO stats (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + ?",
+        (name, count, count),
+    )
+
+
+def record(name, key=None, accessed=None):
+    """Buffer a counter bump (and the access time of a hit), flushing when the interval is up."""
+    with _pending_lock:
+        _pending_stats[name] = _pending_stats.get(name, 0) + 1
+        if key is not None:
+            _pending_accessed[key] = accessed
+        due = time.monotonic() - _last_flush >= LLM_CACHE_FLUSH_INTERVAL
+    if due:
+        try:
+            flush()
+        except sqlite3.Error as e:
+            print(f"LLM cache flush failed: {e}")
+
+
+def flush(conn=None):
+    """Write buffered counters and access times to the cache file in one transaction."""
+    global _last_flush
+    with _pending_lock:
+        accessed = list(_pending_accessed.items())
+        stats = list(_pending_stats.items())
+        _pending_accessed.clear()
+        _pending_stats.clear()
+        _last_flush = time.monotonic()
+    if not (accessed or stats):
+        return
+    own = conn is None
+    conn = connect() if own else conn
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany("UPDATE responses SET accessed = MAX(accessed, ?) WHERE key = ?",
+                         [(when, key) for key, when in accessed])
+        for name, count in stats:
+            bump(conn, name, count)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        if own:
+            conn.close()
+
+
+def lookup(key):
+    """Return the cached response for key, or None when missing or expired."""
+    conn = connect()
+    try:
+        now = time.time()
+        row = conn.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+    finally:
+        conn.close()
+    # Expired rows are left for evict() so that a lookup never writes
+    if row is None or (LLM_CACHE_TTL > 0 and now - row[1] > LLM_CACHE_TTL):
+        record("misses")
+        return None
+    record("hits", key, now)
+    return row[0]
+
+
+def store(key, model_name, response):
+    conn = connect()
+    try:
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        conn.execute(
+            "INSERT OR REPLACE INTO responses (key, model, response, size, created, accessed) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (key, model_name, response, size, now, now),
+        )
+        flush(conn)
+        evict(conn)
+    finally:
+        conn.close()
+
+
+def evict(conn):
+    """Drop expired entries, then least recently used ones until under the size cap."""
+    if LLM_CACHE_TTL > 0:
+        conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - LLM_CACHE_TTL,))
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+    if total <= LLM_CACHE_MAX_BYTES:
+        return
+    excess = total - LLM_CACHE_MAX_BYTES
+    freed = 0
+    victims = []
+    for key, size in conn.execute("SELECT key, size FROM responses ORDER BY accessed"):
+        victims.append((key,))
+        freed += size
+        if freed >= excess:
+            break
+    conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+    bump(conn, "evictions", len(victims))
+
+
+def cached_call(model_name, config, prompt, compute, use_cache=True, variant=None, accept=None):
+    """Return compute() for prompt, serving and filling the on-disk cache.
+
+    Pass use_cache=False to bypass the cache for a single request. With
+    accept, only responses for which accept(response) is true are stored or
+    served from the cache; others are returned once and asked again next time.
+    """
+    if not (use_cache and LLM_CACHE_ENABLED):
+        return compute()
+    key = cache_key(model_name, config, prompt, variant)
+    try:
+        cached = lookup(key)
+    except sqlite3.Error as e:
+        print(f"LLM cache lookup failed: {e}")
+        return compute()
+    if cached is not None and (accept is None or accept(cached)):
+        return cached
+    response = compute()
+    if accept is not None and not accept(response):
+        return response
+    try:
+        store(key, model_name, response)
+    except sqlite3.Error as e:
+        print(f"LLM cache store failed: {e}")
+    return response
+
+
+async def acached_call(model_name, config, prompt, compute, use_cache=True, variant=None):
+    """Async variant of cached_call; compute is a zero-argument coroutine function."""
+    if not (use_cache and LLM_CACHE_ENABLED):
+        return await compute()
+    key = cache_key(model_name, config, prompt, variant)
+    try:
+        cached = await asyncio.to_thread(lookup, key)
+    except sqlite3.Error as e:
+        print(f"LLM cache lookup failed: {e}")
+        return await compute()
+    if cached is not None:
+        return cached
+    response = await compute()
+    try:
+        await asyncio.to_thread(store, key, model_name, response)
+    except sqlite3.Error as e:
+        print(f"LLM cache store failed: {e}")
+    return response
+
+
+def model_identity(model):
+    """Model name and generation config of a genai.GenerativeModel (or a stand-in)."""
+    name = getattr(model, "model_name", type(model).__name__)
+    config = getattr(model, "_generation_config", None)
+    return name, config
+
+
+def cached_send(model, prompt, use_cache=True, variant=None, accept=None):
+    """Cached equivalent of llm_dispatcher.send_prompt."""
+    name, config = model_identity(model)
+    return cached_call(name, config, prompt, lambda: send_prompt(model, prompt),
+                       use_cache=use_cache, variant=variant, accept=accept)
+
+
+def cache_stats():
+    """Hit/miss counters and current size, shared by every process using the cache file.
+
+    Counters buffered by other processes show up once they flush.
+    """
+    conn = connect()
+    try:
+        flush(conn)
+        stats = dict(conn.execute("SELECT name, value FROM stats").fetchall())
+        entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+    finally:
+        conn.close()
+    hits = stats.get("hits", 0)
+    misses = stats.get("misses", 0)
+    lookups = hits + misses
+    return {
+        "enabled": LLM_CACHE_ENABLED,
+        "hits": hits,
+        "misses": misses,
+        "evictions": stats.get("evictions", 0),
+        "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        "api_calls_saved": hits,
+        "entries": entries,
+        "size_bytes": size,
+        "max_bytes": LLM_CACHE_MAX_BYTES,
+    }
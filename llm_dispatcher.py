@@ -0,0 +1,262 @@
+import os
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LLM_MAX_CONCURRENCY = int(os.getenv("llm_max_concurrency", "8"))
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("llm_requests_per_minute", "60"))
+LLM_MAX_RETRIES = int(os.getenv("llm_max_retries", "5"))
+LLM_BACKOFF_BASE = float(os.getenv("llm_backoff_base", "1.0"))
+LLM_BACKOFF_MAX = float(os.getenv("llm_backoff_max", "30.0"))
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Thread-safe token bucket limiting how many requests start per minute."""
+
+    def __init__(self, requests_per_minute, burst=None):
+        self.rate = requests_per_minute / 60.0
+        self.capacity = float(burst if burst is not None else max(1, int(requests_per_minute // 6)))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available, then consume it."""
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_for = (1 - self.tokens) / self.rate
+            time.sleep(wait_for)
+
+
+class AdaptiveTokenBucket(TokenBucket):
+    """Token bucket whose rate adapts to the API: halved on a 429, raised slowly on success.
+
+    The rate stays between min_requests_per_minute and the configured maximum.
+    """
+
+    def __init__(self, requests_per_minute, min_requests_per_minute=None, burst=None):
+        super().__init__(requests_per_minute, burst=burst)
+        self.max_rate = self.rate
+        self.min_rate = (min_requests_per_minute or max(1.0, requests_per_minute / 20)) / 60.0
+
+    def on_success(self):
+        with self.lock:
+            # Additive increase: regain the full rate after roughly 20 successful calls
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+    def on_throttle(self):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0.0)
+
+
+def status_code_of(error):
+    """Best-effort extraction of an HTTP status code from an API client exception."""
+    for attr in ("code", "status_code", "status"):
+        value = getattr(error, attr, None)
+        if callable(value):
+            try:
+                value = value()
+            except Exception:
+                value = None
+        if isinstance(value, int):
+            return value
+        value = getattr(value, "value", value)
+        if isinstance(value, int):
+            return value
+    response = getattr(error, "response", None)
+    if response is not None and isinstance(getattr(response, "status_code", None), int):
+        return response.status_code
+    return None
+
+
+def is_throttled(error):
+    """Return True when the API rejected the call for exceeding its rate limit."""
+    code = status_code_of(error)
+    if code is not None:
+        return code == 429
+    message = str(error).lower()
+    return "429" in message or "resource has been exhausted" in message or "rate limit" in message
+
+
+def is_retryable(error):
+    """Return True for rate limit (429) and server side (5xx) failures."""
+    code = status_code_of(error)
+    if code is not None:
+        return code in RETRYABLE_STATUS_CODES
+    return is_throttled(error)
+
+
+def backoff_delay(attempt, base=None, cap=None):
+    """Full-jitter exponential backoff for the given retry attempt (0 based)."""
+    base = LLM_BACKOFF_BASE if base is None else base
+    cap = LLM_BACKOFF_MAX if cap is None else cap
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def call_with_retry(handler, prompt, bucket=None, max_retries=None):
+    """Call handler(prompt), retrying retryable errors with jittered backoff."""
+    max_retries = LLM_MAX_RETRIES if max_retries is None else max_retries
+    attempt = 0
+    while True:
+        if bucket is not None:
+            bucket.acquire()
+        try:
+            result = handler(prompt)
+        except Exception as e:
+            if isinstance(bucket, AdaptiveTokenBucket) and is_throttled(e):
+                bucket.on_throttle()
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+            delay = backoff_delay(attempt)
+            print(f"Retryable LLM error ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+            attempt += 1
+        else:
+            if isinstance(bucket, AdaptiveTokenBucket):
+                bucket.on_success()
+            return result
+
+
+def send_prompt(model, prompt):
+    """Send a single prompt in a fresh chat session and return the response text."""
+    convo = model.start_chat()
+    convo.send_message(prompt)
+    return convo.last.text
+
+
+def dispatch(prompts, handler, max_concurrency=None, requests_per_minute=None, max_retries=None,
+             on_result=None, return_exceptions=False, collect=True, adaptive=False):
+    """Run handler over prompts concurrently and return the results in input order.
+
+    prompts may be any iterable, including a lazy generator; at most
+    max_concurrency prompts are in flight at a time. on_result(index, result)
+    is called from the calling thread as each prompt completes. With
+    collect=False results are only passed to on_result and None is returned,
+    so memory does not grow with the number of prompts. adaptive=True lets the
+    request rate back off on 429s and recover on success instead of staying fixed.
+    """
+    max_concurrency = LLM_MAX_CONCURRENCY if max_concurrency is None else max(1, int(max_concurrency))
+    requests_per_minute = LLM_REQUESTS_PER_MINUTE if requests_per_minute is None else requests_per_minute
+    bucket_class = AdaptiveTokenBucket if adaptive else TokenBucket
+    bucket = bucket_class(requests_per_minute) if requests_per_minute else None
+
+    results = {}
+    errors = {}
+    prompt_iter = enumerate(prompts)
+    exhausted = False
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        pending = {}
+        while True:
+            while not exhausted and len(pending) < max_concurrency and not errors:
+                try:
+                    index, prompt = next(prompt_iter)
+                except StopIteration:
+                    exhausted = True
+                    break
+                future = executor.submit(call_with_retry, handler, prompt, bucket, max_retries)
+                pending[future] = index
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    if not return_exceptions:
+                        errors[index] = e
+                        continue
+                    result = e
+                if collect:
+                    results[index] = result
+                if on_result is not None:
+                    on_result(index, result)
+
+    if errors:
+        raise errors[min(errors)]
+    if not collect:
+        return None
+    return [results[index] for index in range(len(results))]
+
+
+def progress_reporter(progress, total, done=0):
+    """Adapt a job progress callback(done, total, partial) to dispatch's on_result hook.
+
+    done is the number of rows already finished, e.g. when resuming from a checkpoint.
+    """
+    if progress is None:
+        return None
+    completed = [done]
+
+    def on_result(index, result):
+        completed[0] += 1
+        progress(completed[0], total, {"row": done + index, "result": result})
+
+    return on_result
+
+
+class FakeStatusError(Exception):
+    """Error raised by FakeModel carrying an HTTP style status code."""
+
+    def __init__(self, code, message=""):
+        super().__init__(message or f"fake error {code}")
+        self.code = code
+
+
+class FakeModel:
+    """Local stand-in for genai.GenerativeModel that injects latency and errors.
+
+    Use with send_prompt/dispatch to exercise the dispatcher without calling Gemini.
+    """
+
+    def __init__(self, latency=(0.0, 0.0), error_rate=0.0, error_codes=(429, 503), respond=None, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_codes = error_codes
+        self.respond = respond or (lambda prompt: f"response to: {prompt}")
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def start_chat(self):
+        return _FakeChat(self)
+
+
+class _FakeChat:
+    def __init__(self, model):
+        self.model = model
+        self.last = None
+
+    def send_message(self, prompt):
+        model = self.model
+        with model.lock:
+            model.calls += 1
+            delay = model.random.uniform(*model.latency)
+            fail = model.random.random() < model.error_rate
+            code = model.random.choice(model.error_codes) if fail else None
+        time.sleep(delay)
+        if fail:
+            raise FakeStatusError(code)
+        self.last = _FakeResponse(model.respond(prompt))
+        return self.last
+
+
+class _FakeResponse:
+    def __init__(self, text):
+        self.text = text
@@ -0,0 +1,101 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from botocore.exceptions import ClientError
+from dotenv import load_dotenv
+from text_utils import estimate_tokens
+
+load_dotenv()
+
+LOB_CACHE_SIZE = int(os.getenv("lob_cache_size", "32"))
+# LOB reference text above this many (estimated) tokens is compacted before it goes into prompts
+LOB_PROMPT_TOKEN_BUDGET = int(os.getenv("lob_prompt_token_budget", "6000"))
+# Example values kept per field when a LOB file has to be compacted
+LOB_VALUES_PER_FIELD = int(os.getenv("lob_values_per_field", "5"))
+
+FIELD_LINE = re.compile(r"^\s*([^:=\t]{1,80}?)\s*[:=\t]\s*(.*)$")
+
+
+def compact_reference(text, budget=LOB_PROMPT_TOKEN_BUDGET, values_per_field=LOB_VALUES_PER_FIELD):
+    """Shrink a LOB reference file into one line per field with a few example values.
+
+    Lines like "Field: a, b, c" or "Field = a | b" keep the field name and the
+    first values_per_field values; other lines are kept once. The result is
+    truncated at a line boundary if it still exceeds the token budget.
+    """
+    lines = []
+    seen = set()
+    for raw in text.splitlines():
+        line = " ".join(raw.split())
+        if not line or line in seen:
+            continue
+        seen.add(line)
+        match = FIELD_LINE.match(line)
+        if match:
+            field, values = match.groups()
+            values = [value.strip() for value in re.split(r"[,|;/]", values) if value.strip()]
+            more = len(values) - values_per_field
+            line = f"{field}: {', '.join(values[:values_per_field])}" + (f" (+{more} more)" if more > 0 else "")
+        lines.append(line)
+    compacted = []
+    used = 0
+    for line in lines:
+        cost = estimate_tokens(line) + 1
+        if used + cost > budget:
+            break
+        compacted.append(line)
+        used += cost
+    return "\n".join(compacted)
+
+
+class LobReference:
+    def __init__(self, lob, etag, text):
+        self.lob = lob
+        self.etag = etag
+        self.text = text
+        self.tokens = estimate_tokens(text)
+        # Text that goes into prompts: the file itself, or a compact field summary if it is too large
+        self.prompt_text = text if self.tokens <= LOB_PROMPT_TOKEN_BUDGET else compact_reference(text)
+        self.prompt_tokens = estimate_tokens(self.prompt_text)
+
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def is_not_modified(error):
+    code = error.response.get("Error", {}).get("Code")
+    status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+    return code in ("304", "NotModified") or status == 304
+
+
+def remember(key, reference):
+    with _lock:
+        _cache[key] = reference
+        _cache.move_to_end(key)
+        while len(_cache) > LOB_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def get_lob_reference(s3, bucket, lob):
+    """Return the decoded reference for {lob}.txt, downloading it only when its ETag changed."""
+    key = (bucket, lob)
+    with _lock:
+        cached = _cache.get(key)
+    try:
+        if cached is None:
+            response = s3.get_object(Bucket=bucket, Key=f"{lob}.txt")
+        else:
+            response = s3.get_object(Bucket=bucket, Key=f"{lob}.txt", IfNoneMatch=cached.etag)
+    except ClientError as e:
+        if cached is not None and is_not_modified(e):
+            # Re-inserted, since another thread may have evicted it after the lookup
+            remember(key, cached)
+            return cached
+        raise
+    reference = LobReference(lob, response.get("ETag"), response["Body"].read().decode("utf-8"))
+    if reference.prompt_text is not reference.text:
+        print(f"LOB {lob} compacted from {reference.tokens} to {reference.prompt_tokens} tokens")
+    remember(key, reference)
+    return reference
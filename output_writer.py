@@ -0,0 +1,317 @@
+import io
+import os
+import csv
+import json
+import time
+import hashlib
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# "multipart" streams parts straight to S3, "spool" appends to a local file and uploads it at the end
+OUTPUT_WRITER = os.getenv("output_writer", "multipart")
+OUTPUT_CHECKPOINT_DIR = os.getenv("output_checkpoint_dir", "./checkpoints")
+# S3 requires every part but the last to be at least 5 MiB
+OUTPUT_PART_SIZE = max(5 * 1024 * 1024, int(os.getenv("output_part_size", str(8 * 1024 * 1024))))
+# Checkpoints not resumed for this many seconds are dropped and their uploads aborted
+OUTPUT_CHECKPOINT_TTL = float(os.getenv("output_checkpoint_ttl", str(7 * 24 * 3600)))
+
+
+def csv_line(values):
+    """Format one CSV record the way DataFrame.to_csv would."""
+    with io.StringIO() as buffer:
+        csv.writer(buffer, lineterminator="\n").writerow(values)
+        return buffer.getvalue()
+
+
+def checkpoint_id_for(*parts):
+    """Stable checkpoint id derived from a job's inputs, so re-running the same job resumes it."""
+    return hashlib.sha256(json.dumps(parts, default=str).encode("utf-8")).hexdigest()[:32]
+
+
+def discard_checkpoint(s3, state):
+    """Abort the multipart upload and remove the local files of a checkpoint that will not be resumed."""
+    if state.get("upload_id"):
+        try:
+            s3.abort_multipart_upload(Bucket=state["bucket"], Key=state["key"], UploadId=state["upload_id"])
+        except Exception as e:
+            print(f"Could not abort the upload of {state['key']}: {e}")
+    for path in (state.get("buffer_path"), state.get("spool_path"), state.get("journal_path")):
+        if path and os.path.exists(path):
+            os.remove(path)
+
+
+def expire_checkpoints(s3, max_age=None):
+    """Drop checkpoints that have not been written for max_age seconds, so abandoned uploads do not pile up."""
+    max_age = OUTPUT_CHECKPOINT_TTL if max_age is None else max_age
+    if not os.path.isdir(OUTPUT_CHECKPOINT_DIR):
+        return
+    expired = time.time() - max_age
+    for name in os.listdir(OUTPUT_CHECKPOINT_DIR):
+        checkpoint_path = os.path.join(OUTPUT_CHECKPOINT_DIR, name)
+        if not name.endswith(".json") or os.path.getmtime(checkpoint_path) >= expired:
+            continue
+        try:
+            with open(checkpoint_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            continue
+        print(f"Dropping checkpoint of {state.get('key')}, not resumed for {max_age:.0f}s")
+        discard_checkpoint(s3, state)
+        os.remove(checkpoint_path)
+
+
+class IncrementalWriter:
+    """Base class: accepts rows out of order, emits them in row order, and checkpoints progress.
+
+    next_row is the first row not yet durably written; after a resume callers
+    skip inputs before it and keep using absolute row indexes. extra is a
+    small JSON-serializable dict saved with every checkpoint and restored on
+    resume, for caller state that must match the rows written. journal is an
+    append-only list of strings for state that grows with the rows (e.g. row
+    hashes): entries go to a sidecar file and only its length is checkpointed.
+    """
+
+    def __init__(self, checkpoint_id=None):
+        self.checkpoint_path = (os.path.join(OUTPUT_CHECKPOINT_DIR, f"{checkpoint_id}.json")
+                                if checkpoint_id else None)
+        self.pending = {}
+        self.next_row = 0
+        self.buffered_row = 0
+        self.extra = {}
+        self.journal = []
+        self.journal_path = None
+        self.journal_file = None
+        self.lock = threading.Lock()
+
+    def load_checkpoint(self):
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return None
+        with open(self.checkpoint_path) as f:
+            return json.load(f)
+
+    def save_checkpoint(self, state):
+        if not self.checkpoint_path:
+            return
+        os.makedirs(OUTPUT_CHECKPOINT_DIR, exist_ok=True)
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def remove_checkpoint(self):
+        if self.journal_file is not None:
+            self.journal_file.close()
+            os.remove(self.journal_path)
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    def open_journal(self, state=None):
+        """Reopen the journal sidecar when resuming, cut back to the length checkpointed in state.
+
+        A new journal file is only created by the first record().
+        """
+        if not self.checkpoint_path:
+            return
+        self.journal_path = f"{self.checkpoint_path[:-len('.json')]}.journal"
+        if state and state.get("journal_path") == self.journal_path and os.path.exists(self.journal_path):
+            self.journal_file = open(self.journal_path, "r+b")
+            self.journal_file.truncate(state["journal_offset"])
+            self.journal = self.journal_file.read().decode("utf-8").splitlines()
+
+    def journal_state(self):
+        """Sync the journal and return the checkpoint fields that describe it."""
+        if self.journal_file is None:
+            return {}
+        self.journal_file.flush()
+        os.fsync(self.journal_file.fileno())
+        return {"journal_path": self.journal_path, "journal_offset": self.journal_file.tell()}
+
+    def record(self, entry):
+        """Append entry to the journal; it is kept if the next checkpoint is reached."""
+        with self.lock:
+            self.journal.append(entry)
+            if self.journal_path is None:
+                return
+            if self.journal_file is None:
+                self.journal_file = open(self.journal_path, "w+b")
+            self.journal_file.write(f"{entry}\n".encode("utf-8"))
+
+    def write(self, index, text):
+        """Queue the text for row index; it is emitted once all earlier rows have arrived."""
+        with self.lock:
+            if index < self.buffered_row:
+                return
+            self.pending[index] = text
+            while self.buffered_row in self.pending:
+                text = self.pending.pop(self.buffered_row)
+                self.buffered_row += 1
+                self.emit(text)
+
+    def emit(self, text):
+        raise NotImplementedError
+
+
+class MultipartCsvWriter(IncrementalWriter):
+    """Streams output to an S3 multipart upload, one part per OUTPUT_PART_SIZE bytes.
+
+    Rows of the part being filled are appended to a local buffer file that is
+    part of the checkpoint, so a resume continues after the last row written
+    even when the whole output is smaller than one part.
+    """
+
+    def __init__(self, s3, bucket, key, checkpoint_id=None, header=None, part_size=OUTPUT_PART_SIZE):
+        super().__init__(checkpoint_id)
+        self.s3 = s3
+        self.bucket = bucket
+        self.part_size = part_size
+        state = self.load_checkpoint()
+        if state and state["bucket"] == bucket and os.path.exists(state.get("buffer_path") or "") \
+                and self.upload_exists(state):
+            self.key = state["key"]
+            self.upload_id = state["upload_id"]
+            self.parts = state["parts"]
+            self.next_row = self.buffered_row = state["next_row"]
+            self.extra = state.get("extra", {})
+            self.open_journal(state)
+            self.buffer_path = state["buffer_path"]
+            self.buffer = open(self.buffer_path, "r+b")
+            # Drop anything written after the last checkpoint
+            self.buffer.truncate(state["buffer_offset"])
+            self.buffer.seek(state["buffer_offset"])
+            print(f"Resuming upload of {self.key} from row {self.next_row}")
+        else:
+            if state:
+                discard_checkpoint(s3, state)
+            self.key = key
+            self.upload_id = s3.create_multipart_upload(Bucket=bucket, Key=key)["UploadId"]
+            self.parts = []
+            if self.checkpoint_path:
+                os.makedirs(OUTPUT_CHECKPOINT_DIR, exist_ok=True)
+                self.open_journal()
+                self.buffer_path = f"{self.checkpoint_path[:-len('.json')]}.part"
+                self.buffer = open(self.buffer_path, "w+b")
+            else:
+                self.buffer_path = None
+                self.buffer = io.BytesIO()
+            if header is not None:
+                self.buffer.write(header.encode("utf-8"))
+            self.checkpoint()
+
+    def upload_exists(self, state):
+        try:
+            self.s3.list_parts(Bucket=state["bucket"], Key=state["key"], UploadId=state["upload_id"])
+            return True
+        except Exception as e:
+            print(f"Checkpointed upload is gone, starting over: {e}")
+            return False
+
+    def checkpoint(self):
+        if not self.checkpoint_path:
+            return
+        self.buffer.flush()
+        os.fsync(self.buffer.fileno())
+        self.next_row = self.buffered_row
+        self.save_checkpoint({"bucket": self.bucket, "key": self.key, "upload_id": self.upload_id,
+                              "parts": self.parts, "next_row": self.next_row, "buffer_path": self.buffer_path,
+                              "buffer_offset": self.buffer.tell(), "extra": self.extra, **self.journal_state()})
+
+    def emit(self, text):
+        self.buffer.write(text.encode("utf-8"))
+        if self.buffer.tell() >= self.part_size:
+            self.flush_part()
+        else:
+            self.checkpoint()
+
+    def flush_part(self):
+        part_number = len(self.parts) + 1
+        self.buffer.seek(0)
+        response = self.s3.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                       PartNumber=part_number, Body=self.buffer.read())
+        self.parts.append({"PartNumber": part_number, "ETag": response["ETag"]})
+        # The checkpoint records the part before the buffer is emptied; a crash in
+        # between re-sends the same part number, which S3 overwrites
+        self.buffer.seek(0)
+        self.checkpoint()
+        self.buffer.truncate(0)
+        self.next_row = self.buffered_row
+
+    def close(self):
+        """Upload the remaining buffer, complete the upload and return the HTTP status."""
+        with self.lock:
+            if self.pending:
+                raise ValueError(f"Missing output rows before row {min(self.pending)}")
+            if self.buffer.tell() or not self.parts:
+                self.flush_part()
+            response = self.s3.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                                         MultipartUpload={"Parts": self.parts})
+            self.buffer.close()
+            if self.buffer_path:
+                os.remove(self.buffer_path)
+            self.remove_checkpoint()
+            return response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+
+
+class SpoolCsvWriter(IncrementalWriter):
+    """Appends output to a local spool file and uploads it to S3 on close."""
+
+    def __init__(self, s3, bucket, key, checkpoint_id=None, header=None):
+        super().__init__(checkpoint_id)
+        self.s3 = s3
+        self.bucket = bucket
+        state = self.load_checkpoint()
+        if state and state["bucket"] == bucket and os.path.exists(state["spool_path"]):
+            self.key = state["key"]
+            self.spool_path = state["spool_path"]
+            self.next_row = self.buffered_row = state["next_row"]
+            self.extra = state.get("extra", {})
+            self.open_journal(state)
+            self.file = open(self.spool_path, "r+b")
+            # Drop anything written after the last checkpoint
+            self.file.truncate(state["offset"])
+            self.file.seek(state["offset"])
+            print(f"Resuming spool of {self.key} from row {self.next_row}")
+        else:
+            self.key = key
+            os.makedirs(OUTPUT_CHECKPOINT_DIR, exist_ok=True)
+            self.spool_path = os.path.join(OUTPUT_CHECKPOINT_DIR, f"{checkpoint_id or os.getpid()}_{os.path.basename(key)}")
+            self.file = open(self.spool_path, "w+b")
+            self.open_journal()
+            if header is not None:
+                self.file.write(header.encode("utf-8"))
+            self.checkpoint()
+
+    def checkpoint(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.next_row = self.buffered_row
+        self.save_checkpoint({"bucket": self.bucket, "key": self.key, "spool_path": self.spool_path,
+                              "offset": self.file.tell(), "next_row": self.next_row, "extra": self.extra,
+                              **self.journal_state()})
+
+    def emit(self, text):
+        self.file.write(text.encode("utf-8"))
+        self.checkpoint()
+
+    def close(self):
+        with self.lock:
+            if self.pending:
+                raise ValueError(f"Missing output rows before row {min(self.pending)}")
+            self.file.close()
+            self.s3.upload_file(self.spool_path, self.bucket, self.key)
+            os.remove(self.spool_path)
+            self.remove_checkpoint()
+            return 200
+
+
+WRITERS = {
+    "multipart": MultipartCsvWriter,
+    "spool": SpoolCsvWriter,
+}
+
+
+def open_output_writer(s3, bucket, key, checkpoint_id=None, header=None):
+    """Open the configured incremental writer, resuming from checkpoint_id if one exists."""
+    expire_checkpoints(s3)
+    return WRITERS[OUTPUT_WRITER](s3, bucket, key, checkpoint_id=checkpoint_id, header=header)
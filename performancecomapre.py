@@ -1,11 +1,12 @@
 import json
 import time
 import boto3
-from openpyxl import Workbook
-from openpyxl.styles import PatternFill, Font
+import xlsxwriter
 from io import BytesIO
 import os
-from openpyxl.styles import PatternFill, Font, Border, Side
+import numpy as np
+import pandas as pd
+from comparison_policy import apply_policy, load_policy, overall_verdict, weighted_change
 
 # Initialize S3 client
 AWS_ACCESS_KEY_ID = os.getenv("aws_access_key_id")
@@ -17,20 +18,32 @@ s3_client = boto3.client(
     # aws_session_token=AWS_SESSION_TOKEN,
 )  # Replace with your actual S3 bucket name
 
-# Define a border style
-thin_border = Border(
-    left=Side(style="thin"),
-    right=Side(style="thin"),
-    top=Side(style="thin"),
-    bottom=Side(style="thin"),
-)
-
-
-def apply_border_to_table(sheet, min_row, max_row, min_col, max_col):
-    """Apply borders to all cells in the specified range."""
-    for row in sheet.iter_rows(min_row=min_row, max_row=max_row, min_col=min_col, max_col=max_col):
-        for cell in row:
-            cell.border = thin_border
+COMPARE_METRICS = ["minResponseTime", "maxResponseTime", "meanResponseTime",
+                   "percentiles1", "percentiles2", "percentiles3", "percentiles4",
+                   "standardDeviation"]
+# Request counts are flattened too, so comparisons can weigh transactions by traffic
+FLATTEN_METRICS = ["numberOfRequests"] + COMPARE_METRICS
+INFO_COLUMNS = ["name", "type", "depth"]
+# "xlsx" renders the report workbook; "csv" and "json" upload the comparison table without rendering
+PERFORMANCE_REPORT_FORMAT = os.getenv("performance_report_format", "xlsx")
+REPORT_CONTENT_TYPES = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv",
+    "json": "application/json",
+}
+
+# Cell formats of the report; each workbook creates them once and every cell shares them
+REPORT_FORMATS = {
+    "header": {"bold": True, "bg_color": "#51ABD2", "border": 1},
+    # A different color for the "Delta" columns
+    "delta_header": {"bold": True, "bg_color": "#d3d0d0", "border": 1},
+    "body": {"border": 1},
+    "faster": {"bg_color": "#0c880e", "border": 1},  # Green for Fast
+    "slower": {"bg_color": "#f4eb36", "border": 1},  # Yellow for Slow
+    "fail": {"bg_color": "#e0453a", "border": 1},  # Red for regressions beyond the fail band
+    "summary_label": {"bold": True, "bg_color": "#51ABD2", "border": 1},
+    "summary_value": {"bold": True, "bg_color": "#65E823", "border": 1},
+}
 
 
 def metric_to_sheet_name(metric):
@@ -44,152 +57,244 @@ def metric_to_sheet_name(metric):
     return metric_to_name_map.get(metric, metric)
 
 
-def compare_stats(stats1, stats2, metric, sheet, row, summary):
-    """Compare a specific metric between two JSON objects and write the result to the Excel sheet."""
-    value1_ok = stats1[metric]["ok"]
-    value2_ok = stats2[metric]["ok"]
-    value1_ko = stats1[metric]["ko"]
-    value2_ko = stats2[metric]["ko"]
-
-    diff_ok = value2_ok - value1_ok
-    diff_ko = value2_ko - value1_ko
-
-    safe_value1_ok = value1_ok if value1_ok != 0 else 1e-10
-    diff_delta = (value2_ok - safe_value1_ok) / safe_value1_ok * 100
-    rounded_diff_delta = round(diff_delta, 2)
-    formatted_value = f"{rounded_diff_delta:.2f}%"
-
-    # Keep track of which run is better based on the delta
-    if rounded_diff_delta < 0:
-        summary['faster'] += 1  # File 2 is faster
-    elif rounded_diff_delta > 0:
-        summary['slower'] += 1  # File 1 is slower
+def flatten_stats(tree, metrics=FLATTEN_METRICS):
+    """Flatten a Gatling stats.json tree, nested groups included, into one row per node.
+
+    Rows are indexed by the path of contents keys ("" for the root, "group/request"
+    below it) in depth-first order, with one column per metric and ok/ko value.
+    """
+    keys, names, types, depths, values = [], [], [], [], []
+    empty = {}
+    stack = [("", tree, 0)]
+    while stack:
+        key, node, depth = stack.pop()
+        stats = node.get("stats", empty)
+        keys.append(key)
+        names.append(stats.get("name", node.get("name")))
+        types.append(node.get("type"))
+        depths.append(depth)
+        row = []
+        for metric in metrics:
+            metric_values = stats.get(metric) or empty
+            row.append(metric_values.get("ok"))
+            row.append(metric_values.get("ko"))
+        values.append(row)
+        children = list(node.get("contents", empty).items())
+        for child_key, child in reversed(children):
+            stack.append((f"{key}/{child_key}" if key else child_key, child, depth + 1))
+    return stats_table(keys, names, types, depths, values, metrics)
+
+
+def stats_table(keys, names, types, depths, values, metrics=FLATTEN_METRICS):
+    """Build the flattened table from per-node columns; values holds one ok/ko row per node."""
+    value_columns = [f"{metric}_{side}" for metric in metrics for side in ("ok", "ko")]
+    # Gatling writes "-" for values it could not compute
+    numbers = pd.DataFrame(values, columns=value_columns, index=pd.Index(keys, name="key"))
+    numbers = numbers.apply(pd.to_numeric, errors="coerce")
+    table = pd.DataFrame({"name": names, "type": types, "depth": depths}, index=numbers.index)
+    return pd.concat([table, numbers], axis=1)
+
+
+def compare_stats(table1, table2):
+    """Compare every metric of two flattened runs in one pass.
+
+    Returns a table indexed like the inputs (run 1 order, then nodes only in
+    run 2) with, for each value column c, c_1, c_2, c_delta (run 2 - run 1)
+    and c_pct (delta percentage rounded to 2 places, NaN from a zero
+    baseline), plus a status of "both", "missing" (only in run 1) or "new"
+    (only in run 2).
+    """
+    keys = table1.index.append(table2.index.difference(table1.index, sort=False))
+    value_columns = [column for column in table1.columns if column not in INFO_COLUMNS and column in table2.columns]
+    before = table1.reindex(keys)
+    after = table2.reindex(keys)
+    info = before[INFO_COLUMNS].combine_first(after[INFO_COLUMNS])
+    in_first = np.arange(len(keys)) < len(table1)
+    in_second = table2.index.get_indexer(keys) >= 0
+    status = pd.Series(np.where(in_first, np.where(in_second, "both", "missing"), "new"), index=keys)
+    before = before[value_columns]
+    after = after[value_columns]
+    delta = after - before
+    # A change from a zero baseline has no percentage; no change from zero is 0%
+    pct = (delta / before.where(before != 0) * 100).round(2)
+    pct = pct.mask((before == 0) & (after == 0), 0.0)
+    return pd.concat([info, status.rename("status"), before.add_suffix("_1"), after.add_suffix("_2"),
+                      delta.add_suffix("_delta"), pct.add_suffix("_pct")], axis=1)
+
+
+def compare_tables(table1, table2, metrics=COMPARE_METRICS, policy=None):
+    """compare_stats with the comparison policy's directions and verdicts applied."""
+    return apply_policy(compare_stats(table1, table2), metrics, policy)
+
+
+def summarize_comparison(comparison, metric):
+    """Transactions that got significantly faster or slower on metric, its request-weighted change and verdict."""
+    rows = comparison[comparison["status"] == "both"]
+    direction = rows[f"{metric}_direction"]
+    verdicts = comparison[f"{metric}_verdict"]
+    return {
+        'faster': int((direction == "faster").sum()),
+        'slower': int((direction == "slower").sum()),
+        'weighted_change_pct': weighted_change(comparison, metric),
+        'verdict': "fail" if (verdicts == "fail").any() else "warn" if (verdicts == "warn").any() else "pass",
+    }
 
-    # Write the values to the Excel sheet
-    sheet.cell(row=row, column=1, value=stats1['name'])
-    sheet.cell(row=row, column=2, value=value1_ok)
-    sheet.cell(row=row, column=3, value=value2_ok)
-    sheet.cell(row=row, column=4, value=diff_ok)
 
-    # Color the cell based on the delta
-    cell = sheet.cell(row=row, column=5, value=formatted_value)
-    if rounded_diff_delta < 0:
-        cell.fill = PatternFill(start_color="0c880e", end_color="0c880e", fill_type="solid")  # Green for Fast
-    elif rounded_diff_delta > 0:
-        cell.fill = PatternFill(start_color="f4eb36", end_color="f4eb36", fill_type="solid")  # Yellow for Slow
+def sheet_rows(comparison, metric):
+    """Rows of one metric sheet as plain Python values, prepared column-wise."""
+    columns = [f"{metric}_ok_1", f"{metric}_ok_2", f"{metric}_ok_delta",
+               f"{metric}_ko_1", f"{metric}_ko_2", f"{metric}_ko_delta"]
+    shown = comparison[comparison["status"] != "new"]
+    values = shown[columns].astype(object).where(shown[columns].notna(), None)
+    pct = shown[f"{metric}_ok_pct"]
+    labels = pct.map("{:.2f}%".format).astype(object).where(pct.notna(), None)
+    verdicts = shown[f"{metric}_verdict"].to_numpy()
+    # Only changes outside the policy's tolerance band are colored
+    styles = np.where(shown[f"{metric}_direction"] == "faster", "faster",
+                      np.where(verdicts == "fail", "fail", np.where(verdicts == "warn", "slower", "body")))
+    for key, name, status, (ok1, ok2, ok_delta, ko1, ko2, ko_delta), label, style, verdict in zip(
+            shown.index, shown["name"], shown["status"], values.values.tolist(), labels, styles, verdicts):
+        if status == "missing":
+            yield [f"Key '{key}' not found in the second Execution."], None
+        else:
+            yield [name, ok1, ok2, ok_delta, label, ko1, ko2, ko_delta, verdict], style
 
-    sheet.cell(row=row, column=6, value=value1_ko)
-    sheet.cell(row=row, column=7, value=value2_ko)
-    sheet.cell(row=row, column=8, value=diff_ko)
 
-    # Apply border to the current row
-    apply_border_to_table(sheet, min_row=row, max_row=row, min_col=1, max_col=8)
+def write_metric_sheet(wb, formats, comparison, metric):
+    """Render one metric of a comparison table as a sheet."""
+    sheet = create_sheet(wb, formats, metric_to_sheet_name(metric), metric)
+    row = 1
+    for values, style in sheet_rows(comparison, metric):
+        if style is None:
+            sheet.write_row(row, 0, values)
+        else:
+            sheet.write_row(row, 0, values[:4], formats["body"])
+            # Color the cell based on the delta
+            sheet.write(row, 4, values[4], formats[style])
+            sheet.write_row(row, 5, values[5:8], formats["body"])
+            sheet.write(row, 8, values[8], formats["fail" if values[8] == "fail" else "body"])
+        row += 1
+    add_summary(sheet, formats, row, summarize_comparison(comparison, metric))
+    return sheet
 
 
-def create_sheet(wb, sheet_name, metric):
+def create_sheet(wb, formats, sheet_name, metric):
     """Create a new sheet for a specific metric and set up headers."""
-    sheet = wb.create_sheet(title=sheet_name)
-
-    # Define header colors
-    header_fill = PatternFill(start_color="51ABD2", end_color="51ABD2", fill_type="solid")
-    bold_font = Font(bold=True)
-
-    # Define a different color for the "Delta" columns
-    special_fill = PatternFill(start_color="d3d0d0", end_color="d3d0d0", fill_type="solid")
+    sheet = wb.add_worksheet(sheet_name)
 
     # Write headers
     headers = ["Transaction Name", f"Execution1_OK Value {metric}", f"Execution2_OK Value {metric}",
                f"Delta(Execution2 value - Execution1 value)", f"Delta Percentage %",
                f"Execution1_KO Value {metric}", f"Execution2_KO Value {metric}",
-               f"Delta(Execution2 value - Execution1 value)"]
-    for col, header in enumerate(headers, start=1):
-        cell = sheet.cell(row=1, column=col, value=header)
-        if "Delta" in header:
-            cell.fill = special_fill
-        else:
-            cell.fill = header_fill
-        cell.font = bold_font
-
-    # Apply border to header row
-    apply_border_to_table(sheet, min_row=1, max_row=1, min_col=1, max_col=8)
-
+               f"Delta(Execution2 value - Execution1 value)", "Verdict"]
+    for col, header in enumerate(headers):
+        sheet.write(0, col, header, formats["delta_header" if "Delta" in header else "header"])
     return sheet
 
 
-def add_summary(sheet, row, summary):
-    """Add a summary at the end of the sheet indicating which run is better."""
-    transactions_faster = summary.get('faster', 0)
-    transactions_slower = summary.get('slower', 0)
-    if transactions_slower > transactions_faster:
-        summary_text = "Execution 1 performed better overall."
-    elif transactions_faster > transactions_slower:
-        summary_text = "Execution 2 performed better overall."
+def summary_text_for(summary):
+    # The request-weighted change decides, so a few large regressions are not outvoted by many tiny gains
+    change = summary.get('weighted_change_pct')
+    if change is None:
+        first_better = summary.get('slower', 0) > summary.get('faster', 0)
+        second_better = summary.get('faster', 0) > summary.get('slower', 0)
     else:
-        summary_text = "Both runs performed equally well."
+        band = load_policy()["default"]["warn_pct"]
+        first_better = change > band
+        second_better = change < -band
+    if first_better:
+        return "Execution 1 performed better overall."
+    elif second_better:
+        return "Execution 2 performed better overall."
+    return "Both runs performed equally well."
 
-    note = "These are system generated observations. Please review Manually for a complete analysis"
-    bold_font = Font(bold=True)
-
-    blue_fill = PatternFill(start_color="51ABD2", end_color="51ABD2", fill_type="solid")
-    green_fill = PatternFill(start_color="65E823", end_color="65E823", fill_type="solid")
-
-    sheet.append(["No.Of.Transactions Executed Faster than last run:", transactions_faster])
-    sheet.append(["No.Of.Transactions Executed Slower than last run:", transactions_slower])
-    sheet.append(["Overall Observation:", summary_text])
-    sheet.append(["*Note:", note])
-
-    # Apply blue fill to static text and green fill to result values
-    for i, row in enumerate(sheet.iter_rows(min_row=sheet.max_row - 3, max_row=sheet.max_row, min_col=1, max_col=2)):
-        for j, cell in enumerate(row):
-            cell.font = bold_font
-            if j == 0:
-                cell.fill = blue_fill
-            else:
-                cell.fill = green_fill
-
-    # Apply border to the summary section
-    apply_border_to_table(sheet, min_row=sheet.max_row - 3, max_row=sheet.max_row, min_col=1, max_col=2)
-
-
-def compare_json(json1, json2, metrics):
-    # Create an Excel workbook
-    wb = Workbook()
 
+def add_summary(sheet, formats, row, summary):
+    """Add a summary at the end of the sheet indicating which run is better."""
+    note = "These are system generated observations. Please review Manually for a complete analysis"
+    change = summary.get('weighted_change_pct')
+    rows = [
+        ["No.Of.Transactions Executed Faster than last run:", summary.get('faster', 0)],
+        ["No.Of.Transactions Executed Slower than last run:", summary.get('slower', 0)],
+        ["Request-weighted change:", "n/a" if change is None else f"{change:.2f}%"],
+        ["Verdict:", summary.get('verdict', "pass")],
+        ["Overall Observation:", summary_text_for(summary)],
+        ["*Note:", note],
+    ]
+    # Blue fill for static text and green fill for result values
+    for offset, (label, value) in enumerate(rows):
+        sheet.write(row + offset, 0, label, formats["summary_label"])
+        sheet.write(row + offset, 1, value, formats["summary_value"])
+
+
+def write_workbook(comparison, metrics, buffer):
+    """Render a comparison table into buffer as an XLSX workbook with one sheet per metric."""
+    # constant_memory flushes each row as it is written instead of keeping the sheets in memory
+    wb = xlsxwriter.Workbook(buffer, {"constant_memory": True, "strings_to_urls": False})
+    formats = {name: wb.add_format(properties) for name, properties in REPORT_FORMATS.items()}
     for metric in metrics:
-        sheet_name = metric_to_sheet_name(metric)
-        sheet = create_sheet(wb, sheet_name, metric)
+        write_metric_sheet(wb, formats, comparison, metric)
+    wb.close()
 
-        summary = {'faster': 0, 'slower': 0}
 
-        def compare_section(json1_section, json2_section, start_row):
-            compare_stats(json1_section["stats"], json2_section["stats"], metric, sheet, start_row, summary)
-            return start_row + 1
+def json_values(series):
+    """A column as a list of JSON-safe Python values (NaN becomes None)."""
+    return series.to_numpy(dtype=object, na_value=None).tolist()
 
-        next_row = 2
-        next_row = compare_section(json1, json2, next_row)
 
-        for key in json1.get('contents', {}):
-            if key in json2.get('contents', {}):
-                next_row = compare_section(json1['contents'][key], json2['contents'][key], next_row)
-            else:
-                sheet.cell(row=next_row, column=1, value=f"Key '{key}' not found in the second Execution.")
-                next_row += 1
+def comparison_payload(comparison, metrics, verdicts=None):
+    """JSON-ready comparison: the overall verdict, per-metric summaries and per-transaction deltas.
 
-        add_summary(sheet, next_row, summary)
+    verdicts optionally limits the transactions listed to those with one of
+    the given verdicts (e.g. ["warn", "fail"]); summaries always cover all.
+    """
+    summary = {}
+    for metric in metrics:
+        counts = summarize_comparison(comparison, metric)
+        summary[metric] = dict(counts, observation=summary_text_for(counts))
+    listed = comparison[comparison["verdict"].isin(verdicts)] if verdicts else comparison
+    fields = {"before": "ok_1", "after": "ok_2", "delta": "ok_delta", "pct": "ok_pct",
+              "ko_before": "ko_1", "ko_after": "ko_2", "ko_delta": "ko_delta",
+              "direction": "direction", "verdict": "verdict"}
+    per_metric = {metric: list(zip(*[json_values(listed[f"{metric}_{column}"]) for column in fields.values()]))
+                  for metric in metrics}
+    transactions = []
+    for position, (key, name, node_type, status, verdict, weight) in enumerate(zip(
+            listed.index, json_values(listed["name"]), json_values(listed["type"]), listed["status"],
+            listed["verdict"], json_values(listed["weight"]))):
+        transactions.append({
+            "key": key, "name": name, "type": node_type, "status": status, "verdict": verdict,
+            "weight": weight,
+            "metrics": {metric: dict(zip(fields, per_metric[metric][position])) for metric in metrics},
+        })
+    return {"metrics": metrics, "verdict": overall_verdict(comparison), "summary": summary,
+            "transactions": transactions}
+
+
+def render_report(comparison, metrics, report_format=PERFORMANCE_REPORT_FORMAT):
+    """Serialize a comparison table in the given format and return the bytes."""
+    buffer = BytesIO()
+    if report_format == "xlsx":
+        write_workbook(comparison, metrics, buffer)
+    elif report_format == "csv":
+        buffer.write(comparison.to_csv().encode("utf-8"))
+    elif report_format == "json":
+        buffer.write(json.dumps(comparison_payload(comparison, metrics), default=str).encode("utf-8"))
+    else:
+        raise ValueError(f"Unsupported report format: {report_format}")
+    return buffer.getvalue()
 
-    del wb["Sheet"]  # Remove default sheet
 
-    excel_buffer = BytesIO()
-    wb.save(excel_buffer)
-    excel_buffer.seek(0)
+def upload_report(body, report_format=PERFORMANCE_REPORT_FORMAT):
+    """Upload a rendered report to the performance comparator bucket and return its URL."""
     performance_comparator_bucket = os.getenv("aws_performance_comparator_bucket")
     ts = str(int(round(time.time())))
-    s3_key = f"output_{ts}.xlsx"
+    s3_key = f"output_{ts}.{report_format}"
     response = s3_client.put_object(
         Bucket=performance_comparator_bucket,
         Key=s3_key,
-        Body=excel_buffer.getvalue(),
-        ContentType='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        Body=body,
+        ContentType=REPORT_CONTENT_TYPES[report_format]
     )
 
     # Check the response and return the download URL
@@ -199,3 +304,14 @@ def compare_json(json1, json2, metrics):
         return url
     else:
         raise Exception("Failed to upload file to S3")
+
+
+def report_comparison(comparison, metrics=COMPARE_METRICS, report_format=PERFORMANCE_REPORT_FORMAT):
+    """Render a comparison table and upload it, returning the report URL."""
+    return upload_report(render_report(comparison, metrics, report_format), report_format)
+
+
+def compare_json(json1, json2, metrics=COMPARE_METRICS, report_format=PERFORMANCE_REPORT_FORMAT):
+    # Compare the flattened runs once, then render the comparison
+    comparison = compare_tables(flatten_stats(json1), flatten_stats(json2), metrics)
+    return report_comparison(comparison, metrics, report_format)
@@ -0,0 +1,73 @@
+import os
+import time
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Comma separated resource names to load at worker boot ("all" for every one)
+WARM_RESOURCES = os.getenv("warm_resources", "")
+
+_loaders = {}
+_resources = {}
+_stats = {}
+_locks = {}
+_registry_lock = threading.Lock()
+
+
+def current_rss():
+    """Resident set size of this process in bytes, or None if unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def register(name, loader):
+    """Register a zero-argument loader for a process-wide shared resource."""
+    with _registry_lock:
+        _loaders[name] = loader
+        _locks.setdefault(name, threading.Lock())
+
+
+def get(name):
+    """Return the shared resource, loading it on first use (once per process)."""
+    if name in _resources:
+        return _resources[name]
+    with _locks[name]:
+        if name not in _resources:
+            rss_before = current_rss()
+            started = time.perf_counter()
+            resource = _loaders[name]()
+            load_seconds = time.perf_counter() - started
+            rss_after = current_rss()
+            _stats[name] = {
+                "load_seconds": round(load_seconds, 3),
+                "memory_bytes": rss_after - rss_before if rss_before is not None and rss_after is not None else None,
+                "loaded_at": time.time(),
+            }
+            _resources[name] = resource
+            print(f"Loaded resource {name} in {load_seconds:.2f}s")
+    return _resources[name]
+
+
+def warm(names=None):
+    """Load resources eagerly, e.g. at worker boot. Defaults to the warm_resources env var."""
+    if names is None:
+        names = [name.strip() for name in WARM_RESOURCES.split(",") if name.strip()]
+    if names == ["all"]:
+        names = list(_loaders)
+    for name in names:
+        try:
+            get(name)
+        except Exception as e:
+            print(f"Failed to warm resource {name}: {e}")
+
+
+def stats():
+    """Load time and approximate memory use per resource (memory is the RSS delta while loading)."""
+    return {
+        name: dict(_stats.get(name, {}), loaded=name in _resources)
+        for name in _loaders
+    }
@@ -0,0 +1,212 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from contextlib import closing
+import pandas as pd
+from dotenv import load_dotenv
+from performancecomapre import flatten_stats, compare_tables, INFO_COLUMNS
+from gatling_stream import read_results_table
+
+load_dotenv()
+
+RUN_HISTORY_PATH = os.getenv("run_history_path", "./run_history.db")
+# Previous runs averaged into a transaction's baseline
+RUN_BASELINE_WINDOW = int(os.getenv("run_baseline_window", "7"))
+# Runs a baseline needs before a transaction can be flagged
+RUN_BASELINE_MIN_RUNS = int(os.getenv("run_baseline_min_runs", "3"))
+# A regression must be this many standard deviations and this many percent above its baseline
+RUN_REGRESSION_SIGMA = float(os.getenv("run_regression_sigma", "3"))
+RUN_REGRESSION_MIN_CHANGE = float(os.getenv("run_regression_min_change", "10"))
+
+_init_lock = threading.Lock()
+_initialized = set()
+
+
+def connect(db_path=None):
+    db_path = db_path or RUN_HISTORY_PATH
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.row_factory = sqlite3.Row
+    with _init_lock:
+        if db_path not in _initialized:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS runs (
+                    run_id TEXT PRIMARY KEY,
+                    label TEXT,
+                    started REAL NOT NULL,
+                    transactions INTEGER NOT NULL
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS runs_started ON runs (started)")
+            # One row per run and node of the flattened stats.json
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS run_nodes (
+                    run_id TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    name TEXT,
+                    type TEXT,
+                    depth INTEGER,
+                    metrics TEXT NOT NULL,
+                    PRIMARY KEY (run_id, key)
+                )"""
+            )
+            # Content hash of an uploaded file -> the run it produced, so re-uploads skip parsing
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS run_files (
+                    file_hash TEXT PRIMARY KEY,
+                    run_id TEXT NOT NULL
+                )"""
+            )
+            _initialized.add(db_path)
+    return conn
+
+
+def node_rows(table):
+    """(key, name, type, depth, metrics JSON) for every node of a flattened run table."""
+    value_columns = [column for column in table.columns if column not in INFO_COLUMNS]
+    values = table[value_columns].astype(object).where(table[value_columns].notna(), None)
+    return [(key, name, node_type, int(depth), json.dumps(dict(zip(value_columns, metrics))))
+            for key, name, node_type, depth, metrics in zip(table.index, table["name"], table["type"],
+                                                            table["depth"], values.values.tolist())]
+
+
+def run_id_for(rows):
+    """Content hash of a run's flattened nodes.
+
+    Every route into the history hashes the same table, so a run ingested as
+    a stats.json tree and as an uploaded file gets one id and is counted once.
+    """
+    return hashlib.sha256(json.dumps(rows).encode("utf-8")).hexdigest()[:16]
+
+
+def ingest_run(stats, label=None, started=None):
+    """Flatten a Gatling stats.json tree into the history; returns (run_id, flattened table)."""
+    return ingest_table(flatten_stats(stats), label, started)
+
+
+def file_digest(fileobj):
+    """Content hash of an uploaded results file; the file is rewound afterwards."""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: fileobj.read(1024 * 1024), b""):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+def ingest_file(fileobj, filename, label=None, started=None):
+    """Stream an uploaded stats.json or simulation.log into the history; returns (run_id, flattened table).
+
+    A file already uploaded, such as a baseline sent on every CI run, is
+    loaded from the history instead of being parsed again.
+    """
+    file_hash = file_digest(fileobj)
+    with closing(connect()) as conn:
+        row = conn.execute("SELECT run_files.run_id FROM run_files JOIN runs ON runs.run_id = run_files.run_id "
+                           "WHERE file_hash = ?", (file_hash,)).fetchone()
+    if row is not None:
+        return row["run_id"], load_runs([row["run_id"]])[row["run_id"]]
+    return ingest_table(read_results_table(fileobj, filename), label or filename, started, file_hash)
+
+
+def ingest_table(table, label=None, started=None, file_hash=None):
+    """Record a flattened run table under its content hash; returns (run_id, table)."""
+    rows = node_rows(table)
+    run_id = run_id_for(rows)
+    conn = connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("INSERT OR IGNORE INTO runs (run_id, label, started, transactions) VALUES (?, ?, ?, ?)",
+                     (run_id, label, started or time.time(), len(rows)))
+        conn.executemany("INSERT OR IGNORE INTO run_nodes (run_id, key, name, type, depth, metrics) "
+                         "VALUES (?, ?, ?, ?, ?, ?)", [(run_id, *row) for row in rows])
+        if file_hash:
+            conn.execute("INSERT OR REPLACE INTO run_files (file_hash, run_id) VALUES (?, ?)", (file_hash, run_id))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return run_id, table
+
+
+def list_runs(limit=100):
+    """Most recent runs first."""
+    with closing(connect()) as conn:
+        rows = conn.execute("SELECT * FROM runs ORDER BY started DESC LIMIT ?", (limit,)).fetchall()
+    return [dict(row) for row in rows]
+
+
+def load_runs(run_ids):
+    """Flattened tables of several runs in one query, keyed by run id."""
+    placeholders = ", ".join("?" for _ in run_ids)
+    with closing(connect()) as conn:
+        rows = conn.execute(f"SELECT * FROM run_nodes WHERE run_id IN ({placeholders}) ORDER BY rowid",
+                            tuple(run_ids)).fetchall()
+    by_run = {}
+    for row in rows:
+        by_run.setdefault(row["run_id"], []).append(row)
+    tables = {}
+    for run_id in run_ids:
+        run_rows = by_run.get(run_id)
+        if not run_rows:
+            raise ValueError(f"Unknown run: {run_id}")
+        metrics = pd.DataFrame([json.loads(row["metrics"]) for row in run_rows],
+                               index=pd.Index([row["key"] for row in run_rows], name="key"))
+        info = pd.DataFrame({"name": [row["name"] for row in run_rows], "type": [row["type"] for row in run_rows],
+                             "depth": [row["depth"] for row in run_rows]}, index=metrics.index)
+        tables[run_id] = pd.concat([info, metrics.apply(pd.to_numeric, errors="coerce")], axis=1)
+    return tables
+
+
+def compare_runs(run_id1, run_id2):
+    """Two-run comparison from the history, the same table compare_json renders."""
+    tables = load_runs([run_id1, run_id2])
+    return compare_tables(tables[run_id1], tables[run_id2])
+
+
+def metric_history(metric, side="ok", limit=None, keys=None):
+    """Run x transaction matrix of one metric, oldest run first."""
+    column = f"{metric}_{side}"
+    query = ("SELECT runs.run_id, runs.started, run_nodes.key, json_extract(run_nodes.metrics, ?) AS value "
+             "FROM run_nodes JOIN runs ON runs.run_id = run_nodes.run_id")
+    params = [f'$."{column}"']
+    if limit:
+        query += " WHERE runs.run_id IN (SELECT run_id FROM runs ORDER BY started DESC LIMIT ?)"
+        params.append(limit)
+    with closing(connect()) as conn:
+        frame = pd.read_sql_query(query, conn, params=params)
+    if keys:
+        frame = frame[frame["key"].isin(keys)]
+    matrix = frame.pivot_table(index=["started", "run_id"], columns="key", values="value", aggfunc="first")
+    return matrix.sort_index().droplevel("started")
+
+
+def regressions(metric="percentiles3", side="ok", limit=None, window=RUN_BASELINE_WINDOW,
+                min_runs=RUN_BASELINE_MIN_RUNS, sigma=RUN_REGRESSION_SIGMA, min_change=RUN_REGRESSION_MIN_CHANGE):
+    """Compare every run's transactions against a rolling baseline of the runs before it.
+
+    Returns one row per run and transaction with the value, baseline mean and
+    standard deviation, z-score, percent change and a regression flag set when
+    the value is both sigma deviations and min_change percent above the baseline.
+    """
+    matrix = metric_history(metric, side, limit)
+    previous = matrix.shift(1).rolling(window, min_periods=min_runs)
+    baseline = previous.mean()
+    # A baseline of a single run has no sample spread; treat it as flat instead of never flagging
+    spread = previous.std().mask(previous.count().eq(1), 0.0)
+    change = (matrix - baseline) / baseline.where(baseline != 0) * 100
+    z_score = (matrix - baseline) / spread.where(spread != 0)
+    # A flat baseline has no spread; any change beyond min_change counts then
+    beyond_spread = z_score.gt(sigma) | (spread.eq(0) & matrix.gt(baseline))
+    flagged = beyond_spread & change.gt(min_change)
+    frames = {"value": matrix, "baseline": baseline, "baseline_std": spread, "z_score": z_score,
+              "change_pct": change.round(2), "regression": flagged}
+    # Long format: one row per run and transaction
+    long = [frame.reset_index().melt(id_vars="run_id", var_name="key", value_name=name)
+            for name, frame in frames.items()]
+    result = pd.concat([long[0]] + [frame[[frame.columns[-1]]] for frame in long[1:]], axis=1)
+    return result[result["value"].notna()].reset_index(drop=True)
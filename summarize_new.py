@@ -1,8 +1,16 @@
 import os
+import csv
+import json
 import pandas as pd
 from dotenv import load_dotenv
 from google.generativeai import configure, GenerativeModel
 import time
+from llm_cache import cached_send
+from llm_dispatcher import dispatch
+from text_utils import estimate_tokens
+from dataset_registry import file_digest
+from table_store import DEFECT_COLUMNS, intermediate_path, read_table, write_table
+from output_writer import OUTPUT_CHECKPOINT_DIR, checkpoint_id_for, csv_line
 
 load_dotenv()
 
@@ -16,56 +24,180 @@ UPLOAD_FOLDER = "upload"
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
-def summarize_and_store_locally(file_path, file_type):
-    
+SUMMARY_COLUMNS = ['Summary', 'Issue key', 'Issue id', 'Project name', 'Assignee', 'Components']
+SUMMARIZE_MAX_CONCURRENCY = int(os.getenv("summarize_max_concurrency", "4"))
+# Completed rows are fsynced to the partial file every this many rows
+SUMMARIZE_CHECKPOINT_EVERY = int(os.getenv("summarize_checkpoint_every", "20"))
+SUMMARIZATION_ERROR = "Error in summarization"
+# Defect summaries packed into one prompt (1 disables batching) and the input token budget per batch
+SUMMARIZE_BATCH_SIZE = int(os.getenv("summarize_batch_size", "10"))
+SUMMARIZE_BATCH_TOKEN_BUDGET = int(os.getenv("summarize_batch_token_budget", "3000"))
+
+
+def summary_prompt(summary):
+    return (f"Summarize the following defect summary: {summary}. "
+            "Summarize in such a manner that it will further be used for fetching similar defect summary.")
+
+
+def batch_prompt(summaries):
+    return ("Summarize each of the following defect summaries. "
+            "Summarize in such a manner that it will further be used for fetching similar defect summary.\n"
+            f"The input is a JSON array of {len(summaries)} defect summaries. Reply with only a JSON array of "
+            f"exactly {len(summaries)} strings, one summary per input, in the same order.\n"
+            + json.dumps(summaries))
+
+
+def parse_batch_response(text, expected):
+    """The list of summaries in a batched answer, or None if it is not a JSON array of the right size."""
+    start, end = text.find("["), text.rfind("]")
+    if start == -1 or end < start:
+        return None
     try:
-        # Load the input file based on the file type (CSV or Excel)
-        if file_type == 'csv':
-            df = pd.read_csv(file_path)
-        elif file_type == 'xlsx':
-            df = pd.read_excel(file_path)
-        else:
-            raise ValueError("Unsupported file type. Use 'csv' or 'excel'.")
+        parsed = json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+    if not isinstance(parsed, list) or len(parsed) != expected or not all(isinstance(item, str) for item in parsed):
+        return None
+    return parsed
+
+
+def summarize_batch(summaries, use_cache=True):
+    """Summarize several defects in one call, splitting the batch in half when the answer is unusable."""
+    if len(summaries) == 1:
+        return [cached_send(model, summary_prompt(summaries[0]), use_cache)]
+    # Unusable answers are not cached, so a rerun asks again instead of replaying them
+    answer = cached_send(model, batch_prompt(summaries), use_cache,
+                         accept=lambda text: parse_batch_response(text, len(summaries)) is not None)
+    parsed = parse_batch_response(answer, len(summaries))
+    if parsed is None:
+        middle = len(summaries) // 2
+        print(f"Unusable answer for a batch of {len(summaries)} summaries, splitting it")
+        return summarize_batch(summaries[:middle], use_cache) + summarize_batch(summaries[middle:], use_cache)
+    return parsed
+
+
+def plan_batches(summaries, max_items=SUMMARIZE_BATCH_SIZE, token_budget=SUMMARIZE_BATCH_TOKEN_BUDGET):
+    """Group positions into batches of at most max_items whose summaries fit the token budget."""
+    batches = []
+    current = []
+    used = 0
+    for position, summary in enumerate(summaries):
+        cost = estimate_tokens(summary) + 4
+        if current and (len(current) >= max_items or used + cost > token_budget):
+            batches.append(current)
+            current, used = [], 0
+        current.append(position)
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
 
-        # Drop all columns except Summary, Issue key, Issue id, Project name, Assignee,  Components, and Description
-        df = df[['Summary', 'Issue key', 'Issue id', 'Project name', 'Assignee', 'Components']]
+def load_checkpoint(checkpoint_path):
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path) as f:
+        return json.load(f)
+
+
+def load_partial(partial_path):
+    """Abstracts already written by an interrupted run, keyed by DataFrame index."""
+    if not os.path.exists(partial_path):
+        return {}
+    done = {}
+    with open(partial_path, newline="") as f:
+        for row in csv.reader(f):
+            # A torn last line from a crash has the wrong shape and is simply redone
+            if len(row) == 2 and row[0].isdigit():
+                done[int(row[0])] = row[1]
+    return done
+
+
+def summarize_and_store_locally(file_path, file_type, progress=None, use_cache=True):
+    
+    try:
+        # Load only Summary, Issue key, Issue id, Project name, Assignee, Components and abstract
+        # from the Parquet, CSV or Excel input
+        df = read_table(file_path, columns=DEFECT_COLUMNS, file_type=file_type).reset_index(drop=True)
+        missing_columns = [column for column in SUMMARY_COLUMNS if column not in df.columns]
+        if missing_columns:
+            raise ValueError(f"Missing columns: {', '.join(missing_columns)}")
 
         # Ensure 'Summary' column is a string
         df['Summary'] = df['Summary'].astype(str)
 
-        # Check if 'Summarised_Summary' column exists, if not, create it
+        # Check if 'abstract' column exists, if not, create it
         if 'abstract' not in df.columns:
             df['abstract'] = None
+        df['abstract'] = df['abstract'].astype(object)
+
+        # A checkpoint keyed by the input contents lets a crashed run resume where it stopped
+        checkpoint_id = checkpoint_id_for("summarize", file_digest(file_path))
+        os.makedirs(OUTPUT_CHECKPOINT_DIR, exist_ok=True)
+        checkpoint_path = os.path.join(OUTPUT_CHECKPOINT_DIR, f"{checkpoint_id}.json")
+        partial_path = os.path.join(OUTPUT_CHECKPOINT_DIR, f"{checkpoint_id}.partial.csv")
+        state = load_checkpoint(checkpoint_path)
+        if state is None:
+            timestamp = str(int(time.time()))
+            state = {"output_file_path": intermediate_path(UPLOAD_FOLDER, f"summarized_{timestamp}")}
+            with open(checkpoint_path, "w") as f:
+                json.dump(state, f)
+        resumed = load_partial(partial_path)
+        if resumed:
+            print(f"Resuming summarization with {len(resumed)} rows already done")
+            done_index = pd.Index(list(resumed))
+            df.loc[done_index, 'abstract'] = pd.Series(resumed)[done_index]
+
+        # Summarize only where 'abstract' is null or empty
+        missing = df['abstract'].isnull() | (df['abstract'].astype(str).str.strip() == '')
+        todo = df.index[missing]
+        total = len(todo)
+        completed = 0
+        errors = 0
+
+        summaries = df.loc[todo, 'Summary'].tolist()
+        batches = plan_batches(summaries)
+
+        with open(partial_path, "a", newline="") as partial:
+            def on_result(batch_position, result):
+                nonlocal completed, errors
+                positions = batches[batch_position]
+                if isinstance(result, Exception):
+                    print(f"Error summarizing: {result}")
+                    errors += len(positions)
+                    result = [SUMMARIZATION_ERROR] * len(positions)
+                for position, abstract in zip(positions, result):
+                    index = todo[position]
+                    if abstract != SUMMARIZATION_ERROR:
+                        # Only real summaries are checkpointed, so a resumed run retries failures
+                        partial.write(csv_line([index, abstract]))
+                    df.at[index, 'abstract'] = abstract
+                completed += len(positions)
+                if completed // SUMMARIZE_CHECKPOINT_EVERY != (completed - len(positions)) // SUMMARIZE_CHECKPOINT_EVERY:
+                    partial.flush()
+                    os.fsync(partial.fileno())
+                if progress is not None:
+                    progress(completed, total)
+
+            # Several summaries go into each prompt, and the request rate adapts to 429s
+            # from the API instead of sleeping between rows
+            dispatch(([summaries[position] for position in batch] for batch in batches),
+                     lambda batch: summarize_batch(batch, use_cache),
+                     max_concurrency=SUMMARIZE_MAX_CONCURRENCY, on_result=on_result,
+                     return_exceptions=True, collect=False, adaptive=True)
 
-        # Summarize summary only where 'Summarised_Summary' is null or empty
-        for index, row in df.iterrows():
-            if pd.isnull(row['abstract']) or row['abstract'] == '':
-                summary = row['Summary']
-                try:
-                    convo = model.start_chat()
-                    convo.send_message(
-                        f"Summarize the following defect summary: {summary}. "
-                        "Summarize in such a manner that it will further be used for fetching similar defect summary."
-                    )
-                    summary = convo.last.text
-                except Exception as e:
-                    summary = "Error in summarization"
-                    print(f"Error summarizing: {e}")
-                
-                # Update the DataFrame with the generated summary
-                df.at[index, 'abstract'] = summary
-
-                # Wait for 3 seconds before the next request
-                time.sleep(3)
+        if errors:
+            print(f"{errors} rows failed to summarize")
 
         # Save the updated DataFrame to the 'upload' folder
-        timestamp = str(int(time.time()))
-        output_file_path = os.path.join(UPLOAD_FOLDER, f"summarized_{timestamp}.csv")
-        df.to_csv(output_file_path, index=False)
+        output_file_path = state["output_file_path"]
+        write_table(df, output_file_path)
+        os.remove(partial_path)
+        os.remove(checkpoint_path)
 
         print(f"File successfully saved to: {output_file_path}")
         return output_file_path
 
     except Exception as e:
         print(f"An error occurred: {e}")
-        return None
\ No newline at end of file
+        return None
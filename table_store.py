@@ -0,0 +1,93 @@
+import os
+import pandas as pd
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Format the summarize and embed stages write their intermediates in: "parquet" or "csv"
+INTERMEDIATE_FORMAT = os.getenv("intermediate_format", "parquet")
+
+DEFECT_COLUMNS = ['Summary', 'Issue key', 'Issue id', 'Project name', 'Assignee', 'Components', 'abstract']
+# Low-cardinality columns stored as dictionary-encoded categoricals
+CATEGORICAL_COLUMNS = ['Project name', 'Assignee', 'Components']
+
+
+def file_type_of(file_path):
+    return os.path.splitext(file_path)[1].lower().replace('.', '')
+
+
+def intermediate_path(folder, stem):
+    """Path for a pipeline intermediate in the configured format."""
+    return os.path.join(folder, f"{stem}.{INTERMEDIATE_FORMAT}")
+
+
+def table_columns(file_path, file_type=None):
+    """Column names of a table without loading its rows."""
+    file_type = file_type or file_type_of(file_path)
+    if file_type == 'parquet':
+        return pq.read_schema(file_path).names
+    if file_type == 'csv':
+        return list(pd.read_csv(file_path, nrows=0).columns)
+    if file_type == 'xlsx':
+        return list(pd.read_excel(file_path, nrows=0).columns)
+    raise ValueError("Unsupported file type. Use 'parquet', 'csv' or 'xlsx'.")
+
+
+def table_rows(file_path, file_type=None):
+    """Row count of a table; read from the footer for Parquet."""
+    file_type = file_type or file_type_of(file_path)
+    if file_type == 'parquet':
+        return pq.read_metadata(file_path).num_rows
+    return len(read_table(file_path, columns=table_columns(file_path, file_type)[:1], file_type=file_type))
+
+
+def read_table(file_path, columns=None, file_type=None):
+    """Load a Parquet, CSV or XLSX table, keeping only the wanted columns that exist.
+
+    Parquet files are memory-mapped and only the requested column chunks are
+    decoded, so reloading a large export does not re-parse it. CSV cells are
+    read as strings, exactly as written.
+    """
+    file_type = file_type or file_type_of(file_path)
+    wanted = None
+    if columns is not None:
+        present = set(table_columns(file_path, file_type))
+        wanted = [column for column in dict.fromkeys(columns) if column in present]
+    if file_type == 'parquet':
+        df = pd.read_parquet(file_path, columns=wanted, memory_map=True)
+    elif file_type == 'csv':
+        # Cells are kept as the text in the file, as CSVLoader reads them: no 123 -> 123.0 for
+        # integer columns with blanks and no "nan" for empty cells, so row_texts and chunk ids do not change
+        df = pd.read_csv(file_path, usecols=wanted, dtype=str, keep_default_na=False)
+    elif file_type == 'xlsx':
+        df = pd.read_excel(file_path, usecols=wanted)
+    else:
+        raise ValueError("Unsupported file type. Use 'parquet', 'csv' or 'xlsx'.")
+    return df[wanted] if wanted is not None else df
+
+
+def write_table(df, file_path):
+    """Write a table in the format given by its extension; Parquet gets categorical columns."""
+    file_type = file_type_of(file_path)
+    if file_type == 'parquet':
+        df = df.copy()
+        for column in CATEGORICAL_COLUMNS:
+            if column in df.columns:
+                df[column] = df[column].astype('category')
+        df.to_parquet(file_path, index=False)
+    elif file_type == 'csv':
+        df.to_csv(file_path, index=False)
+    elif file_type == 'xlsx':
+        df.to_excel(file_path, index=False)
+    else:
+        raise ValueError("Unsupported file type. Use 'parquet', 'csv' or 'xlsx'.")
+    return file_path
+
+
+def row_texts(df):
+    """Rows as "column: value" lines, the same page content CSVLoader produces for a CSV file."""
+    columns = [str(column).strip() for column in df.columns]
+    values = df.astype(object).where(df.notna(), "")
+    return ["\n".join(f"{column}: {str(value).strip()}" for column, value in zip(columns, row))
+            for row in values.itertuples(index=False, name=None)]
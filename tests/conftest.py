@@ -0,0 +1,44 @@
+import os
+import sys
+
+import boto3
+import pytest
+from moto import mock_aws
+
+# The application modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def s3(monkeypatch, tmp_path):
+    """A mocked S3 client with an "output" bucket, and checkpoints kept under tmp_path."""
+    import output_writer
+    monkeypatch.setattr(output_writer, "OUTPUT_CHECKPOINT_DIR", str(tmp_path / "checkpoints"))
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+        monkeypatch.setenv(name, "testing")
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket="output")
+        yield client
+
+
+@pytest.fixture
+def llm_cache_path(tmp_path, monkeypatch):
+    """An empty LLM cache file under tmp_path with nothing buffered from other tests."""
+    import llm_cache
+    db_path = str(tmp_path / "llm_cache.db")
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_PATH", db_path)
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_ENABLED", True)
+    monkeypatch.setattr(llm_cache, "_pending_accessed", {})
+    monkeypatch.setattr(llm_cache, "_pending_stats", {})
+    return db_path
+
+
+@pytest.fixture
+def flask_app(tmp_path, monkeypatch):
+    """The app module, first imported under tmp_path so its boot-time folder scan stays out of the repo."""
+    import dataset_registry
+    monkeypatch.setattr(dataset_registry, "DATASET_DB_PATH", str(tmp_path / "datasets.db"))
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("OPENAI_API_KEY", os.environ.get("OPENAI_API_KEY", "test"))
+    return pytest.importorskip("app")
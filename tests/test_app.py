@@ -0,0 +1,17 @@
+import gzip
+import json
+
+
+def test_json_is_compressed_only_when_gzip_is_requested(flask_app):
+    app = flask_app
+    payload = {"run_id1": "a", "run_id2": "b", "rows": list(range(50))}
+
+    with app.app.test_request_context("/", headers={"Accept-Encoding": "gzip, deflate"}):
+        response = app.json_response(payload)
+    assert "Content-Encoding" not in response.headers
+    assert json.loads(response.get_data()) == payload
+
+    with app.app.test_request_context("/?gzip=true"):
+        response = app.json_response(payload, 400)
+    assert (response.status_code, response.headers["Content-Encoding"]) == (400, "gzip")
+    assert json.loads(gzip.decompress(response.get_data())) == payload
@@ -0,0 +1,62 @@
+import io
+
+import pytest
+from openpyxl import Workbook
+
+pytest.importorskip("google.generativeai")
+
+import aws_s3
+import llm_dispatcher
+
+STORIES = ["As a user I log in", None, "As an admin I export reports", "  ", "As a guest I browse"]
+
+
+def workbook_bytes(stories):
+    wb = Workbook()
+    wb.active.append(["User story"])
+    for story in stories:
+        wb.active.append([story])
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def bdd_env(s3, monkeypatch):
+    for bucket in ("bdd-input", "bdd-archive"):
+        s3.create_bucket(Bucket=bucket)
+    s3.put_object(Bucket="bdd-input", Key="qa_input.xlsx", Body=workbook_bytes(STORIES))
+    monkeypatch.setattr(aws_s3, "s3_client", s3)
+    monkeypatch.setattr(aws_s3, "AWS_BDD_INPUT_BUCKET", "bdd-input")
+    monkeypatch.setattr(aws_s3, "AWS_BDD_OUTPUT_BUCKET", "output")
+    monkeypatch.setattr(aws_s3, "AWS_ARCHIVE_BUCKET", "bdd-archive")
+    monkeypatch.setattr(aws_s3, "cached_send", lambda model, prompt, use_cache=True: "Feature: " + prompt[-12:])
+    monkeypatch.setattr(llm_dispatcher, "LLM_REQUESTS_PER_MINUTE", 0)
+    return s3
+
+
+def test_bdd_progress_total_comes_from_the_sheet_without_a_counting_pass(bdd_env, monkeypatch):
+    passes = []
+    iter_stories = aws_s3.iter_xlsx_stories
+
+    def counted(spool):
+        passes.append(1)
+        return iter_stories(spool)
+
+    monkeypatch.setattr(aws_s3, "iter_xlsx_stories", counted)
+    reports = []
+    url = aws_s3.generate_bdd_scenario("qa", progress=lambda done, total, partial=None: reports.append((done, total)))
+
+    assert url.startswith("https://output.s3.amazonaws.com/output_")
+    assert len(passes) == 1
+    # The stored dimension counts blank rows; the final report has the real count
+    assert [total for _, total in reports[:-1]] == [len(STORIES)] * 3
+    assert reports[-1] == (3, 3)
+    body = bdd_env.get_object(Bucket="output", Key=url.rsplit("/", 1)[1])["Body"].read().decode()
+    assert body.splitlines()[1:] == ["Feature: " + aws_s3.bdd_prompt(story)[-12:] for story in STORIES[::2]]
+
+
+def test_xlsx_row_count_reads_only_the_dimension():
+    with io.BytesIO(workbook_bytes(STORIES)) as spool:
+        assert aws_s3.xlsx_row_count(spool) == len(STORIES)
+        assert list(aws_s3.iter_xlsx_stories(spool)) == STORIES[::2]
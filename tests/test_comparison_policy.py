@@ -0,0 +1,100 @@
+import json
+
+import pytest
+
+import comparison_policy
+from comparison_policy import apply_policy, load_policy, mean_difference_significant, overall_verdict, weighted_change
+from performancecomapre import compare_stats, flatten_stats
+
+
+def tree(requests):
+    """A run with one request per (name, {metric: value}) entry."""
+    def stats(name, metrics):
+        return {"name": name, **{metric: {"total": value, "ok": value, "ko": 0} for metric, value in metrics.items()}}
+
+    return {"type": "GROUP", "name": "All Requests", "stats": stats("All Requests", {}),
+            "contents": {name.lower(): {"type": "REQUEST", "name": name, "stats": stats(name, metrics)}
+                         for name, metrics in requests.items()}}
+
+
+def graded(before, after, metrics=("percentiles3",), policy=None):
+    return apply_policy(compare_stats(flatten_stats(tree(before)), flatten_stats(tree(after))), list(metrics), policy)
+
+
+@pytest.fixture
+def default_policy(monkeypatch):
+    monkeypatch.setattr(comparison_policy, "COMPARISON_POLICY_PATH", None)
+    return load_policy()
+
+
+def p95(value, requests=100):
+    return {"percentiles3": value, "numberOfRequests": requests}
+
+
+def test_changes_are_graded_by_the_tolerance_bands(default_policy):
+    before = {"Same": p95(100), "Noise": p95(40), "Warn": p95(100), "Fail": p95(100), "Faster": p95(100)}
+    after = {"Same": p95(104), "Noise": p95(44), "Warn": p95(110), "Fail": p95(125), "Faster": p95(80)}
+    comparison = graded(before, after)
+
+    rows = comparison.loc[["same", "noise", "warn", "fail", "faster"]]
+    # Noise moved 10% but by less than min_delta milliseconds
+    assert rows["percentiles3_direction"].tolist() == ["same", "same", "slower", "slower", "faster"]
+    assert rows["percentiles3_verdict"].tolist() == ["pass", "pass", "warn", "fail", "pass"]
+    assert overall_verdict(comparison) == "fail"
+    assert comparison.loc["warn", "weight"] == 100
+
+
+def test_policy_file_overrides_metrics_and_transactions(tmp_path, monkeypatch):
+    path = tmp_path / "policy.json"
+    path.write_text(json.dumps({"default": {"warn_pct": 5},
+                                "metrics": {"percentiles3": {"fail_pct": 50}},
+                                "transactions": {"Checkout": {"*": {"warn_pct": 30}}}}))
+    monkeypatch.setattr(comparison_policy, "_policy", None)
+    policy = load_policy(str(path))
+    comparison = graded({"Login": p95(100), "Checkout": p95(100)}, {"Login": p95(125), "Checkout": p95(125)},
+                        policy=policy)
+    assert comparison.loc["login", "percentiles3_verdict"] == "warn"
+    assert comparison.loc["checkout", "percentiles3_verdict"] == "pass"
+
+
+def mean(value, std, requests):
+    return {"meanResponseTime": value, "standardDeviation": std, "numberOfRequests": requests}
+
+
+def test_mean_changes_must_pass_the_welch_test(default_policy):
+    before = {"Steady": mean(100, 5, 1000), "Noisy": mean(100, 400, 20)}
+    after = {"Steady": mean(130, 5, 1000), "Noisy": mean(130, 400, 20)}
+    comparison = graded(before, after, ["meanResponseTime"])
+
+    assert mean_difference_significant(comparison, 0.95).loc[["steady", "noisy"]].tolist() == [True, False]
+    assert comparison.loc["steady", "meanResponseTime_verdict"] == "fail"
+    # Within the noise of so few samples, even a 30% change passes
+    assert comparison.loc["noisy", "meanResponseTime_direction"] == "same"
+    assert comparison.loc["noisy", "meanResponseTime_verdict"] == "pass"
+
+
+def test_rows_without_spread_leave_the_decision_to_the_bands(default_policy):
+    comparison = graded({"Login": {"meanResponseTime": 100}}, {"Login": {"meanResponseTime": 130}},
+                        ["meanResponseTime"])
+    assert comparison.loc["login", "meanResponseTime_verdict"] == "fail"
+
+
+def test_zero_baselines_are_judged_on_the_absolute_change(default_policy):
+    comparison = graded({"Tiny": p95(0), "Big": p95(0), "Idle": p95(0)},
+                        {"Tiny": p95(3), "Big": p95(50), "Idle": p95(0)})
+    assert comparison.loc[["tiny", "big", "idle"], "percentiles3_verdict"].tolist() == ["pass", "fail", "pass"]
+
+
+def test_overall_verdict_is_the_worst_row(default_policy):
+    before = {"Login": p95(100), "Search": p95(100)}
+    assert overall_verdict(graded(before, before)) == "pass"
+    # A transaction missing from the second run warns; a new one does not
+    assert overall_verdict(graded(before, {"Login": p95(100)})) == "warn"
+    assert overall_verdict(graded({"Login": p95(100)}, before)) == "pass"
+    assert overall_verdict(graded(before, {"Login": p95(100), "Search": p95(150)})) == "fail"
+    assert overall_verdict(graded(before, before).iloc[:0]) == "pass"
+
+
+def test_weighted_change_weighs_requests_by_traffic(default_policy):
+    comparison = graded({"Hot": p95(100, 900), "Cold": p95(100, 100)}, {"Hot": p95(90, 900), "Cold": p95(200, 100)})
+    assert weighted_change(comparison, "percentiles3") == 1.0
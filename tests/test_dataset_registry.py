@@ -0,0 +1,85 @@
+import os
+
+import pytest
+
+import dataset_registry
+from dataset_registry import (JIRA_EXPORT, SUMMARIZED, UPLOADED, derived_dataset, get_dataset, latest_dataset,
+                              list_datasets, register_dataset, scan_folder)
+
+EXPORT = "Summary,Issue key\nLogin fails,QA-1\nSearch is slow,QA-2\n"
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    monkeypatch.setattr(dataset_registry, "DATASET_DB_PATH", str(tmp_path / "datasets.db"))
+    return tmp_path
+
+
+def write(path, text=EXPORT):
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def test_registering_the_same_content_returns_the_existing_entry(registry):
+    first = register_dataset(UPLOADED, write(registry / "a.csv"))
+    again = register_dataset(UPLOADED, write(registry / "copy.csv"))
+
+    assert again == first
+    dataset = get_dataset(first)
+    assert (dataset["path"], dataset["rows"], dataset["parent_id"]) == (str(registry / "copy.csv"), 2, None)
+    assert len(list_datasets()) == 1
+    # Kind and parent are part of the identity
+    assert register_dataset(JIRA_EXPORT, str(registry / "a.csv")) != first
+    assert register_dataset(UPLOADED, str(registry / "a.csv"), parent_id=first) != first
+
+
+def test_latest_dataset_skips_entries_whose_file_is_gone(registry):
+    older = register_dataset(UPLOADED, write(registry / "old.csv"))
+    newer = register_dataset(JIRA_EXPORT, write(registry / "new.csv", EXPORT + "Crash,QA-3\n"))
+    register_dataset(SUMMARIZED, write(registry / "summary.csv", "Summary\n"))
+
+    assert latest_dataset(dataset_registry.RAW_KINDS)["dataset_id"] == newer
+    os.remove(registry / "new.csv")
+    assert latest_dataset(dataset_registry.RAW_KINDS)["dataset_id"] == older
+    assert latest_dataset(("embedded",)) is None
+
+
+def test_derived_dataset_is_found_by_the_input_hash(registry):
+    raw = register_dataset(UPLOADED, write(registry / "a.csv"))
+    summary = register_dataset(SUMMARIZED, write(registry / "summarized_a.csv", "Summary,abstract\n"), parent_id=raw)
+    content_hash = get_dataset(raw)["content_hash"]
+
+    assert derived_dataset(content_hash, SUMMARIZED)["dataset_id"] == summary
+    assert derived_dataset(content_hash, dataset_registry.EMBEDDED) is None
+    os.remove(registry / "summarized_a.csv")
+    assert derived_dataset(content_hash, SUMMARIZED) is None
+
+
+def test_scan_folder_registers_only_unknown_files_by_name(registry):
+    folder = registry / "upload"
+    folder.mkdir()
+    write(folder / "defects.csv")
+    write(folder / "jira_export_1.csv", EXPORT + "Crash,QA-3\n")
+    write(folder / "summarized_defects.csv", "Summary,abstract\nLogin fails,x\n")
+    (folder / "nested").mkdir()
+
+    new_ids = scan_folder(str(folder))
+    kinds = {os.path.basename(get_dataset(dataset_id)["path"]): get_dataset(dataset_id)["kind"]
+             for dataset_id in new_ids}
+    assert kinds == {"defects.csv": UPLOADED, "jira_export_1.csv": JIRA_EXPORT, "summarized_defects.csv": SUMMARIZED}
+    assert scan_folder(str(folder)) == []
+    assert scan_folder(str(registry / "missing")) == []
+
+
+def test_a_file_changed_in_place_keeps_its_parent(registry, flask_app):
+    app = flask_app
+    raw = register_dataset(UPLOADED, write(registry / "a.csv"))
+    summary_path = write(registry / "summarized_a.csv", "Summary,abstract\nLogin fails,x\n")
+    summary = get_dataset(register_dataset(SUMMARIZED, summary_path, parent_id=raw))
+
+    assert app.current_dataset(summary) == summary
+    write(registry / "summarized_a.csv", "Summary,abstract\nLogin fails,edited\n")
+    current = app.current_dataset(summary)
+    assert current["dataset_id"] != summary["dataset_id"]
+    assert current["parent_id"] == raw
+    assert derived_dataset(get_dataset(raw)["content_hash"], SUMMARIZED)["dataset_id"] == current["dataset_id"]
@@ -0,0 +1,78 @@
+import csv
+import io
+
+import pytest
+
+import defect_prefilter
+from defect_prefilter import ANSWER_HEADER, DefectIndex, normalize, prefilter, trigrams
+
+EXPORT = (
+    "Summary,Issue key,Issue id,Project name,Assignee,Components,abstract\n"
+    "Login button fails on the checkout page,QA-1,1,Portal,Ann,Auth,Users cannot sign in at checkout\n"
+    "Login button fails on checkout,QA-2,2,Portal,,Auth,\n"
+    "Report totals are off by one,QA-3,3,Billing,Cy,Reports,Totals wrong\n"
+    "Search returns nothing,QA-4,4,Portal,Di,Search,\n"
+)
+
+
+@pytest.fixture
+def export(tmp_path, monkeypatch):
+    monkeypatch.setattr(defect_prefilter, "PREFILTER_ENABLED", True)
+    file_path = tmp_path / "summarized.csv"
+    file_path.write_text(EXPORT, encoding="utf-8")
+    return str(file_path)
+
+
+def jaccard(a, b):
+    a, b = trigrams(normalize(a)), trigrams(normalize(b))
+    return len(a & b) / len(a | b)
+
+
+def rows_of(answer):
+    return list(csv.reader(io.StringIO(answer)))
+
+
+def test_exact_match_answers_with_the_chain_layout(export):
+    issue = "**Login button fails on the checkout page!**"
+    [answer] = prefilter([issue], export)
+    rows = rows_of(answer)
+    assert rows[0] == ANSWER_HEADER
+    assert rows[1] == [issue, "QA-1", "Login button fails on the checkout page", "Portal", "Ann", "Auth"]
+    # As many candidates as the chain is given, closest first
+    assert len(rows) == 1 + defect_prefilter.PREFILTER_CANDIDATES
+    assert rows[2][1] == "QA-2"
+    assert rows[2][4] == ""
+
+
+def test_abstract_matches_exactly_too(export):
+    [answer] = prefilter(["users cannot sign in at checkout"], export, candidates=1)
+    assert [row[1] for row in rows_of(answer)[1:]] == ["QA-1"]
+
+
+def test_near_duplicates_are_answered_only_above_the_threshold(export):
+    issue = "Login button fails on the checkout pages"
+    score = jaccard(issue, "Login button fails on the checkout page")
+    assert 0.8 < score < 1.0
+
+    [answer] = prefilter([issue], export, threshold=score - 0.01, candidates=2)
+    assert [row[1] for row in rows_of(answer)[1:]] == ["QA-1", "QA-2"]
+    assert prefilter([issue], export, threshold=score + 0.01) == [None]
+
+
+def test_unrelated_and_empty_issues_go_to_the_chain(export):
+    assert prefilter([], export) == []
+    assert prefilter(["", "!!!", "Payment gateway times out"], export) == [None, None, None]
+
+
+def test_missing_export_or_disabled_prefilter_answers_nothing(export, monkeypatch):
+    assert prefilter(["Search returns nothing"], None) == [None]
+    monkeypatch.setattr(defect_prefilter, "PREFILTER_ENABLED", False)
+    assert prefilter(["Search returns nothing"], export) == [None]
+
+
+def test_matches_rank_by_trigram_similarity(export):
+    index = DefectIndex.from_file(export)
+    matches = index.matches("report totals off", limit=5)
+    assert matches[0][0] == 2
+    assert [score for _, score in matches] == sorted((score for _, score in matches), reverse=True)
+    assert all(0 < score < 1 for _, score in matches)
@@ -0,0 +1,164 @@
+import logging
+import os
+
+import pytest
+
+pytest.importorskip("chromadb")
+# embedGenerate copies the OpenAI key into the environment at import time
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from langchain_core.embeddings import Embeddings
+
+import embedGenerate
+
+HEADER = "Summary,Issue key,Issue id,Project name,Assignee,Components,abstract\n"
+
+
+class FakeEmbeddings(Embeddings):
+    """Deterministic 8-dimensional vectors; records every text it is asked to embed."""
+
+    def __init__(self):
+        self.embedded = []
+
+    def vector(self, text):
+        return [float(byte) for byte in text.encode("utf-8")[:8].ljust(8, b"\0")]
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return [self.vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.vector(text)
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    fake = FakeEmbeddings()
+    monkeypatch.setattr(embedGenerate, "VECTORSTORE_DIR", str(tmp_path / "vectorstore"))
+    monkeypatch.setattr(embedGenerate, "embeddings", fake)
+    monkeypatch.setattr(embedGenerate, "vectorstore", None)
+    monkeypatch.setattr(embedGenerate, "vectorstore_version", None)
+    yield fake
+    if embedGenerate.vectorstore is not None:
+        embedGenerate.vectorstore._client.clear_system_cache()
+
+
+def write_export(path, *rows):
+    path.write_text(HEADER + "".join(f"{row}\n" for row in rows), encoding="utf-8")
+    return str(path)
+
+
+def stored_ids():
+    return set(embedGenerate.get_vectorstore().get(include=[])["ids"])
+
+
+def test_reingest_embeds_only_new_chunks_and_drops_removed_ones(tmp_path, store):
+    export = tmp_path / "summarized.csv"
+    file_path = write_export(export, "Login fails,QA-1,1,Portal,Ann,Auth,a", "Page blank,QA-2,2,Portal,Bo,UI,b")
+    assert embedGenerate.vector_embedding(file_path) == file_path
+    first = stored_ids()
+    assert len(first) == len(store.embedded) == 2
+    assert all(len(doc_id) == 64 for doc_id in first)
+
+    store.embedded.clear()
+    assert embedGenerate.vector_embedding(file_path) == file_path
+    assert store.embedded == []
+    assert stored_ids() == first
+
+    write_export(export, "Login fails,QA-1,1,Portal,Ann,Auth,a", "Totals off,QA-3,3,Billing,Cy,UI,c")
+    embedGenerate.vector_embedding(file_path)
+    assert len(store.embedded) == 1 and "QA-3" in store.embedded[0]
+    kept = stored_ids()
+    assert len(kept) == 2 and len(kept & first) == 1
+    assert embedGenerate.read_vectorstore_source() == os.path.abspath(file_path)
+
+
+def test_vectorstore_reopens_when_another_worker_bumps_the_version(tmp_path, store):
+    file_path = write_export(tmp_path / "summarized.csv", "Login fails,QA-1,1,Portal,Ann,Auth,a")
+    embedGenerate.vector_embedding(file_path)
+    opened = embedGenerate.get_vectorstore()
+    assert embedGenerate.get_vectorstore() is opened
+
+    embedGenerate.write_vectorstore_marker("VERSION", "written-by-another-worker")
+    reopened = embedGenerate.get_vectorstore()
+    assert reopened is not opened
+    assert embedGenerate.vectorstore_version == "written-by-another-worker"
+    assert len(reopened.get(include=[])["ids"]) == 1
+
+
+def test_batched_search_matches_per_issue_similarity_search(tmp_path, store):
+    rows = [f"Defect {n},QA-{n},{n},Portal,Ann,UI,issue {n}" for n in range(6)]
+    embedGenerate.vector_embedding(write_export(tmp_path / "summarized.csv", *rows))
+    vectorstore = embedGenerate.get_vectorstore()
+    issues = ["Summary: Defect 2", "Issue key: QA-4", "nothing alike"]
+
+    batched = embedGenerate.batch_similarity_search(vectorstore, issues, k=3)
+    assert batched == [vectorstore.similarity_search(issue, k=3) for issue in issues]
+    assert embedGenerate.batch_similarity_search(vectorstore, []) == []
+
+
+WORDS = "login fails page blank totals off checkout error timeout payment report export".split()
+
+
+def word_tokenizer():
+    """A padded BERT-style pair tokenizer over a tiny vocabulary, as flashrank configures its own."""
+    from tokenizers import Tokenizer
+    from tokenizers.models import WordLevel
+    from tokenizers.pre_tokenizers import Whitespace
+    from tokenizers.processors import TemplateProcessing
+
+    vocab = {"[PAD]": 0, "[UNK]": 1, "[CLS]": 2, "[SEP]": 3, **{word: n + 4 for n, word in enumerate(WORDS)}}
+    tokenizer = Tokenizer(WordLevel(vocab, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = Whitespace()
+    tokenizer.post_processor = TemplateProcessing(single="[CLS] $A [SEP]", pair="[CLS] $A [SEP] $B:1 [SEP]:1",
+                                                  special_tokens=[("[CLS]", 2), ("[SEP]", 3)])
+    tokenizer.enable_padding(pad_id=0, pad_token="[PAD]")
+    return tokenizer
+
+
+class OverlapSession:
+    """Stands in for the ONNX cross-encoder: scores query/passage token overlap, ignoring padding."""
+
+    def __init__(self, labels):
+        self.labels = labels
+
+    def run(self, output_names, onnx_input):
+        import numpy as np
+
+        ids = onnx_input["input_ids"] * onnx_input["attention_mask"]
+        types = onnx_input["token_type_ids"]
+        overlap = np.array([len(set(row[kind == 0]) & set(row[kind == 1]) - {0, 2, 3})
+                            for row, kind in zip(ids, types)], dtype=np.float32)
+        length = onnx_input["attention_mask"].sum(axis=1).astype(np.float32)
+        logits = overlap - length / 100
+        if self.labels == 1:
+            return [logits[:, None]]
+        return [np.stack([-logits, logits], axis=1)]
+
+
+@pytest.mark.parametrize("labels", [1, 2])
+def test_batched_rerank_matches_flashrank_per_issue(labels, monkeypatch):
+    from flashrank import Ranker
+    from langchain.retrievers.document_compressors import FlashrankRerank
+    from langchain_core.documents import Document
+
+    ranker = Ranker.__new__(Ranker)
+    ranker.logger = logging.getLogger("flashrank")
+    ranker.llm_model = None
+    ranker.tokenizer = word_tokenizer()
+    ranker.session = OverlapSession(labels)
+    # Skip validation, which would download the default model
+    compressor = FlashrankRerank.construct(client=ranker, top_n=3)
+    # Several forward passes, each mixing the candidates of different issues
+    monkeypatch.setattr(embedGenerate, "DEFECT_RERANK_BATCH", 5)
+
+    issues = ["login fails", "page blank", "checkout payment timeout", "report export"]
+    passages = ["login fails on page", "page blank after login", "checkout error", "payment timeout on checkout",
+                "totals off in report", "export report blank"]
+    candidates = [[Document(page_content=text, metadata={"row": n}) for n, text in enumerate(passages)]
+                  for _ in issues]
+
+    expected = [compressor.compress_documents([doc.copy(deep=True) for doc in docs], issue)
+                for issue, docs in zip(issues, candidates)]
+    assert embedGenerate.rerank_batch(compressor, issues, candidates) == expected
+    assert [doc.metadata["row"] for doc in expected[2]] == [3, 2, 5]
@@ -0,0 +1,40 @@
+from langchain_core.embeddings import Embeddings
+
+from embedding_cache import CachedEmbeddings, VectorCache, cache_dir_for
+
+
+class FakeEmbeddings(Embeddings):
+    def __init__(self, model, dim):
+        self.model = model
+        self.dim = dim
+        self.calls = 0
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        return [[float(len(text) + offset) for offset in range(self.dim)] for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def test_cached_vectors_are_not_requested_again(tmp_path):
+    model = FakeEmbeddings("small", 3)
+    embeddings = CachedEmbeddings(model, cache=VectorCache(str(tmp_path)), requests_per_minute=0)
+    first = embeddings.embed_documents(["a", "bb", "a"])
+    assert first == [[1.0, 2.0, 3.0], [2.0, 3.0, 4.0], [1.0, 2.0, 3.0]]
+    assert embeddings.embed_documents(["bb", "a"]) == [first[1], first[0]]
+    assert model.calls == 1
+
+
+def test_models_get_separate_cache_directories(tmp_path):
+    assert cache_dir_for(FakeEmbeddings("text-embedding-3-small", 3), str(tmp_path)) != \
+        cache_dir_for(FakeEmbeddings("text-embedding-3-large", 3), str(tmp_path))
+
+
+def test_dimension_change_resets_a_shared_cache(tmp_path):
+    cache = VectorCache(str(tmp_path))
+    CachedEmbeddings(FakeEmbeddings("m", 3), cache=cache, requests_per_minute=0).embed_documents(["abc", "de"])
+    wider = CachedEmbeddings(FakeEmbeddings("m", 5), cache=cache, requests_per_minute=0)
+    assert wider.embed_documents(["xy"]) == [[2.0, 3.0, 4.0, 5.0, 6.0]]
+    assert wider.embed_documents(["xy"]) == [[2.0, 3.0, 4.0, 5.0, 6.0]]
+    assert cache.get_many([wider.text_hash("abc")]) == {}
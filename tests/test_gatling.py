@@ -0,0 +1,75 @@
+import io
+import json
+
+import pandas as pd
+import pytest
+
+import run_history
+from gatling_stream import read_simulation_log, stream_stats_table
+from performancecomapre import FLATTEN_METRICS, flatten_stats
+
+
+def node_stats(name, base):
+    return {"name": name, **{metric: {"total": base + offset, "ok": base + offset, "ko": offset}
+                             for offset, metric in enumerate(FLATTEN_METRICS)}}
+
+
+STATS = {
+    "type": "GROUP", "name": "All Requests", "path": "", "stats": node_stats("All Requests", 100),
+    "contents": {
+        "login": {"type": "REQUEST", "name": "Login", "path": "Login", "stats": node_stats("Login", 40)},
+        "checkout": {"type": "GROUP", "name": "Checkout", "path": "Checkout", "stats": node_stats("Checkout", 60),
+                     "contents": {"pay": {"type": "REQUEST", "name": "Pay", "path": "Pay",
+                                          "stats": node_stats("Pay", 50)}}},
+    },
+}
+
+# Gatling 3 layout, and the older one with a user id after the record type
+SIMULATION_LOG = [
+    ("REQUEST\t\tLogin\t1000\t1120\tOK\t \n", "REQUEST\t7\t\tLogin\t1000\t1120\tOK\t \n"),
+    ("REQUEST\tCheckout\tPay\t2000\t2300\tOK\t \n", "REQUEST\t7\tCheckout\tPay\t2000\t2300\tOK\t \n"),
+    ("REQUEST\tCheckout\tPay\t3000\t3900\tKO\ttimeout\n", "REQUEST\t7\tCheckout\tPay\t3000\t3900\tKO\ttimeout\n"),
+    ("GROUP\tCheckout\t2000\t3900\t1200\tKO\n", "GROUP\t7\tCheckout\t2000\t3900\t1200\tKO\n"),
+]
+
+
+@pytest.fixture
+def history(tmp_path, monkeypatch):
+    monkeypatch.setattr(run_history, "RUN_HISTORY_PATH", str(tmp_path / "run_history.db"))
+    return run_history
+
+
+def test_streamed_stats_match_the_flattened_tree():
+    streamed = stream_stats_table(io.BytesIO(json.dumps(STATS).encode("utf-8")))
+    pd.testing.assert_frame_equal(streamed, flatten_stats(STATS))
+
+
+def test_both_simulation_log_layouts_read_the_same():
+    current = read_simulation_log(io.StringIO("".join(line for line, _ in SIMULATION_LOG)))
+    older = read_simulation_log(io.StringIO("".join(line for _, line in SIMULATION_LOG)))
+    pd.testing.assert_frame_equal(current, older)
+    assert list(older.index) == ["", "Login", "Checkout", "Checkout/Pay"]
+    assert older.loc["Checkout", "numberOfRequests_ko"] == 1
+    assert older.loc["Checkout", "maxResponseTime_ko"] == 1200
+
+
+def test_stats_json_gets_one_run_id_by_every_route(history):
+    body = json.dumps(STATS).encode("utf-8")
+    tree_id, _ = history.ingest_run(STATS)
+    upload_id, _ = history.ingest_file(io.BytesIO(body), "stats.json")
+    pretty_id, _ = history.ingest_file(io.BytesIO(json.dumps(STATS, indent=2).encode("utf-8")), "stats.json")
+    assert tree_id == upload_id == pretty_id
+    assert len(history.list_runs()) == 1
+
+
+def test_reupload_is_loaded_from_the_history(history, monkeypatch):
+    body = json.dumps(STATS).encode("utf-8")
+    run_id, table = history.ingest_file(io.BytesIO(body), "stats.json")
+
+    def no_parsing(fileobj, filename):
+        raise AssertionError("a known upload was parsed again")
+
+    monkeypatch.setattr(history, "read_results_table", no_parsing)
+    again_id, again = history.ingest_file(io.BytesIO(body), "stats.json")
+    assert again_id == run_id
+    pd.testing.assert_frame_equal(again[table.columns], table, check_dtype=False, check_index_type=False)
@@ -0,0 +1,176 @@
+import json
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import requests
+import responses
+
+import jira
+from jira import JiraClient
+
+JIRA_URL = "https://jira.example.com"
+BOARDS = f"{JIRA_URL}/rest/agile/1.0/board"
+
+
+def page_callback(items, key, with_total=True, server_page_size=None, requests_seen=None):
+    """Serve items as startAt/maxResults pages, as Jira's Agile API does."""
+
+    def callback(request):
+        query = parse_qs(urlparse(request.url).query)
+        start = int(query["startAt"][0])
+        size = min(int(query["maxResults"][0]), server_page_size or 10 ** 6)
+        if requests_seen is not None:
+            requests_seen.append(start)
+        body = {key: items[start:start + size], "startAt": start, "maxResults": size,
+                "isLast": start + size >= len(items)}
+        if with_total:
+            body["total"] = len(items)
+        return 200, {}, json.dumps(body)
+
+    return callback
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(jira, "JIRA_PAGE_SIZE", 10)
+    return JiraClient(JIRA_URL, "qa@example.com", "secret")
+
+
+@responses.activate
+def test_paged_fetches_remaining_pages_from_total(client):
+    boards = [{"id": n, "name": f"Board {n}"} for n in range(35)]
+    starts = []
+    responses.add_callback(responses.GET, BOARDS, callback=page_callback(boards, "values", requests_seen=starts))
+    assert client.boards() == boards
+    assert sorted(starts) == [0, 10, 20, 30]
+
+
+@responses.activate
+def test_paged_follows_is_last_without_total(client):
+    boards = [{"id": n} for n in range(23)]
+    responses.add_callback(responses.GET, BOARDS, callback=page_callback(boards, "values", with_total=False))
+    assert client.boards() == boards
+    assert len(responses.calls) == 3
+
+
+@responses.activate
+def test_paged_uses_the_page_size_the_server_caps_to(client, monkeypatch):
+    monkeypatch.setattr(jira, "JIRA_PAGE_SIZE", 100)
+    boards = [{"id": n} for n in range(12)]
+    starts = []
+    responses.add_callback(responses.GET, BOARDS,
+                           callback=page_callback(boards, "values", server_page_size=5, requests_seen=starts))
+    assert client.boards() == boards
+    assert sorted(starts) == [0, 5, 10]
+
+
+@responses.activate
+def test_etag_is_sent_back_and_304_reuses_the_payload(client):
+    sprints = f"{BOARDS}/4/sprint"
+    payload = {"values": [{"id": 2, "state": "active", "name": "Sprint 2"}], "isLast": True}
+    responses.add(responses.GET, sprints, json=payload, headers={"ETag": '"abc"'})
+    responses.add(responses.GET, sprints, status=304)
+
+    assert client.sprints(4, state="active") == payload["values"]
+    assert client.sprints(4, state="active") == payload["values"]
+    assert "If-None-Match" not in responses.calls[0].request.headers
+    assert responses.calls[1].request.headers["If-None-Match"] == '"abc"'
+
+
+@responses.activate
+def test_sprint_issues_requests_only_the_needed_fields(client):
+    issues_url = f"{BOARDS}/4/sprint/2/issue"
+    responses.add(responses.GET, issues_url, json={"issues": [{"id": "1"}], "total": 1, "maxResults": 10})
+    assert client.sprint_issues(4, 2) == [{"id": "1"}]
+    query = parse_qs(urlparse(responses.calls[0].request.url).query)
+    assert query["fields"] == [jira.ISSUE_FIELDS]
+
+
+@responses.activate
+def test_errors_are_raised(client):
+    responses.add(responses.GET, BOARDS, status=401)
+    with pytest.raises(requests.HTTPError):
+        client.boards()
+
+
+@pytest.fixture
+def lookups():
+    jira._lookups.clear()
+    yield jira._lookups
+    jira._lookups.clear()
+
+
+def cache(kind, email, password, board_id=None):
+    return jira.cached_lookup(kind, JIRA_URL, email, password, lambda: object(), board_id=board_id)
+
+
+def test_invalidation_matches_the_credentials_used(lookups):
+    cache("boards", "qa@example.com", None)
+    cache("boards", "dev@example.com", "other")
+    jira.invalidate_jira_cache(JIRA_URL, "qa@example.com", "")
+    assert len(lookups) == 1
+
+
+def test_invalidation_by_email_covers_every_password(lookups):
+    cache("boards", "qa@example.com", "old")
+    cache("boards", "qa@example.com", "new")
+    cache("boards", "dev@example.com", "new")
+    jira.invalidate_jira_cache(JIRA_URL, "qa@example.com")
+    assert len(lookups) == 1
+
+
+def test_invalidation_narrowed_to_a_board(lookups):
+    cache("sprints", "qa@example.com", "secret", board_id=4)
+    cache("sprints", "qa@example.com", "secret", board_id=5)
+    jira.invalidate_jira_cache(JIRA_URL, "qa@example.com", "secret", board_id=4)
+    assert [key[4] for key in lookups] == ["5"]
+
+
+@responses.activate
+def test_verify_credentials():
+    responses.add(responses.GET, f"{JIRA_URL}/rest/api/2/myself", json={"name": "qa"})
+    responses.add(responses.GET, f"{JIRA_URL}/rest/api/2/myself", status=401)
+    assert jira.verify_credentials(JIRA_URL, "qa@example.com", "secret")
+    assert not jira.verify_credentials(JIRA_URL, "qa@example.com", "wrong")
+    assert not jira.verify_credentials(JIRA_URL, "qa@example.com", None)
+
+
+@pytest.fixture
+def clients(monkeypatch):
+    monkeypatch.setattr(jira, "_clients", jira.OrderedDict())
+    return jira._clients
+
+
+def test_client_cache_evicts_the_least_recently_used(clients, monkeypatch):
+    monkeypatch.setattr(jira, "JIRA_MAX_CLIENTS", 2)
+    first = jira.get_client(JIRA_URL, "a@example.com", "1")
+    jira.get_client(JIRA_URL, "b@example.com", "2")
+    assert jira.get_client(JIRA_URL, "a@example.com", "1") is first
+    closed = []
+    monkeypatch.setattr(requests.Session, "close", lambda session: closed.append(session))
+
+    jira.get_client(JIRA_URL, "c@example.com", "3")
+    assert len(clients) == 2
+    assert jira.credential_key(JIRA_URL, "b@example.com", "2") not in clients
+    assert len(closed) == 1 and closed[0] is not first.session
+
+
+def test_idle_clients_expire(clients, monkeypatch):
+    stale = jira.get_client(JIRA_URL, "a@example.com", "1")
+    monkeypatch.setattr(jira, "JIRA_CLIENT_TTL", 0.0)
+    fresh = jira.get_client(JIRA_URL, "b@example.com", "2")
+    assert [client for _, client in clients.values()] == [fresh]
+    assert jira.get_client(JIRA_URL, "a@example.com", "1") is not stale
+
+
+@responses.activate
+def test_rejected_credentials_leave_no_client_behind(clients):
+    responses.add(responses.GET, f"{JIRA_URL}/rest/api/2/myself", status=401)
+    responses.add(responses.GET, BOARDS, status=401)
+    assert not jira.verify_credentials(JIRA_URL, "qa@example.com", "wrong")
+    assert jira.get_boardid(JIRA_URL, "qa@example.com", "wrong") == []
+    assert len(clients) == 0
+
+    responses.upsert(responses.GET, f"{JIRA_URL}/rest/api/2/myself", json={"name": "qa"})
+    assert jira.verify_credentials(JIRA_URL, "qa@example.com", "secret")
+    assert len(clients) == 1
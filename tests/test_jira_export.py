@@ -0,0 +1,119 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from urllib.parse import parse_qs, urlparse
+
+import httpx
+import pytest
+
+import jira
+import jira_export
+from jira_export import AsyncJiraCrawler
+
+JIRA_URL = "https://jira.example.com"
+SHARED_SPRINT = {"id": 7, "name": "Sprint 7", "state": "active"}
+
+
+def issue(n):
+    return {"id": str(n), "key": f"QA-{n}", "fields": {"summary": f"Issue {n}", "issuetype": {"name": "Bug"}}}
+
+
+class FakeJira:
+    """Two scrum boards sharing sprint 7, a Kanban board without sprints, and 25 issues in the sprint."""
+
+    def __init__(self, throttle=None):
+        self.throttle = list(throttle or [])
+        self.requests = []
+
+    def page(self, items, key, query):
+        start = int(query["startAt"][0])
+        size = int(query["maxResults"][0])
+        return {key: items[start:start + size], "startAt": start, "maxResults": size, "total": len(items)}
+
+    def __call__(self, request):
+        url = urlparse(str(request.url))
+        query = parse_qs(url.query)
+        self.requests.append(url.path)
+        if self.throttle:
+            return httpx.Response(429, headers={"Retry-After": self.throttle.pop(0)})
+        if url.path == "/rest/agile/1.0/board":
+            boards = [{"id": 1, "name": "Web"}, {"id": 2, "name": "Mobile"}, {"id": 3, "name": "Support"}]
+            return httpx.Response(200, json=self.page(boards, "values", query))
+        if url.path == "/rest/agile/1.0/board/3/sprint":
+            return httpx.Response(400, json={"errorMessages": ["The board does not support sprints"]})
+        if url.path in ("/rest/agile/1.0/board/1/sprint", "/rest/agile/1.0/board/2/sprint"):
+            assert query["state"] == ["active"]
+            return httpx.Response(200, json=self.page([SHARED_SPRINT], "values", query))
+        if url.path.endswith("/sprint/7/issue"):
+            return httpx.Response(200, json=self.page([issue(n) for n in range(25)], "issues", query))
+        return httpx.Response(404)
+
+
+def crawl(fake, progress=None):
+    async def run():
+        async with httpx.AsyncClient(base_url=JIRA_URL, transport=httpx.MockTransport(fake)) as client:
+            return await AsyncJiraCrawler(client).crawl(progress=progress)
+
+    return asyncio.run(run())
+
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    waits = []
+
+    async def sleep(seconds):
+        waits.append(seconds)
+
+    monkeypatch.setattr(jira_export.asyncio, "sleep", sleep)
+    monkeypatch.setattr(jira, "JIRA_PAGE_SIZE", 10)
+    return waits
+
+
+def test_shared_sprints_are_fetched_once_and_kanban_boards_skipped(no_sleep):
+    fake = FakeJira()
+    reports = []
+    rows = crawl(fake, progress=lambda done, total: reports.append((done, total)))
+
+    assert [row["Issue key"] for row in rows] == [f"QA-{n}" for n in range(25)]
+    assert {row["Sprint id"] for row in rows} == {7}
+    assert reports == [(1, 1)]
+    # One board listing, three sprint listings, and three pages of the shared sprint's issues
+    assert sum(path.endswith("/sprint/7/issue") for path in fake.requests) == 3
+    assert "/rest/agile/1.0/board/3/sprint" in fake.requests
+
+
+def test_throttled_requests_wait_for_retry_after(no_sleep):
+    soon = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    rows = crawl(FakeJira(throttle=["2", soon, "not a date"]))
+    assert len(rows) == 25
+    assert no_sleep[0] == 2.0
+    assert 25 <= no_sleep[1] <= 30
+    # An unparseable Retry-After on the third attempt falls back to exponential backoff
+    assert no_sleep[2] == 4
+
+
+def test_page_plan_steps_by_the_page_size_the_server_caps_to(monkeypatch):
+    monkeypatch.setattr(jira, "JIRA_PAGE_SIZE", 10)
+    items = list(range(23))
+
+    def answer(params):
+        start, size = params["startAt"], min(params["maxResults"], 4)
+        return {"values": items[start:start + size], "maxResults": size, "total": len(items)}
+
+    plan = jira.plan_pages("values", {"state": "active"})
+    batch = next(plan)
+    assert batch == [{"state": "active", "startAt": 0, "maxResults": 10}]
+    batch = plan.send([answer(params) for params in batch])
+    # The server capped pages at 4, so the rest are planned in steps of 4
+    assert [params["startAt"] for params in batch] == [4, 8, 12, 16, 20]
+    with pytest.raises(StopIteration) as done:
+        plan.send([answer(params) for params in batch])
+    assert done.value.value == items
+
+
+def test_retry_delay_handles_seconds_dates_and_garbage():
+    past = format_datetime(datetime.now(timezone.utc) - timedelta(minutes=5), usegmt=True)
+    assert jira_export.retry_delay(httpx.Response(429, headers={"Retry-After": "3"}), 0) == 3.0
+    assert jira_export.retry_delay(httpx.Response(429, headers={"Retry-After": past}), 0) == 0.0
+    assert jira_export.retry_delay(httpx.Response(503), 2) == 4
+    assert jira_export.retry_delay(httpx.Response(429, headers={"Retry-After": "soon"}), 1) == 2
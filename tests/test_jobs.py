@@ -0,0 +1,114 @@
+import json
+import sqlite3
+import time
+
+import pytest
+
+import jobs
+from jobs import SQLiteJobBackend, ThreadJobBackend, register_task
+
+
+@pytest.fixture
+def echo_task():
+    register_task("echo", lambda progress=None, **kwargs: json.dumps(kwargs, sort_keys=True))
+    yield "echo"
+    jobs.TASKS.pop("echo", None)
+
+
+def stored_job(db_path, job_id):
+    with sqlite3.connect(db_path) as conn:
+        conn.row_factory = sqlite3.Row
+        return dict(conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone())
+
+
+def test_sqlite_backend_keeps_secrets_out_of_the_store(tmp_path, echo_task):
+    db_path = str(tmp_path / "jobs.db")
+    backend = SQLiteJobBackend(db_path, max_workers=0)
+    job_id = backend.submit(echo_task, email="qa@example.com", password="hunter2")
+    assert "hunter2" not in stored_job(db_path, job_id)["kwargs"]
+
+    # Another process sharing the queue cannot run a job whose secrets it does not hold
+    assert SQLiteJobBackend(db_path, max_workers=0).claim() is None
+    claimed_id, task, kwargs = backend.claim()
+    assert (claimed_id, task, kwargs) == (job_id, echo_task, {"email": "qa@example.com", "password": "hunter2"})
+
+
+def test_sqlite_backend_recovers_jobs_of_crashed_workers(tmp_path, echo_task, monkeypatch):
+    db_path = str(tmp_path / "jobs.db")
+    crashed = SQLiteJobBackend(db_path, max_workers=0)
+    plain = crashed.submit(echo_task, value=1)
+    secret = crashed.submit(echo_task, password="hunter2")
+    assert crashed.claim()[0] == plain
+    assert crashed.claim()[0] == secret
+    monkeypatch.setattr(jobs, "JOB_STALE_AFTER", 0.0)
+    time.sleep(0.01)
+
+    SQLiteJobBackend(db_path, max_workers=0)
+    assert stored_job(db_path, plain)["status"] == "queued"
+    assert stored_job(db_path, secret)["status"] == "failed"
+
+
+def test_sqlite_backend_fails_jobs_that_keep_crashing(tmp_path, echo_task, monkeypatch):
+    db_path = str(tmp_path / "jobs.db")
+    monkeypatch.setattr(jobs, "JOB_STALE_AFTER", 0.0)
+    backend = SQLiteJobBackend(db_path, max_workers=0)
+    job_id = backend.submit(echo_task, value=1)
+    for _ in range(jobs.JOB_MAX_ATTEMPTS):
+        assert backend.claim()[0] == job_id
+        time.sleep(0.01)
+        backend.recover()
+    assert stored_job(db_path, job_id)["status"] == "failed"
+
+
+def test_thread_backend_prunes_expired_jobs(echo_task, monkeypatch):
+    backend = ThreadJobBackend(max_workers=1)
+    first = backend.submit(echo_task, password="hunter2")
+    backend.executor.shutdown(wait=True)
+    assert backend.get(first)["status"] == "finished"
+    assert "password" not in backend.jobs[first]["kwargs"]
+
+    backend.executor = jobs.ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(jobs, "JOB_TTL", 0.0)
+    time.sleep(0.01)
+    backend.submit(echo_task, value=1)
+    assert backend.get(first) is None
+
+
+def test_sqlite_backend_keeps_a_bounded_tail_of_partials(tmp_path, echo_task, monkeypatch):
+    db_path = str(tmp_path / "jobs.db")
+    monkeypatch.setattr(jobs, "JOB_PARTIAL_LIMIT", 3)
+    backend = SQLiteJobBackend(db_path, max_workers=0)
+    job_id = backend.submit(echo_task, value=1)
+    for row in range(10):
+        backend.report(job_id, row + 1, 10, {"row": row})
+    job = backend.get(job_id)
+    assert (job["done"], job["total"]) == (10, 10)
+    assert job["partial"] == [{"row": 7}, {"row": 8}, {"row": 9}]
+
+    backend.report(job_id, 10)
+    assert backend.get(job_id)["total"] == 10
+    backend.update(job_id, status="finished", url="s3://bucket/out.csv", partial=[])
+    assert backend.get(job_id)["partial"] == []
+
+
+def test_thread_backend_drops_partials_once_finished(echo_task, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_PARTIAL_LIMIT", 2)
+
+    tails = []
+
+    def chatty(progress=None):
+        for row in range(5):
+            progress(row + 1, 5, row)
+        tails.extend(list(job["partial"]) for job in backend.jobs.values())
+        return "s3://bucket/out.csv"
+
+    register_task("chatty", chatty)
+    try:
+        backend = ThreadJobBackend(max_workers=1)
+        job_id = backend.submit("chatty")
+        backend.executor.shutdown(wait=True)
+        assert tails == [[3, 4]]
+        job = backend.get(job_id)
+        assert (job["status"], job["partial"]) == ("finished", [])
+    finally:
+        jobs.TASKS.pop("chatty", None)
@@ -0,0 +1,105 @@
+import sqlite3
+
+import pytest
+
+import llm_cache
+
+
+@pytest.fixture
+def cache(llm_cache_path):
+    return llm_cache_path
+
+
+def counting(response="answer"):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return response
+
+    return calls, compute
+
+
+def test_repeated_prompts_are_served_from_the_cache(cache):
+    calls, compute = counting()
+    assert llm_cache.cached_call("model", {}, "prompt", compute) == "answer"
+    assert llm_cache.cached_call("model", {}, "prompt", compute) == "answer"
+    assert llm_cache.cached_call("model", {"temperature": 1}, "prompt", compute) == "answer"
+    assert len(calls) == 2
+
+    stats = llm_cache.cache_stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 2, 2)
+    assert stats["hit_rate"] == 0.3333
+
+
+def test_no_cache_bypasses_lookup_and_store(cache, monkeypatch):
+    calls, compute = counting()
+    llm_cache.cached_call("model", {}, "prompt", compute, use_cache=False)
+    llm_cache.cached_call("model", {}, "prompt", compute, use_cache=False)
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_ENABLED", False)
+    llm_cache.cached_call("model", {}, "prompt", compute)
+    assert len(calls) == 3
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_ENABLED", True)
+    stats = llm_cache.cache_stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (0, 0, 0)
+
+
+def test_expired_entries_are_recomputed(cache, monkeypatch):
+    calls, compute = counting()
+    llm_cache.cached_call("model", {}, "prompt", compute)
+    with sqlite3.connect(cache) as conn:
+        conn.execute("UPDATE responses SET created = created - 100")
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_TTL", 50)
+    llm_cache.cached_call("model", {}, "prompt", compute)
+    assert len(calls) == 2
+    assert llm_cache.cache_stats()["entries"] == 1
+
+
+def test_least_recently_used_entries_are_evicted_over_the_size_cap(cache, monkeypatch):
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_MAX_BYTES", 25)
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_FLUSH_INTERVAL", 3600)
+    for prompt in ("a", "b"):
+        llm_cache.cached_call("model", {}, prompt, lambda: "x" * 10)
+    with sqlite3.connect(cache) as conn:
+        conn.execute("UPDATE responses SET accessed = accessed - 10")
+    # The buffered hit on "a" must count when choosing what to evict
+    llm_cache.cached_call("model", {}, "a", lambda: "unused")
+    llm_cache.cached_call("model", {}, "c", lambda: "x" * 10)
+
+    with sqlite3.connect(cache) as conn:
+        kept = {row[0] for row in conn.execute("SELECT key FROM responses")}
+    assert kept == {llm_cache.cache_key("model", {}, prompt) for prompt in ("a", "c")}
+    assert llm_cache.cache_stats()["evictions"] == 1
+
+
+def test_hits_are_buffered_instead_of_written(cache, monkeypatch):
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_FLUSH_INTERVAL", 3600)
+    llm_cache.cached_call("model", {}, "prompt", lambda: "answer")
+    key = llm_cache.cache_key("model", {}, "prompt")
+
+    def accessed():
+        with sqlite3.connect(cache) as conn:
+            return conn.execute("SELECT accessed FROM responses WHERE key = ?", (key,)).fetchone()[0]
+
+    before = accessed()
+    for _ in range(5):
+        assert llm_cache.lookup(key) == "answer"
+    assert accessed() == before
+    assert llm_cache.cache_stats()["hits"] == 5
+    assert accessed() > before
+
+
+def test_rejected_responses_are_not_cached(cache):
+    answers = iter(["not json", "[\"ok\"]"])
+    calls, compute = counting()
+    accept = lambda text: text.startswith("[")
+
+    assert llm_cache.cached_call("model", {}, "prompt", lambda: next(answers), accept=accept) == "not json"
+    assert llm_cache.cached_call("model", {}, "prompt", lambda: next(answers), accept=accept) == "[\"ok\"]"
+    assert llm_cache.cached_call("model", {}, "prompt", compute, accept=accept) == "[\"ok\"]"
+    assert calls == []
+
+    # A bad answer cached before accept was used is asked again and replaced
+    llm_cache.cached_call("model", {}, "other", lambda: "not json")
+    assert llm_cache.cached_call("model", {}, "other", lambda: "[]", accept=accept) == "[]"
+    assert llm_cache.cached_call("model", {}, "other", compute) == "[]"
@@ -0,0 +1,116 @@
+import threading
+import time
+
+import pytest
+
+import llm_dispatcher
+from llm_dispatcher import (AdaptiveTokenBucket, FakeModel, FakeStatusError, TokenBucket, dispatch,
+                            send_prompt)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(llm_dispatcher, "backoff_delay", lambda attempt, base=None, cap=None: 0)
+
+
+def test_token_bucket_paces_after_burst():
+    bucket = TokenBucket(600, burst=2)
+    start = time.monotonic()
+    for _ in range(5):
+        bucket.acquire()
+    # Two tokens are available at once, the other three arrive at 10 per second
+    assert time.monotonic() - start >= 0.28
+
+
+def test_token_bucket_without_rate_never_blocks():
+    bucket = TokenBucket(0)
+    start = time.monotonic()
+    for _ in range(100):
+        bucket.acquire()
+    assert time.monotonic() - start < 0.1
+
+
+def test_adaptive_bucket_halves_on_throttle_and_recovers():
+    bucket = AdaptiveTokenBucket(600, min_requests_per_minute=60)
+    bucket.on_throttle()
+    assert bucket.rate == pytest.approx(5.0)
+    assert bucket.tokens <= 0
+    for _ in range(3):
+        bucket.on_throttle()
+    assert bucket.rate == pytest.approx(1.0)
+    for _ in range(40):
+        bucket.on_success()
+    assert bucket.rate == pytest.approx(10.0)
+
+
+def test_dispatch_returns_results_in_input_order():
+    model = FakeModel(latency=(0.0, 0.02), seed=1)
+    prompts = [f"prompt {index}" for index in range(20)]
+    results = dispatch(prompts, lambda prompt: send_prompt(model, prompt), max_concurrency=4,
+                       requests_per_minute=0)
+    assert results == [f"response to: prompt {index}" for index in range(20)]
+
+
+def test_dispatch_limits_concurrency_and_reads_prompts_lazily():
+    lock = threading.Lock()
+    state = {"running": 0, "peak": 0, "pulled": 0}
+
+    def prompts():
+        for index in range(12):
+            state["pulled"] += 1
+            yield index
+
+    def handler(prompt):
+        with lock:
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+        time.sleep(0.01)
+        with lock:
+            state["running"] -= 1
+        return prompt * 2
+
+    assert dispatch(prompts(), handler, max_concurrency=3, requests_per_minute=0) == [i * 2 for i in range(12)]
+    assert state["peak"] <= 3
+    assert state["pulled"] == 12
+
+
+def test_dispatch_retries_retryable_errors():
+    model = FakeModel(error_rate=0.3, error_codes=(429, 503), seed=7)
+    results = dispatch(range(30), lambda prompt: send_prompt(model, prompt), max_concurrency=4,
+                       requests_per_minute=0, max_retries=20, adaptive=True)
+    assert results == [f"response to: {index}" for index in range(30)]
+    assert model.calls > 30
+
+
+def test_dispatch_raises_first_failure_without_return_exceptions():
+    def handler(prompt):
+        if prompt == 3:
+            raise ValueError("bad prompt")
+        return prompt
+
+    with pytest.raises(ValueError, match="bad prompt"):
+        dispatch(range(6), handler, max_concurrency=2, requests_per_minute=0)
+
+
+def test_dispatch_return_exceptions_keeps_errors_in_place():
+    def handler(prompt):
+        if prompt % 2:
+            raise FakeStatusError(400)
+        return prompt
+
+    results = dispatch(range(4), handler, max_concurrency=2, requests_per_minute=0, return_exceptions=True)
+    assert results[0] == 0 and results[2] == 2
+    assert isinstance(results[1], FakeStatusError) and isinstance(results[3], FakeStatusError)
+
+
+def test_dispatch_on_result_sees_every_prompt_without_collecting():
+    seen = {}
+    caller = threading.current_thread()
+
+    def on_result(index, result):
+        assert threading.current_thread() is caller
+        seen[index] = result
+
+    assert dispatch(range(10), lambda prompt: prompt + 1, max_concurrency=3, requests_per_minute=0,
+                    on_result=on_result, collect=False) is None
+    assert seen == {index: index + 1 for index in range(10)}
@@ -0,0 +1,51 @@
+import pytest
+from botocore.exceptions import ClientError
+
+import lob_cache
+
+
+class FakeBody:
+    def __init__(self, data):
+        self.data = data
+
+    def read(self):
+        return self.data
+
+
+class FakeS3:
+    """Serves {lob}.txt with ETag "v1" and answers conditional requests for it with 304."""
+
+    def __init__(self, on_not_modified=None):
+        self.requests = []
+        self.on_not_modified = on_not_modified
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None):
+        self.requests.append((Key, IfNoneMatch))
+        if IfNoneMatch == "v1":
+            if self.on_not_modified is not None:
+                self.on_not_modified()
+            raise ClientError({"Error": {"Code": "304"}, "ResponseMetadata": {"HTTPStatusCode": 304}}, "GetObject")
+        return {"ETag": "v1", "Body": FakeBody(b"State: TX, CA")}
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    lob_cache._cache.clear()
+    yield
+    lob_cache._cache.clear()
+
+
+def test_unchanged_reference_is_revalidated_not_downloaded():
+    s3 = FakeS3()
+    first = lob_cache.get_lob_reference(s3, "lobs", "auto")
+    assert lob_cache.get_lob_reference(s3, "lobs", "auto") is first
+    assert s3.requests == [("auto.txt", None), ("auto.txt", "v1")]
+
+
+def test_not_modified_survives_a_concurrent_eviction():
+    s3 = FakeS3()
+    first = lob_cache.get_lob_reference(s3, "lobs", "auto")
+    # Another thread evicts the entry between the lookup and the 304
+    s3.on_not_modified = lob_cache._cache.clear
+    assert lob_cache.get_lob_reference(s3, "lobs", "auto") is first
+    assert lob_cache._cache[("lobs", "auto")] is first
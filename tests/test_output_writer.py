@@ -0,0 +1,130 @@
+import os
+import time
+
+import moto.s3.models
+import pytest
+
+import output_writer
+from output_writer import MultipartCsvWriter, SpoolCsvWriter, csv_line, expire_checkpoints
+
+
+def object_text(s3, key):
+    return s3.get_object(Bucket="output", Key=key)["Body"].read().decode("utf-8")
+
+
+def open_uploads(s3):
+    return s3.list_multipart_uploads(Bucket="output").get("Uploads", [])
+
+
+def test_multipart_writer_resumes_output_smaller_than_a_part(s3):
+    header = csv_line(["story"])
+    first = MultipartCsvWriter(s3, "output", "out_1.csv", checkpoint_id="job", header=header)
+    for index in (0, 1, 2, 4):
+        first.write(index, csv_line([f"row {index}"]))
+    # The process dies here: nothing was uploaded, but rows 0-2 are in the checkpointed buffer
+
+    resumed = MultipartCsvWriter(s3, "output", "out_2.csv", checkpoint_id="job", header=header)
+    assert resumed.next_row == 3
+    assert resumed.key == "out_1.csv"
+    for index in (3, 4):
+        resumed.write(index, csv_line([f"row {index}"]))
+    assert resumed.close() == 200
+
+    assert object_text(s3, "out_1.csv") == header + "".join(csv_line([f"row {index}"]) for index in range(5))
+    assert os.listdir(output_writer.OUTPUT_CHECKPOINT_DIR) == []
+
+
+def test_multipart_writer_resumes_after_uploaded_parts(s3, monkeypatch):
+    monkeypatch.setattr(moto.s3.models, "S3_UPLOAD_PART_MIN_SIZE", 1)
+    rows = [csv_line([f"row {index}", "x" * 20]) for index in range(10)]
+    first = MultipartCsvWriter(s3, "output", "out.csv", checkpoint_id="job", part_size=64)
+    for index in range(7):
+        first.write(index, rows[index])
+    assert first.parts
+
+    resumed = MultipartCsvWriter(s3, "output", "out.csv", checkpoint_id="job", part_size=64)
+    assert resumed.next_row == 7
+    for index in range(7, 10):
+        resumed.write(index, rows[index])
+    resumed.close()
+    assert object_text(s3, "out.csv") == "".join(rows)
+
+
+def test_multipart_writer_without_checkpoint(s3):
+    writer = MultipartCsvWriter(s3, "output", "out.csv", header="a\n")
+    writer.write(1, "c\n")
+    writer.write(0, "b\n")
+    writer.close()
+    assert object_text(s3, "out.csv") == "a\nb\nc\n"
+
+
+def test_spool_writer_resumes(s3):
+    first = SpoolCsvWriter(s3, "output", "out.csv", checkpoint_id="job", header="h\n")
+    first.write(0, "a\n")
+    first.file.close()
+    resumed = SpoolCsvWriter(s3, "output", "out.csv", checkpoint_id="job", header="h\n")
+    assert resumed.next_row == 1
+    resumed.write(1, "b\n")
+    resumed.close()
+    assert object_text(s3, "out.csv") == "h\na\nb\n"
+
+
+def test_unresumable_checkpoint_aborts_its_upload(s3):
+    MultipartCsvWriter(s3, "output", "out.csv", checkpoint_id="job").write(0, "a\n")
+    assert len(open_uploads(s3)) == 1
+    s3.create_bucket(Bucket="other")
+    MultipartCsvWriter(s3, "other", "out.csv", checkpoint_id="job")
+    assert open_uploads(s3) == []
+
+
+def test_expired_checkpoints_are_dropped_with_their_uploads(s3):
+    MultipartCsvWriter(s3, "output", "old.csv", checkpoint_id="old").write(0, "a\n")
+    MultipartCsvWriter(s3, "output", "new.csv", checkpoint_id="new").write(0, "a\n")
+    stale = time.time() - 3600
+    os.utime(os.path.join(output_writer.OUTPUT_CHECKPOINT_DIR, "old.json"), (stale, stale))
+
+    expire_checkpoints(s3, max_age=60)
+
+    assert [upload["Key"] for upload in open_uploads(s3)] == ["new.csv"]
+    assert sorted(os.listdir(output_writer.OUTPUT_CHECKPOINT_DIR)) == ["new.json", "new.part"]
+
+
+@pytest.mark.parametrize("writer_class", [MultipartCsvWriter, SpoolCsvWriter])
+def test_close_refuses_missing_rows(s3, writer_class):
+    writer = writer_class(s3, "output", "out.csv", checkpoint_id="job")
+    writer.write(1, "b\n")
+    with pytest.raises(ValueError):
+        writer.close()
+
+
+@pytest.mark.parametrize("writer_class", [MultipartCsvWriter, SpoolCsvWriter])
+def test_extra_state_and_journal_are_restored_with_the_rows(s3, writer_class):
+    first = writer_class(s3, "output", "out.csv", checkpoint_id="job")
+    first.extra["round"] = 1
+    first.record("a")
+    first.write(0, "a\n")
+    first.extra["round"] = 2
+    first.record("b")
+
+    resumed = writer_class(s3, "output", "out.csv", checkpoint_id="job")
+    assert resumed.next_row == 1
+    assert resumed.extra == {"round": 1}
+    # Entries recorded after the last checkpoint are dropped with its rows
+    assert resumed.journal == ["a"]
+    resumed.record("c")
+    resumed.write(1, "c\n")
+
+    again = writer_class(s3, "output", "out.csv", checkpoint_id="job")
+    assert again.journal == ["a", "c"]
+    again.close()
+    assert os.listdir(output_writer.OUTPUT_CHECKPOINT_DIR) == []
+
+
+def test_journal_keeps_the_checkpoint_size_constant(s3):
+    writer = MultipartCsvWriter(s3, "output", "out.csv", checkpoint_id="job")
+    sizes = []
+    for row in range(200):
+        writer.record(f"{row:016x}")
+        writer.write(row, f"{row}\n")
+        sizes.append(os.path.getsize(writer.checkpoint_path))
+    assert max(sizes) - min(sizes) < 16
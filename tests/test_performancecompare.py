@@ -0,0 +1,126 @@
+import io
+import json
+
+import numpy as np
+import pytest
+from openpyxl import load_workbook
+
+from performancecomapre import FLATTEN_METRICS, compare_stats, compare_tables, flatten_stats, render_report
+
+
+def node(name, node_type="REQUEST", contents=None, **metrics):
+    stats = {"name": name, **{metric: {"total": value, "ok": value, "ko": 0} for metric, value in metrics.items()}}
+    tree = {"type": node_type, "name": name, "stats": stats}
+    if contents is not None:
+        tree["contents"] = contents
+    return tree
+
+
+def run(login=100, pay=200, extra=None):
+    checkout = {"pay": node("Pay", meanResponseTime=pay, numberOfRequests=10)}
+    if extra is not None:
+        checkout["receipt"] = node("Receipt", meanResponseTime=extra, numberOfRequests=10)
+    return node("All Requests", "GROUP", meanResponseTime=150, numberOfRequests=30, contents={
+        "login": node("Login", meanResponseTime=login, numberOfRequests=20),
+        "checkout": node("Checkout", "GROUP", {"step": node("Step", "GROUP", checkout)}, meanResponseTime=200),
+    })
+
+
+def test_nested_groups_flatten_depth_first_by_key_path():
+    table = flatten_stats(run())
+    assert list(table.index) == ["", "login", "checkout", "checkout/step", "checkout/step/pay"]
+    assert list(table["depth"]) == [0, 1, 1, 2, 3]
+    assert list(table["name"]) == ["All Requests", "Login", "Checkout", "Step", "Pay"]
+    assert list(table["type"]) == ["GROUP", "REQUEST", "GROUP", "GROUP", "REQUEST"]
+    assert table.loc["checkout/step/pay", "meanResponseTime_ok"] == 200
+    assert table.loc["checkout/step/pay", "meanResponseTime_ko"] == 0
+    # Metrics a node does not report are empty
+    assert np.isnan(table.loc["checkout/step", "meanResponseTime_ok"])
+    assert len(table.columns) == 3 + 2 * len(FLATTEN_METRICS)
+
+
+def test_unparseable_values_become_nan():
+    tree = node("All Requests", "GROUP", meanResponseTime=150)
+    tree["stats"]["percentiles4"] = {"total": "-", "ok": "-", "ko": "-"}
+    table = flatten_stats(tree)
+    assert np.isnan(table.loc["", "percentiles4_ok"])
+    assert table.loc["", "meanResponseTime_ok"] == 150
+
+
+def test_compare_marks_missing_and_new_nodes():
+    before = flatten_stats(run(extra=50))
+    after = flatten_stats(run(login=120))
+    after = after.rename(index={"checkout/step/pay": "checkout/step/pay2"})
+    comparison = compare_stats(before, after)
+
+    # Run 1 order first, then nodes only in run 2
+    assert list(comparison.index) == ["", "login", "checkout", "checkout/step", "checkout/step/pay",
+                                      "checkout/step/receipt", "checkout/step/pay2"]
+    assert comparison["status"].to_dict() == {
+        "": "both", "login": "both", "checkout": "both", "checkout/step": "both",
+        "checkout/step/pay": "missing", "checkout/step/receipt": "missing", "checkout/step/pay2": "new",
+    }
+    # Names come from whichever run has the node
+    assert comparison.loc["checkout/step/pay2", "name"] == "Pay"
+    assert comparison.loc["login", "meanResponseTime_ok_delta"] == 20
+    assert comparison.loc["login", "meanResponseTime_ok_pct"] == 20.0
+    assert np.isnan(comparison.loc["checkout/step/pay", "meanResponseTime_ok_2"])
+    assert np.isnan(comparison.loc["checkout/step/pay2", "meanResponseTime_ok_delta"])
+
+
+def test_zero_baselines_have_no_percentage():
+    comparison = compare_stats(flatten_stats(run(login=0, pay=0)), flatten_stats(run(login=0, pay=30)))
+    assert comparison.loc["login", "meanResponseTime_ok_pct"] == 0.0
+    assert np.isnan(comparison.loc["checkout/step/pay", "meanResponseTime_ok_pct"])
+    assert comparison.loc["checkout/step/pay", "meanResponseTime_ok_delta"] == 30
+
+
+@pytest.mark.parametrize("login, pct", [(101, 1.0), (100.0 / 3, -66.67)])
+def test_percentages_are_rounded_to_two_places(login, pct):
+    comparison = compare_stats(flatten_stats(run()), flatten_stats(run(login=login)))
+    assert comparison.loc["login", "meanResponseTime_ok_pct"] == pct
+
+
+def rendered_workbook(comparison, metrics):
+    return load_workbook(io.BytesIO(render_report(comparison, metrics, "xlsx")))
+
+
+def test_xlsx_report_has_a_sheet_per_metric_with_colored_deltas():
+    before = flatten_stats(run(extra=50))
+    after = flatten_stats(run(login=200, pay=100))
+    comparison = compare_tables(before, after, ["meanResponseTime", "percentiles3"])
+    wb = rendered_workbook(comparison, ["meanResponseTime", "percentiles3"])
+
+    assert wb.sheetnames == ["meanResponseTime", "95th Percentile"]
+    rows = list(wb["meanResponseTime"].values)
+    assert rows[0][:5] == ("Transaction Name", "Execution1_OK Value meanResponseTime",
+                           "Execution2_OK Value meanResponseTime", "Delta(Execution2 value - Execution1 value)",
+                           "Delta Percentage %")
+    assert rows[0][8] == "Verdict"
+    by_name = {row[0]: row for row in rows[1:6]}
+    assert by_name["Login"][1:5] == (100, 200, 100, "100.00%")
+    assert by_name["Login"][8] == "fail"
+    assert by_name["Pay"][4] == "-50.00%"
+    assert rows[6][0] == "Key 'checkout/step/receipt' not found in the second Execution."
+
+    sheet = wb["meanResponseTime"]
+    fills = {sheet.cell(row, 1).value: sheet.cell(row, 5).fill.fgColor.rgb for row in range(2, 7)}
+    assert fills["Login"].endswith("E0453A")
+    assert fills["Pay"].endswith("0C880E")
+    assert sheet.cell(1, 4).fill.fgColor.rgb.endswith("D3D0D0")
+
+    summary = {row[0]: row[1] for row in rows[7:]}
+    assert summary["No.Of.Transactions Executed Faster than last run:"] == 1
+    assert summary["No.Of.Transactions Executed Slower than last run:"] == 1
+    assert summary["Verdict:"] == "fail"
+    assert summary["Overall Observation:"] == "Execution 1 performed better overall."
+
+
+def test_tabular_report_formats_skip_the_workbook():
+    comparison = compare_tables(flatten_stats(run()), flatten_stats(run(login=90)), ["meanResponseTime"])
+    payload = json.loads(render_report(comparison, ["meanResponseTime"], "json"))
+    assert payload["verdict"] == "pass"
+    assert [row["key"] for row in payload["transactions"]][:2] == ["", "login"]
+    assert render_report(comparison, ["meanResponseTime"], "csv").decode("utf-8").startswith("key,name,type,depth")
+    with pytest.raises(ValueError):
+        render_report(comparison, ["meanResponseTime"], "pdf")
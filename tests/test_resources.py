@@ -0,0 +1,63 @@
+import threading
+import time
+
+import pytest
+
+import resources
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """Empty resource registry, restored after the test."""
+    for name in ("_loaders", "_resources", "_stats", "_locks"):
+        monkeypatch.setattr(resources, name, {})
+
+
+class FakeLoader:
+    def __init__(self, delay=0.0, error=None):
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return object()
+
+
+def test_get_loads_once_under_concurrent_first_use(registry):
+    loader = FakeLoader(delay=0.05)
+    resources.register("reranker", loader)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(resources.get("reranker"))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert loader.calls == 1
+    assert len(results) == 8 and all(result is results[0] for result in results)
+
+
+def test_warm_loads_named_or_all_resources_and_survives_failures(registry):
+    loaders = {"llm": FakeLoader(), "prompt": FakeLoader(), "broken": FakeLoader(error=RuntimeError("no model"))}
+    for name, loader in loaders.items():
+        resources.register(name, loader)
+
+    resources.warm(["llm"])
+    assert [loader.calls for loader in loaders.values()] == [1, 0, 0]
+    resources.warm(["all"])
+    assert [loader.calls for loader in loaders.values()] == [1, 1, 1]
+    assert resources.stats()["broken"] == {"loaded": False}
+
+
+def test_stats_report_load_time_for_loaded_resources(registry):
+    resources.register("reranker", FakeLoader(delay=0.02))
+    resources.register("defect_llm", FakeLoader())
+    resources.get("reranker")
+    stats = resources.stats()
+    assert stats["defect_llm"] == {"loaded": False}
+    assert stats["reranker"]["loaded"] is True
+    assert stats["reranker"]["load_seconds"] >= 0.02
+    assert "memory_bytes" in stats["reranker"] and "loaded_at" in stats["reranker"]
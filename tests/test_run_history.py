@@ -0,0 +1,79 @@
+import pytest
+
+import run_history
+
+
+@pytest.fixture
+def history(tmp_path, monkeypatch):
+    monkeypatch.setattr(run_history, "RUN_HISTORY_PATH", str(tmp_path / "run_history.db"))
+    return run_history
+
+
+def stats(login, search=100, failed=0):
+    def node(name, value):
+        return {"type": "REQUEST", "name": name,
+                "stats": {"name": name, "percentiles3": {"total": value, "ok": value, "ko": failed}}}
+
+    return {"type": "GROUP", "name": "All Requests", "stats": {"name": "All Requests"},
+            "contents": {"login": node("Login", login), "search": node("Search", search)}}
+
+
+def record(history, values, search=None):
+    """Ingest one run per login value, a minute apart; returns the run ids oldest first.
+
+    The ko values count up, so runs with the same ok values are still distinct.
+    """
+    run_ids = []
+    for position, login in enumerate(values):
+        run_id, _ = history.ingest_run(stats(login, search[position] if search else 100 + position, position),
+                                       started=1000 + 60 * position)
+        run_ids.append(run_id)
+    return run_ids
+
+
+def test_metric_history_is_a_run_by_transaction_matrix(history):
+    run_ids = record(history, [100, 110, 120])
+    matrix = history.metric_history("percentiles3")
+
+    assert list(matrix.index) == run_ids
+    assert list(matrix["login"]) == [100, 110, 120]
+    assert list(matrix["search"]) == [100, 101, 102]
+    # The root has no value for the metric
+    assert "" not in matrix.columns
+
+    recent = history.metric_history("percentiles3", limit=2, keys=["login"])
+    assert list(recent.index) == run_ids[1:]
+    assert list(recent.columns) == ["login"]
+    assert history.metric_history("percentiles3", side="ko")["login"].tolist() == [0, 1, 2]
+
+
+def test_regressions_flag_runs_far_above_the_rolling_baseline(history):
+    run_ids = record(history, [100, 102, 98, 101, 99, 150])
+    result = history.regressions("percentiles3", window=5, min_runs=3, sigma=3, min_change=10)
+    login = result[result["key"] == "login"].set_index("run_id")
+
+    # Too few runs before the third for a baseline
+    assert login.loc[run_ids[:3], "baseline"].isna().all()
+    assert login.loc[run_ids[5], "baseline"] == 100
+    assert login.loc[run_ids[5], "change_pct"] == 50.0
+    assert login["regression"].tolist() == [False] * 5 + [True]
+    # Search creeps up by 1 a run: above its spread but under min_change
+    assert not result[result["key"] == "search"]["regression"].any()
+
+
+def test_a_single_run_baseline_can_flag_a_regression(history):
+    run_ids = record(history, [100, 130, 131], search=[100, 100, 100])
+    result = history.regressions("percentiles3", window=1, min_runs=1, sigma=3, min_change=10)
+    login = result[result["key"] == "login"].set_index("run_id")
+
+    assert login.loc[run_ids[1], "baseline_std"] == 0
+    assert login["regression"].tolist() == [False, True, False]
+    assert not result[result["key"] == "search"]["regression"].any()
+
+
+def test_a_flat_baseline_flags_any_change_beyond_min_change(history):
+    record(history, [100, 100, 100, 115], search=[100, 100, 100, 105])
+    result = history.regressions("percentiles3", window=3, min_runs=3, sigma=3, min_change=10)
+    flagged = result.groupby("key")["regression"].apply(list)
+    assert flagged["login"] == [False, False, False, True]
+    assert flagged["search"] == [False, False, False, False]
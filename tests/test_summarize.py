@@ -0,0 +1,153 @@
+import functools
+import json
+
+import pytest
+
+pytest.importorskip("google.generativeai")
+
+import llm_dispatcher
+import summarize_new
+from llm_dispatcher import AdaptiveTokenBucket, FakeModel, FakeStatusError
+from table_store import read_table
+
+
+def batch_items(prompt):
+    """The JSON array of summaries a batch prompt carries, or None for a single-summary prompt."""
+    start = prompt.find("\n[")
+    return json.loads(prompt[start + 1:]) if start != -1 else None
+
+
+def answering(garbage_batches=False):
+    """FakeModel answering batch prompts with a JSON array (or prose) and single prompts with text."""
+
+    def respond(prompt):
+        items = batch_items(prompt)
+        if items is None:
+            return "single: " + prompt.split(": ", 1)[1].split(". Summarize", 1)[0]
+        if garbage_batches:
+            return "Sure! Here are your summaries."
+        return json.dumps([f"batch: {item}" for item in items])
+
+    return FakeModel(respond=respond)
+
+
+def test_unusable_batch_answers_are_split_and_not_cached(llm_cache_path, monkeypatch):
+    monkeypatch.setattr(summarize_new, "model", answering(garbage_batches=True))
+    assert summarize_new.summarize_batch(["a", "b"]) == ["single: a", "single: b"]
+
+    # A rerun asks for the batch again instead of replaying the unusable answer
+    fixed = answering()
+    monkeypatch.setattr(summarize_new, "model", fixed)
+    assert summarize_new.summarize_batch(["a", "b"]) == ["batch: a", "batch: b"]
+    assert fixed.calls == 1
+    assert summarize_new.summarize_batch(["a", "b"]) == ["batch: a", "batch: b"]
+    assert fixed.calls == 1
+
+
+class Killed(BaseException):
+    """Stands in for the worker being killed; not an Exception, so nothing on the way catches it."""
+
+
+EXPORT = "Summary,Issue key,Issue id,Project name,Assignee,Components,abstract\n" + "".join(
+    f"Defect {n},QA-{n},{n},Portal,Ann,UI,{abstract}\n"
+    for n, abstract in enumerate(["", "done before", "  ", "", "", "", "also done", "", "", ""]))
+# Rows whose abstract is empty or blank
+TODO = [0, 2, 3, 4, 5, 7, 8, 9]
+
+
+@pytest.fixture
+def summarize_env(tmp_path, monkeypatch):
+    monkeypatch.setattr(summarize_new, "UPLOAD_FOLDER", str(tmp_path / "upload"))
+    monkeypatch.setattr(summarize_new, "OUTPUT_CHECKPOINT_DIR", str(tmp_path / "checkpoints"))
+    monkeypatch.setattr(summarize_new, "SUMMARIZE_MAX_CONCURRENCY", 1)
+    monkeypatch.setattr(summarize_new, "plan_batches", functools.partial(summarize_new.plan_batches, max_items=2))
+    monkeypatch.setattr(llm_dispatcher, "LLM_REQUESTS_PER_MINUTE", 0)
+    monkeypatch.setattr(llm_dispatcher, "LLM_BACKOFF_BASE", 0.0)
+    (tmp_path / "upload").mkdir()
+    file_path = tmp_path / "defects.csv"
+    file_path.write_text(EXPORT, encoding="utf-8")
+    return str(file_path)
+
+
+def recording(prompts, fail=None):
+    """FakeModel that records its prompts and calls fail(call number) before answering."""
+
+    def respond(prompt):
+        prompts.append(prompt)
+        if fail is not None:
+            fail(len(prompts))
+        return answering().respond(prompt)
+
+    return FakeModel(respond=respond)
+
+
+def asked(prompts):
+    return [item for prompt in prompts for item in batch_items(prompt)]
+
+
+def abstracts(file_path):
+    df = read_table(file_path)
+    return dict(zip(df["Summary"], df["abstract"]))
+
+
+def test_killed_run_resumes_from_the_partial_file(summarize_env, tmp_path, monkeypatch):
+    def kill_third_call(call):
+        if call == 3:
+            raise Killed()
+
+    prompts = []
+    monkeypatch.setattr(summarize_new, "model", recording(prompts, kill_third_call))
+    with pytest.raises(Killed):
+        summarize_new.summarize_and_store_locally(summarize_env, "csv", use_cache=False)
+    # Only rows with an empty or blank abstract are sent, two per prompt
+    assert asked(prompts[:2]) == [f"Defect {n}" for n in TODO[:4]]
+    assert len(list((tmp_path / "checkpoints").glob("*.partial.csv"))) == 1
+
+    resumed = []
+    reports = []
+    monkeypatch.setattr(summarize_new, "model", recording(resumed))
+    output = summarize_new.summarize_and_store_locally(summarize_env, "csv", use_cache=False,
+                                                       progress=lambda done, total: reports.append((done, total)))
+
+    assert asked(resumed) == [f"Defect {n}" for n in TODO[4:]]
+    assert reports[-1] == (4, 4)
+    result = abstracts(output)
+    assert (result["Defect 1"], result["Defect 6"]) == ("done before", "also done")
+    assert [result[f"Defect {n}"] for n in TODO] == [f"batch: Defect {n}" for n in TODO]
+    assert list((tmp_path / "checkpoints").iterdir()) == []
+
+
+def test_throttled_calls_slow_the_adaptive_limiter_and_still_finish(summarize_env, monkeypatch):
+    def throttle_first_two(call):
+        if call <= 2:
+            raise FakeStatusError(429)
+
+    rates = []
+    on_throttle = AdaptiveTokenBucket.on_throttle
+
+    def recorded_throttle(bucket):
+        on_throttle(bucket)
+        rates.append(bucket.rate * 60)
+
+    monkeypatch.setattr(AdaptiveTokenBucket, "on_throttle", recorded_throttle)
+    monkeypatch.setattr(llm_dispatcher, "LLM_REQUESTS_PER_MINUTE", 60000)
+    prompts = []
+    monkeypatch.setattr(summarize_new, "model", recording(prompts, throttle_first_two))
+    output = summarize_new.summarize_and_store_locally(summarize_env, "csv", use_cache=False)
+
+    assert rates == [30000, 15000]
+    assert len(prompts) == 2 + len(TODO) // 2
+    result = abstracts(output)
+    assert [result[f"Defect {n}"] for n in TODO] == [f"batch: Defect {n}" for n in TODO]
+
+
+def test_failed_batches_are_marked_in_the_output(summarize_env, tmp_path, monkeypatch):
+    def reject_first(call):
+        if call == 1:
+            raise ValueError("blocked by safety filters")
+
+    monkeypatch.setattr(summarize_new, "model", recording([], reject_first))
+    output = summarize_new.summarize_and_store_locally(summarize_env, "csv", use_cache=False)
+    result = abstracts(output)
+    assert [result[f"Defect {n}"] for n in TODO[:2]] == [summarize_new.SUMMARIZATION_ERROR] * 2
+    assert result["Defect 3"] == "batch: Defect 3"
@@ -0,0 +1,48 @@
+import csv
+import hashlib
+
+import pandas as pd
+
+from table_store import DEFECT_COLUMNS, read_table, row_texts, write_table
+
+EXPORT = (
+    "Summary,Issue key,Issue id,Project name,Assignee,Components,abstract\n"
+    "Login fails,QA-1,123,Portal,Ann,Auth,Login broken\n"
+    "Page blank,QA-2,,Portal,,UI,\n"
+    "\"Quote, comma\",QA-3,125,NA,nan,UI,Totals off\n"
+)
+
+
+def csv_loader_texts(file_path):
+    """Page content as langchain's CSVLoader builds it: csv.DictReader rows as "column: value" lines."""
+    with open(file_path, newline="", encoding="utf-8") as f:
+        return ["\n".join(f"{column.strip()}: {value.strip() if value is not None else value}"
+                          for column, value in row.items())
+                for row in csv.DictReader(f)]
+
+
+def chunk_ids(texts):
+    return [hashlib.sha256(text.encode("utf-8")).hexdigest() for text in texts]
+
+
+def test_csv_rows_keep_the_chunk_ids_of_csv_loader(tmp_path):
+    file_path = tmp_path / "summarized.csv"
+    file_path.write_text(EXPORT, encoding="utf-8")
+    texts = row_texts(read_table(str(file_path), columns=DEFECT_COLUMNS))
+    assert texts[1].splitlines()[2] == "Issue id: "
+    assert "Project name: NA" in texts[2] and "Assignee: nan" in texts[2]
+    assert chunk_ids(texts) == chunk_ids(csv_loader_texts(str(file_path)))
+
+
+def test_csv_reads_only_the_wanted_columns_that_exist(tmp_path):
+    file_path = tmp_path / "export.csv"
+    file_path.write_text(EXPORT, encoding="utf-8")
+    df = read_table(str(file_path), columns=["Issue id", "Missing", "Summary", "Issue id"])
+    assert list(df.columns) == ["Issue id", "Summary"]
+    assert df["Issue id"].tolist() == ["123", "", "125"]
+
+
+def test_parquet_round_trip(tmp_path):
+    df = pd.DataFrame({"Summary": ["a", "b"], "Assignee": ["Ann", "Ann"], "Issue id": ["1", "2"]})
+    file_path = write_table(df, str(tmp_path / "table.parquet"))
+    assert row_texts(read_table(file_path)) == row_texts(df)
@@ -0,0 +1,81 @@
+import csv
+import glob
+import io
+import json
+import os
+
+import pytest
+
+pytest.importorskip("google.generativeai")
+
+import aws_s3
+import llm_dispatcher
+import output_writer
+
+HEADER = ["policy", "state", "premium"]
+
+
+class FlakyModel:
+    """Answers round r with rows r*7 .. r*7+9, so consecutive rounds share three rows."""
+
+    def __init__(self, fail_round=None):
+        self.fail_round = fail_round
+        self.rounds = []
+
+    def __call__(self, model, prompt, use_cache=True, variant=None):
+        self.rounds.append(variant)
+        if variant == self.fail_round:
+            raise RuntimeError("worker killed")
+        rows = [HEADER] + [[f"P{n}", "TX", str(100 + n)] for n in range(variant * 7, variant * 7 + 10)]
+        return "```csv\n" + "\n".join(",".join(row) for row in rows) + "\n```"
+
+
+@pytest.fixture
+def test_data_env(s3, monkeypatch):
+    s3.create_bucket(Bucket="lobs")
+    s3.put_object(Bucket="lobs", Key="auto.txt", Body=b"Premium: 100, 200\nState: TX, CA")
+    monkeypatch.setattr(aws_s3, "s3_client", s3)
+    monkeypatch.setattr(aws_s3, "AWS_LOB_FILES", "lobs")
+    monkeypatch.setattr(aws_s3, "AWS_TEST_OUTPUT_BUCKET", "output")
+    monkeypatch.setattr(aws_s3, "TEST_DATA_MAX_CONCURRENCY", 1)
+    monkeypatch.setattr(llm_dispatcher, "LLM_REQUESTS_PER_MINUTE", 0)
+    return s3
+
+
+def output_rows(s3):
+    (item,) = s3.list_objects_v2(Bucket="output")["Contents"]
+    body = s3.get_object(Bucket="output", Key=item["Key"])["Body"].read().decode("utf-8")
+    return list(csv.reader(io.StringIO(body)))
+
+
+def test_resumed_test_data_has_no_duplicate_rows(test_data_env, monkeypatch):
+    crashing = FlakyModel(fail_round=3)
+    monkeypatch.setattr(aws_s3, "cached_send", crashing)
+    with pytest.raises(RuntimeError):
+        aws_s3.generate_test_data("auto", "TX", 40)
+    assert crashing.rounds == [0, 1, 2, 3]
+    # Row hashes live in the journal, so the checkpoint does not grow with the rows
+    (checkpoint,) = glob.glob(os.path.join(output_writer.OUTPUT_CHECKPOINT_DIR, "*.json"))
+    with open(checkpoint) as f:
+        assert set(json.load(f)["extra"]) == {"header", "round"}
+
+    resumed = FlakyModel()
+    monkeypatch.setattr(aws_s3, "cached_send", resumed)
+    assert aws_s3.generate_test_data("auto", "TX", 40).endswith(".csv")
+    # Round 0 is not replayed and round numbering continues after the last accepted round
+    assert resumed.rounds[0] == 3
+
+    rows = output_rows(test_data_env)
+    assert rows[0] == HEADER
+    assert len(rows) == 41
+    assert len({tuple(row) for row in rows[1:]}) == 40
+    assert [row[0] for row in rows[1:]] == [f"P{n}" for n in range(40)]
+
+
+def test_test_data_without_resume(test_data_env, monkeypatch):
+    model = FlakyModel()
+    monkeypatch.setattr(aws_s3, "cached_send", model)
+    aws_s3.generate_test_data("auto", "TX", 15)
+    rows = output_rows(test_data_env)
+    assert rows[0] == HEADER
+    assert [row[0] for row in rows[1:]] == [f"P{n}" for n in range(15)]